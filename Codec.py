@@ -0,0 +1,297 @@
+import json
+import struct
+
+# Wire formats. Every frame is a 4 byte big-endian body length followed by a
+# 1 byte format and the body.
+#   FORMAT_JSON - body is the JSON encoded message
+#   FORMAT_TLV  - body is a sequence of type-length-value fields (see encodeTLV)
+# Peers that predate framing send bare JSON; their first byte is always '{',
+# which as a length prefix would mean a >2GB frame, so it is unambiguous.
+FORMAT_JSON = 0
+FORMAT_TLV = 1
+LEGACY_JSON = 'json'
+FRAMED_TLV = 'tlv'
+FRAMED_JSON = 'framed-json'
+WIRE_FORMATS = [FRAMED_TLV, FRAMED_JSON, LEGACY_JSON]
+
+MAX_FRAME = 16 * 1024 * 1024
+
+FRAME_HEADER = struct.Struct('!IB')
+FIELD_HEADER = struct.Struct('!BBH')
+DOUBLE = struct.Struct('!d')
+LONG = struct.Struct('!q')
+# Ints outside a signed 64-bit long are sent as JSON
+LONG_MIN = -2 ** 63
+LONG_MAX = 2 ** 63 - 1
+
+# Value kinds
+K_STR = 1
+K_FLOAT = 2
+K_INT = 3
+K_NONE = 4
+K_JSON = 5
+K_BYTES = 6
+
+# Field tags. Envelope fields and known content fields get a single byte;
+# anything else is sent as TAG_EXT followed by its key as a string field.
+TAG_ID = 1
+TAG_TYPE = 2
+TAG_TTL = 3
+TAG_CONTENT_END = 4
+TAG_EXT = 255
+CONTENT_TAGS = {
+    'data_name': 10,
+    'data_val': 11,
+    'time_to_use': 12,
+    'location': 13,
+    'location_name': 14,
+    'time_to_wait': 15,
+    'port': 16,
+    'fallback': 17,
+    'data_names': 18,
+    'items': 19,
+    'mac': 20,
+    'reason': 21,
+    'nonce': 22,
+}
+CONTENT_KEYS = {v: k for k, v in CONTENT_TAGS.items()}
+# Messages forwarders pass on with only these content fields changed. Their
+# other content fields are kept encoded when decoded (see RawContent).
+RAW_TYPES = ('DATA',)
+PATCHED_FIELDS = ('location',)
+PATCHED_TAGS = tuple(CONTENT_TAGS[k] for k in PATCHED_FIELDS)
+
+# Message types are sent as a single byte code
+MSG_TYPES = ['ANNOUNCE', 'ACKNOWLEDGE', 'REQUEST', 'DIRECT_REQUEST', 'FAIL', 'DATA', 'BATCH_REQUEST', 'BATCH_DATA', 'SUBSCRIBE']
+MSG_CODES = {t: i for i, t in enumerate(MSG_TYPES)}
+
+
+class CodecError(Exception):
+    pass
+
+
+def _packValue(out, tag, value):
+    if isinstance(value, str):
+        raw = value.encode()
+        kind = K_STR
+    elif isinstance(value, (bytes, bytearray)):
+        raw = bytes(value)
+        kind = K_BYTES
+    elif value is None:
+        raw = b''
+        kind = K_NONE
+    elif isinstance(value, bool):
+        raw = json.dumps(value).encode()
+        kind = K_JSON
+    elif isinstance(value, int) and LONG_MIN <= value <= LONG_MAX:
+        raw = LONG.pack(value)
+        kind = K_INT
+    elif isinstance(value, float):
+        raw = DOUBLE.pack(value)
+        kind = K_FLOAT
+    else:
+        raw = json.dumps(value).encode()
+        kind = K_JSON
+    if len(raw) > 0xFFFF:
+        raise CodecError(f"Field {tag} too large ({len(raw)} bytes)")
+    out += FIELD_HEADER.pack(tag, kind, len(raw))
+    out += raw
+
+
+def _unpackValue(buf, kind, offset, length):
+    if kind == K_STR:
+        return str(buf[offset:offset + length], 'utf-8')
+    elif kind == K_FLOAT:
+        return DOUBLE.unpack_from(buf, offset)[0]
+    elif kind == K_INT:
+        return LONG.unpack_from(buf, offset)[0]
+    elif kind == K_NONE:
+        return None
+    elif kind == K_BYTES:
+        return bytes(buf[offset:offset + length])
+    elif kind == K_JSON:
+        return json.loads(str(buf[offset:offset + length], 'utf-8'))
+    raise CodecError(f"Unknown value kind {kind}")
+
+
+# Encodes a message {id, type, content, ttl} as TLV fields. The message type is
+# a single byte and content keys are flattened into the same field list.
+# fields are content fields already encoded (eg as received), sent as they
+# are in place of every content key but those in PATCHED_FIELDS.
+def encodeTLV(msg, fields=None):
+    out = bytearray()
+    _packValue(out, TAG_ID, msg['id'])
+    msg_type = msg['type']
+    _packValue(out, TAG_TYPE, MSG_CODES.get(msg_type, msg_type))
+    _packValue(out, TAG_TTL, msg['ttl'])
+    content = msg['content']
+    if fields is not None:
+        out += fields
+        for k in PATCHED_FIELDS:
+            if k in content:
+                _packValue(out, CONTENT_TAGS[k], content[k])
+    elif isinstance(content, dict):
+        for k, v in content.items():
+            tag = CONTENT_TAGS.get(k)
+            if tag is None:
+                _packValue(out, TAG_EXT, k)
+                tag = TAG_EXT
+            _packValue(out, tag, v)
+    else:
+        _packValue(out, TAG_CONTENT_END, content)
+    return out
+
+
+# Content of a decoded RAW_TYPES message, which also keeps its encoded content
+# fields (but those in PATCHED_FIELDS) so a forwarder can send them on as they are
+class RawContent(dict):
+    def __init__(self, content, fields):
+        super().__init__(content)
+        self.fields = fields
+
+
+# Decodes TLV fields from buf[offset:end] without copying the body
+def decodeTLV(buf, offset, end):
+    msg = {'content': {}}
+    content = msg['content']
+    ext_key = None
+    # (start, end) of the content fields a forwarder could keep
+    kept = []
+    while offset < end:
+        start = offset
+        tag, kind, length = FIELD_HEADER.unpack_from(buf, offset)
+        offset += FIELD_HEADER.size
+        if offset + length > end:
+            raise CodecError("Truncated field")
+        value = _unpackValue(buf, kind, offset, length)
+        offset += length
+        if tag > TAG_CONTENT_END and tag not in PATCHED_TAGS:
+            if kept and kept[-1][1] == start:
+                kept[-1] = (kept[-1][0], offset)
+            else:
+                kept.append((start, offset))
+        if tag == TAG_ID:
+            msg['id'] = value
+        elif tag == TAG_TYPE:
+            msg['type'] = MSG_TYPES[value] if isinstance(value, int) else value
+        elif tag == TAG_TTL:
+            msg['ttl'] = value
+        elif tag == TAG_CONTENT_END:
+            msg['content'] = value
+        elif tag == TAG_EXT:
+            if ext_key is None:
+                ext_key = value
+            else:
+                content[ext_key] = value
+                ext_key = None
+        else:
+            content[CONTENT_KEYS[tag]] = value
+    if msg.get('type') in RAW_TYPES and msg['content'] is content:
+        msg['content'] = RawContent(content, b''.join(bytes(buf[s:e]) for s, e in kept))
+    return msg
+
+
+def encodeFrame(msg, wire_format=FRAMED_TLV):
+    if isinstance(msg, EncodedMessage):
+        return msg.frame(wire_format)
+    return _encodeFrame(msg, wire_format)
+
+
+def _encodeFrame(msg, wire_format, fields=None):
+    if wire_format == LEGACY_JSON:
+        return json.dumps(dict(msg, content=json.dumps(msg['content']))).encode()
+    if wire_format == FRAMED_JSON:
+        body = json.dumps(msg).encode()
+        fmt = FORMAT_JSON
+    else:
+        body = encodeTLV(msg, fields)
+        fmt = FORMAT_TLV
+    return FRAME_HEADER.pack(len(body), fmt) + body
+
+
+# A message sent unchanged many times (eg a producer's DATA for the current
+# sensor value, or a request flooded to every peer). Its frame for each wire
+# format is encoded once and the same bytes are written to every connection.
+# It must not be changed once sent. fields, the RawContent.fields of the
+# message being forwarded, are reused in TLV frames.
+class EncodedMessage(dict):
+    def __init__(self, msg, fields=None):
+        super().__init__(msg)
+        self.fields = fields
+        self.frames = {}
+
+    def frame(self, wire_format):
+        frame = self.frames.get(wire_format)
+        if frame is None:
+            frame = self.frames[wire_format] = _encodeFrame(self, wire_format, self.fields)
+        return frame
+
+
+# Incremental decoder for a single connection. Bytes are appended to one
+# reusable buffer and complete frames are decoded in place.
+class FrameDecoder:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.legacy = False
+
+    def feed(self, data):
+        self.buffer += data
+        msgs = []
+        buf = self.buffer
+        if not self.legacy and buf[:1] == b'{':
+            self.legacy = True
+        if self.legacy:
+            return self._feedLegacy()
+        view = memoryview(buf)
+        offset = 0
+        try:
+            while len(buf) - offset >= FRAME_HEADER.size:
+                length, fmt = FRAME_HEADER.unpack_from(view, offset)
+                if length > MAX_FRAME:
+                    raise CodecError(f"Frame of {length} bytes exceeds limit")
+                start = offset + FRAME_HEADER.size
+                end = start + length
+                if end > len(buf):
+                    break
+                if fmt == FORMAT_TLV:
+                    msgs.append(decodeTLV(view, start, end))
+                elif fmt == FORMAT_JSON:
+                    msgs.append(json.loads(str(view[start:end], 'utf-8')))
+                else:
+                    raise CodecError(f"Unknown frame format {fmt}")
+                offset = end
+        finally:
+            view.release()
+        if offset:
+            del buf[:offset]
+        return msgs
+
+    # Bare JSON peers: split concatenated objects with raw_decode. Their
+    # content is itself a JSON string, so it is decoded here as well. A read
+    # may end part way through a multibyte character, which is left in the
+    # buffer for the next one.
+    def _feedLegacy(self):
+        msgs = []
+        try:
+            text = self.buffer.decode('utf-8')
+        except UnicodeDecodeError as e:
+            if e.reason != 'unexpected end of data':
+                raise CodecError(f"Invalid UTF-8 at byte {e.start}")
+            text = self.buffer[:e.start].decode('utf-8')
+        decoder = json.JSONDecoder()
+        idx = 0
+        while idx < len(text):
+            try:
+                msg, end = decoder.raw_decode(text, idx)
+            except ValueError:
+                break
+            if isinstance(msg.get('content'), str):
+                msg['content'] = json.loads(msg['content'])
+            msgs.append(msg)
+            idx = end
+            while idx < len(text) and text[idx].isspace():
+                idx += 1
+        # idx counts characters; the buffer holds bytes
+        if idx:
+            del self.buffer[:len(text[:idx].encode('utf-8'))]
+        return msgs
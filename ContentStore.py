@@ -0,0 +1,414 @@
+from collections import OrderedDict
+from time import time
+import heapq
+import random
+
+# Content Store replacement policies
+LRU = 'lru'
+LFU = 'lfu'
+ARC = 'arc'
+WTINYLFU = 'wtinylfu'
+POLICIES = [LRU, LFU, ARC, WTINYLFU]
+
+
+# Least recently used key of an OrderedDict, skipping one key
+def _oldest(entries, skip=None):
+    for k in entries:
+        if k != skip:
+            return k
+    return None
+
+
+# Signed data is cached as (data_val, mac)
+def entrySize(data_val):
+    if isinstance(data_val, tuple):
+        return sum(entrySize(v) for v in data_val if v is not None)
+    return len(data_val) if isinstance(data_val, (str, bytes, bytearray)) else len(str(data_val))
+
+
+# Admits everything
+class AlwaysAdmit:
+    def admit(self, data_name):
+        return True
+
+    def __str__(self):
+        return 'always'
+
+
+# Cache-less-for-more style admission: each node caches only a fraction of the
+# Data passing through it, so one-hit wonders rarely displace hot entries and
+# copies spread out along the path instead of sitting at every hop
+class ProbabilisticAdmission:
+    def __init__(self, probability, rng=None):
+        self.probability = probability
+        self.rng = rng or random.Random()
+
+    def admit(self, data_name):
+        return self.rng.random() < self.probability
+
+    def __str__(self):
+        return f'prob({self.probability})'
+
+
+# Base Content Store. Tracks values, time to use (via a min-heap like
+# TLRU_Table) and byte usage; subclasses only decide what to evict. Capacity is
+# max_entries entries and, if set, max_bytes bytes of data values.
+class ContentStore:
+    def __init__(self, max_entries, max_bytes=None, admission=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.admission = admission or AlwaysAdmit()
+        self.vals = {}
+        self.times = {}
+        self.sizes = {}
+        self.bytes = 0
+        self.expiry = []
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def contains(self, data_name):
+        self.evaluateTTU()
+        self.recordAccess(data_name)
+        if data_name in self.vals:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def get(self, data_name):
+        self.touch(data_name)
+        return self.vals[data_name], self.times[data_name]
+
+    # admit=False skips admission (eg for entries reloaded from a snapshot)
+    def add(self, data_name, data_val, ttu=32500000000, admit=True):
+        if time() > ttu:
+            return
+        self.evaluateTTU()
+        if data_name in self.vals:
+            if ttu < self.times[data_name]:
+                return
+            self.bytes -= self.sizes[data_name]
+            self.touch(data_name)
+        else:
+            if admit and (not self.admission.admit(data_name) or not self.admit(data_name)):
+                self.rejected += 1
+                return
+            self.insert(data_name)
+        size = entrySize(data_val)
+        self.vals[data_name] = data_val
+        self.sizes[data_name] = size
+        self.bytes += size
+        if self.times.get(data_name) != ttu:
+            heapq.heappush(self.expiry, (ttu, data_name))
+        self.times[data_name] = ttu
+        while self.overBudget():
+            victim = self.victim()
+            if victim is None:
+                break
+            self.drop(victim)
+            self.evicted += 1
+
+    def remove(self, data_name):
+        if data_name in self.vals:
+            val = self.vals[data_name]
+            self.drop(data_name)
+            return val, 0
+        return None, -1
+
+    def overBudget(self):
+        return len(self.vals) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes)
+
+    def drop(self, data_name):
+        self.discard(data_name)
+        self.vals.pop(data_name)
+        self.times.pop(data_name)
+        self.bytes -= self.sizes.pop(data_name)
+
+    def evaluateTTU(self):
+        now = time()
+        while self.expiry and self.expiry[0][0] < now:
+            use_time, data_name = heapq.heappop(self.expiry)
+            if self.times.get(data_name) == use_time:
+                self.drop(data_name)
+                self.expired += 1
+        if len(self.expiry) > 2 * len(self.times) + 16:
+            self.expiry = [(t, k) for k, t in self.times.items()]
+            heapq.heapify(self.expiry)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'policy': self.policy,
+            'admission': str(self.admission),
+            'entries': len(self.vals),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'rejected': self.rejected,
+            'evicted': self.evicted,
+            'expired': self.expired,
+        }
+
+    # Policy hooks
+    def recordAccess(self, data_name):
+        pass
+
+    def admit(self, data_name):
+        return True
+
+    def insert(self, data_name):
+        raise NotImplementedError
+
+    def touch(self, data_name):
+        raise NotImplementedError
+
+    def victim(self):
+        raise NotImplementedError
+
+    def discard(self, data_name):
+        raise NotImplementedError
+
+    def __len__(self):
+        return len(self.vals)
+
+    def __str__(self):
+        return str(self.vals)
+
+    def __iter__(self):
+        return iter(self.vals)
+
+
+class LRUStore(ContentStore):
+    policy = LRU
+
+    def __init__(self, max_entries, max_bytes=None, admission=None):
+        super().__init__(max_entries, max_bytes, admission)
+        self.order = OrderedDict()
+
+    def insert(self, data_name):
+        self.order[data_name] = None
+
+    def touch(self, data_name):
+        self.order.move_to_end(data_name)
+
+    def victim(self):
+        return next(iter(self.order), None)
+
+    def discard(self, data_name):
+        self.order.pop(data_name, None)
+
+
+# Least frequently used, ties broken by LRU. Frequencies are kept in buckets so
+# every operation is O(1).
+class LFUStore(ContentStore):
+    policy = LFU
+
+    def __init__(self, max_entries, max_bytes=None, admission=None):
+        super().__init__(max_entries, max_bytes, admission)
+        self.freq = {}
+        self.buckets = {}
+        self.min_freq = 0
+
+    def insert(self, data_name):
+        self.freq[data_name] = 1
+        self.buckets.setdefault(1, OrderedDict())[data_name] = None
+        self.min_freq = 1
+
+    def touch(self, data_name):
+        f = self.freq[data_name]
+        bucket = self.buckets[f]
+        del bucket[data_name]
+        if not bucket:
+            del self.buckets[f]
+            if self.min_freq == f:
+                self.min_freq = f + 1
+        self.freq[data_name] = f + 1
+        self.buckets.setdefault(f + 1, OrderedDict())[data_name] = None
+
+    def victim(self):
+        if not self.freq:
+            return None
+        if self.min_freq not in self.buckets:
+            self.min_freq = min(self.buckets)
+        return next(iter(self.buckets[self.min_freq]))
+
+    def discard(self, data_name):
+        f = self.freq.pop(data_name)
+        bucket = self.buckets[f]
+        del bucket[data_name]
+        if not bucket:
+            del self.buckets[f]
+
+
+# Adaptive Replacement Cache (Megiddo & Modha). T1 holds names seen once, T2
+# names seen again; ghost lists B1/B2 remember recent evictions and move the
+# target size p of T1 towards whichever list is producing hits.
+class ARCStore(ContentStore):
+    policy = ARC
+
+    def __init__(self, max_entries, max_bytes=None, admission=None):
+        super().__init__(max_entries, max_bytes, admission)
+        self.t1 = OrderedDict()
+        self.t2 = OrderedDict()
+        self.b1 = OrderedDict()
+        self.b2 = OrderedDict()
+        self.p = 0
+        self.incoming = None
+        self.incoming_b2 = False
+
+    def insert(self, data_name):
+        c = self.max_entries
+        self.incoming = data_name
+        self.incoming_b2 = data_name in self.b2
+        if data_name in self.b1:
+            self.p = min(c, self.p + max(len(self.b2) // max(len(self.b1), 1), 1))
+            del self.b1[data_name]
+            self.t2[data_name] = None
+        elif data_name in self.b2:
+            self.p = max(0, self.p - max(len(self.b1) // max(len(self.b2), 1), 1))
+            del self.b2[data_name]
+            self.t2[data_name] = None
+        else:
+            self.t1[data_name] = None
+
+    def touch(self, data_name):
+        if data_name in self.t1:
+            del self.t1[data_name]
+        self.t2[data_name] = None
+        self.t2.move_to_end(data_name)
+
+    def victim(self):
+        t1 = _oldest(self.t1, self.incoming)
+        t2 = _oldest(self.t2, self.incoming)
+        if t1 is not None and (len(self.t1) > self.p or (self.incoming_b2 and len(self.t1) == self.p) or t2 is None):
+            return t1
+        return t2 if t2 is not None else t1
+
+    def discard(self, data_name):
+        if data_name in self.t1:
+            del self.t1[data_name]
+            self.b1[data_name] = None
+        elif data_name in self.t2:
+            del self.t2[data_name]
+            self.b2[data_name] = None
+        c = self.max_entries
+        while len(self.b1) > c:
+            self.b1.popitem(last=False)
+        while len(self.b2) > c:
+            self.b2.popitem(last=False)
+
+
+# Count-min sketch with periodic halving, used by W-TinyLFU to estimate how
+# often a name has been requested recently. Each row indexes by the top bits
+# of a 64-bit multiply-shift hash with its own odd multiplier, so rows collide
+# independently of each other.
+class FrequencySketch:
+    DEPTH = 4
+    SEEDS = [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93]
+    MASK64 = (1 << 64) - 1
+
+    def __init__(self, capacity):
+        width = 16
+        while width < capacity * 4:
+            width *= 2
+        self.shift = 64 - (width.bit_length() - 1)
+        self.table = [[0] * width for _ in range(self.DEPTH)]
+        self.sample_size = 10 * max(capacity, 1)
+        self.additions = 0
+
+    def indexes(self, key):
+        h = hash(key) & self.MASK64
+        return [(h * seed & self.MASK64) >> self.shift for seed in self.SEEDS]
+
+    def increment(self, key):
+        for row, i in zip(self.table, self.indexes(key)):
+            if row[i] < 15:
+                row[i] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.reset()
+
+    def frequency(self, key):
+        return min(row[i] for row, i in zip(self.table, self.indexes(key)))
+
+    def reset(self):
+        for row in self.table:
+            for i in range(len(row)):
+                row[i] >>= 1
+        self.additions //= 2
+
+
+# W-TinyLFU (Einziger et al.): a small LRU window admits new names, which then
+# compete with the main segmented LRU's probation victim on estimated
+# frequency, so names requested once never displace popular ones
+class WTinyLFUStore(ContentStore):
+    policy = WTINYLFU
+    WINDOW_SHARE = 0.01
+    PROTECTED_SHARE = 0.8
+
+    def __init__(self, max_entries, max_bytes=None, admission=None):
+        super().__init__(max_entries, max_bytes, admission)
+        self.window_size = max(1, int(max_entries * self.WINDOW_SHARE))
+        self.protected_size = max(1, int((max_entries - self.window_size) * self.PROTECTED_SHARE))
+        self.window = OrderedDict()
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        self.sketch = FrequencySketch(max_entries)
+        self.candidate = None
+
+    def recordAccess(self, data_name):
+        self.sketch.increment(data_name)
+
+    # New names enter the window; its overflow moves to probation as the
+    # candidate that competes with the main cache on the next eviction
+    def insert(self, data_name):
+        self.window[data_name] = None
+        while len(self.window) > self.window_size:
+            k, _ = self.window.popitem(last=False)
+            self.probation[k] = None
+            self.candidate = k
+
+    def touch(self, data_name):
+        if data_name in self.window:
+            self.window.move_to_end(data_name)
+        elif data_name in self.probation:
+            del self.probation[data_name]
+            self.protected[data_name] = None
+            # Demote the oldest protected entry when protected is full
+            if len(self.protected) > self.protected_size:
+                k, _ = self.protected.popitem(last=False)
+                self.probation[k] = None
+        else:
+            self.protected.move_to_end(data_name)
+
+    def victim(self):
+        candidate = self.candidate
+        self.candidate = None
+        if candidate is not None and candidate in self.probation:
+            incumbent = next(iter(self.probation))
+            if incumbent != candidate and self.sketch.frequency(candidate) > self.sketch.frequency(incumbent):
+                return incumbent
+            return candidate
+        for segment in (self.probation, self.protected, self.window):
+            if segment:
+                return next(iter(segment))
+        return None
+
+    def discard(self, data_name):
+        for segment in (self.window, self.probation, self.protected):
+            if data_name in segment:
+                del segment[data_name]
+                return
+
+
+STORES = {LRU: LRUStore, LFU: LFUStore, ARC: ARCStore, WTINYLFU: WTinyLFUStore}
+
+
+# Builds a Content Store. admit_probability < 1 enables probabilistic admission.
+def makeContentStore(policy=LRU, max_entries=3, max_bytes=None, admit_probability=1.0):
+    admission = ProbabilisticAdmission(admit_probability) if admit_probability < 1 else AlwaysAdmit()
+    return STORES[policy](max_entries, max_bytes, admission)
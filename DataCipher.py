@@ -0,0 +1,120 @@
+from cryptography.fernet import Fernet
+from twisted.internet import defer
+from Metrics import NullMetrics
+from Transport import TwistedBackend
+from time import perf_counter
+import base64
+import hashlib
+import hmac
+import os
+from Logs import msg_log
+
+# Environment variables holding the key data values are encrypted with and
+# the key DATA is signed with, if no key file is given (see loadKey)
+DATA_KEY_ENV = 'ICN_DATA_KEY'
+MAC_KEY_ENV = 'ICN_MAC_KEY'
+# Bytes of the HMAC-SHA256 sent with each DATA
+MAC_SIZE = 16
+
+
+# Key read from key_file or else the env environment variable, or None if
+# neither is set
+def loadKey(env, key_file=None):
+    if key_file is not None:
+        with open(key_file, 'rb') as f:
+            return f.read().strip()
+    key = os.environ.get(env)
+    return key.encode() if key else None
+
+
+# Key DATA is signed with. Forwarders hold it to check what they cache and
+# pass on, which does not let them read the encrypted value.
+def loadMacKey(key_file=None):
+    return loadKey(MAC_KEY_ENV, key_file)
+
+
+# Key data values are encrypted with, which only producers and consumers need
+def loadDataKey(key_file=None):
+    return loadKey(DATA_KEY_ENV, key_file)
+
+
+# Fernet key for a data key of any length (eg a passphrase)
+def fernetKey(data_key):
+    return base64.urlsafe_b64encode(hashlib.sha256(data_key).digest())
+
+
+# Encrypts/decrypts data values for a node. The Fernet instance is built once
+# and reused. With offload enabled the *Deferred methods run on the backend's
+# thread pool, otherwise they run inline and return an already fired Deferred.
+# Without a MAC key nothing is signed and no MAC is accepted; a data key is
+# always needed.
+class DataCipher:
+    def __init__(self, key=None, threads=0, metrics=None, backend=None, mac_key=None):
+        if key is None:
+            raise ValueError(f"No data key set ({DATA_KEY_ENV} or --data-key-file)")
+        self.fernet = Fernet(fernetKey(key))
+        self.mac_key = mac_key
+        self.metrics = metrics or NullMetrics()
+        self.backend = backend or TwistedBackend()
+        self.offload = threads > 0
+        if self.offload:
+            self.backend.setThreadPoolSize(threads)
+
+    def encrypt(self, data_val):
+        msg_log.debug("Encrypting data")
+        if not self.metrics.enabled:
+            return self.fernet.encrypt(str(data_val).encode()).decode()
+        start = perf_counter()
+        token = self.fernet.encrypt(str(data_val).encode()).decode()
+        self.metrics.observe('icn_crypto_seconds', perf_counter() - start)
+        return token
+
+    def decrypt(self, data_val):
+        msg_log.debug("Decrypting data")
+        if not self.metrics.enabled:
+            return self.fernet.decrypt(data_val.encode()).decode()
+        start = perf_counter()
+        val = self.fernet.decrypt(data_val.encode()).decode()
+        self.metrics.observe('icn_crypto_seconds', perf_counter() - start)
+        return val
+
+    def encryptBatch(self, data_vals):
+        encrypt = self.fernet.encrypt
+        return [encrypt(str(v).encode()).decode() for v in data_vals]
+
+    def decryptBatch(self, data_vals):
+        decrypt = self.fernet.decrypt
+        return [decrypt(v.encode()).decode() for v in data_vals]
+
+    # MAC binding an encrypted value to its name and time to use, so a cache
+    # cannot serve it under another name or for longer than it was meant to last
+    def sign(self, data_name, token, ttu):
+        if self.mac_key is None:
+            return None
+        digest = hmac.new(self.mac_key, f"{data_name}\n{token}\n{ttu!r}".encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:MAC_SIZE]).decode()
+
+    def verify(self, data_name, token, ttu, mac):
+        if self.mac_key is None or not isinstance(mac, str) or not isinstance(token, str):
+            return False
+        return hmac.compare_digest(self.sign(data_name, token, ttu), mac)
+
+    def encryptDeferred(self, data_val):
+        return self._run(self.encrypt, data_val)
+
+    def decryptDeferred(self, data_val):
+        return self._run(self.decrypt, data_val)
+
+    def encryptBatchDeferred(self, data_vals):
+        return self._run(self.encryptBatch, data_vals)
+
+    def decryptBatchDeferred(self, data_vals):
+        return self._run(self.decryptBatch, data_vals)
+
+    def _run(self, f, arg):
+        if self.offload:
+            return self.backend.deferToThread(f, arg)
+        try:
+            return defer.succeed(f(arg))
+        except Exception:
+            return defer.fail()
@@ -0,0 +1,55 @@
+import numpy as np
+import logging
+import os
+
+CACHE_DIR = '.cache'
+
+# Datasets already opened by this process, keyed by CSV path
+_datasets = {}
+
+
+# Returns the parsed CSV at path as a read-only array. The first call parses the
+# CSV and stores it as .npy next to it (in CACHE_DIR). Later calls, from this or
+# any other process, memory-map that file so every Sensor shares the same pages.
+# The cache file name includes the CSV size and mtime, so edits invalidate it.
+def load_dataset(path):
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    version = (st.st_size, st.st_mtime_ns)
+    cached = _datasets.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    cache_path = cache_file(path, version)
+    if not os.path.exists(cache_path):
+        build_cache(path, cache_path)
+    data = np.load(cache_path, mmap_mode='r')
+    _datasets[path] = (version, data)
+    return data
+
+
+def cache_file(path, version):
+    folder, name = os.path.split(path)
+    base = os.path.splitext(name)[0]
+    return os.path.join(folder, CACHE_DIR, f"{base}-{version[0]}-{version[1]}.npy")
+
+
+def build_cache(path, cache_path):
+    logging.debug(f"Building dataset cache for {path}")
+    data = np.genfromtxt(path, delimiter=',')
+    folder = os.path.dirname(cache_path)
+    os.makedirs(folder, exist_ok=True)
+    # Write then rename so concurrent node processes never map a partial file
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, data)
+    os.replace(tmp_path, cache_path)
+
+    # Remove caches built from older versions of this CSV
+    prefix = os.path.basename(cache_path).rsplit('-', 2)[0] + '-'
+    for old in os.listdir(folder):
+        if old.startswith(prefix) and old.endswith('.npy') and os.path.join(folder, old) != cache_path:
+            try:
+                os.remove(os.path.join(folder, old))
+            except OSError:
+                pass
@@ -0,0 +1,123 @@
+from collections import OrderedDict
+from Tables import ENTRY_OVERHEAD
+
+
+# Splits a data name into its components. Hierarchical names (/dublin/temp)
+# and flat names (dublin_temp) give the same components.
+def nameComponents(name):
+    if name.startswith('/'):
+        return tuple(c for c in name.split('/') if c)
+    return tuple(name.split('_'))
+
+
+def flatName(name):
+    return '_'.join(nameComponents(name))
+
+
+def prefixName(components):
+    return '/' + '/'.join(components)
+
+
+class _TrieNode:
+    __slots__ = ('children', 'next_hop')
+
+    def __init__(self):
+        self.children = {}
+        self.next_hop = None
+
+
+# Forwarding Information Base: maps name prefixes to the node that serves them
+# and answers lookups by longest prefix match. Holds at most size prefixes (and
+# max_bytes, if set) and evicts the least recently used ones when full.
+class FIB:
+    def __init__(self, size, max_bytes=None):
+        self.root = _TrieNode()
+        self.entries = OrderedDict()
+        self.size = size
+        self.max_bytes = max_bytes
+        self.sizes = {}
+        self.bytes = 0
+
+    def add(self, name, next_hop):
+        components = nameComponents(name)
+        if components in self.entries:
+            self.entries.move_to_end(components)
+        elif len(self.entries) >= self.size:
+            self.removeLRU()
+        node = self.root
+        for c in components:
+            child = node.children.get(c)
+            if child is None:
+                child = node.children[c] = _TrieNode()
+            node = child
+        node.next_hop = next_hop
+        self.entries[components] = next_hop
+        size = ENTRY_OVERHEAD * len(components) + sum(map(len, components)) + len(next_hop)
+        self.bytes += size - self.sizes.get(components, 0)
+        self.sizes[components] = size
+        while self.max_bytes is not None and self.bytes > self.max_bytes and len(self.entries) > 1:
+            self.removeLRU()
+
+    # Returns (prefix components, next hop) for the longest prefix of name with a route
+    def lookup(self, name):
+        components = nameComponents(name)
+        node = self.root
+        best = None
+        depth = 0
+        for i, c in enumerate(components):
+            node = node.children.get(c)
+            if node is None:
+                break
+            if node.next_hop is not None:
+                best = node.next_hop
+                depth = i + 1
+        if best is None:
+            return None, None
+        return components[:depth], best
+
+    def contains(self, name):
+        return self.lookup(name)[1] is not None
+
+    def get(self, name):
+        prefix, next_hop = self.lookup(name)
+        if prefix is not None:
+            self.entries.move_to_end(prefix)
+        return next_hop
+
+    # Removes the route that a lookup for name would use
+    def remove(self, name):
+        prefix, next_hop = self.lookup(name)
+        if prefix is None:
+            return None, -1
+        self.removePrefix(prefix)
+        return next_hop, 0
+
+    def removePrefix(self, components):
+        self.entries.pop(components, None)
+        self.bytes -= self.sizes.pop(components, 0)
+        path = [self.root]
+        for c in components:
+            node = path[-1].children.get(c)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].next_hop = None
+        # Prune branches that no longer lead to a route
+        for i in range(len(components), 0, -1):
+            node = path[i]
+            if node.next_hop is not None or node.children:
+                break
+            del path[i - 1].children[components[i - 1]]
+
+    def removeLRU(self):
+        components = next(iter(self.entries))
+        self.removePrefix(components)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return str({prefixName(k): v for k, v in self.entries.items()})
+
+    def __iter__(self):
+        return (prefixName(k) for k in self.entries)
@@ -1,8 +1,12 @@
 
 from IPNode import IPNode, LOCAL
+from Codec import FRAMED_TLV, EncodedMessage
 import logging
-import json
-from cryptography.fernet import Fernet
+import random
+from time import perf_counter
+from DataCipher import DataCipher
+from Logs import msg_log
+from Tables import BoundedMap
 
 
 HANDSHAKE_TIME_LIMIT = 10
@@ -15,6 +19,9 @@ REQUEST = 'REQUEST'
 DIR_REQUEST = 'DIRECT_REQUEST'
 FAIL = 'FAIL'
 DATA = 'DATA'
+BATCH_REQUEST = 'BATCH_REQUEST'
+BATCH_DATA = 'BATCH_DATA'
+SUBSCRIBE = 'SUBSCRIBE'
 
 # Content values
 DN = 'data_name'
@@ -25,47 +32,183 @@ LOCN = 'location_name'
 TTW = 'time_to_wait'
 PRT = 'port'
 FB = 'fallback'
+DNS = 'data_names'
+ITEMS = 'items'
+MAC = 'mac'
+REASON = 'reason'
+NONCE = 'nonce'
+
+# Reason a FAIL gives when the sender's PIT had no room for the request, ie
+# the name may well exist and should be asked for again later
+CONGESTION = 'congestion'
+# Reason a FAIL gives when the sender already had the request (same nonce) by
+# another path, ie it is being searched for there and this copy adds nothing
+DUPLICATE = 'duplicate'
+# Reason a FAIL gives when the sender only searched part of the network for
+# the requester: the request joined one sent on for another face, or the two
+# were waiting on each other. It should be asked for again rather than given up.
+PARTIAL = 'partial'
+
+# Most names carried by one BATCH_REQUEST/BATCH_DATA; longer lists are split
+MAX_BATCH = 64
+
+
+# Tags a request so forwarders can tell copies of it arriving by other paths
+# from other nodes' requests for the same name
+def newNonce():
+    return random.getrandbits(32)
+
+
+# A produced value encrypted and signed once for one sensor version, with the
+# DATA message (and so its encoded frames) for each location it is sent with
+class SealedData:
+    __slots__ = ('version', 'token', 'ttu', 'mac', 'messages')
+
+    def __init__(self, version, token, ttu, mac):
+        self.version = version
+        self.token = token
+        self.ttu = ttu
+        self.mac = mac
+        self.messages = {}
 
 
 # Represents ICN protocol
 class ICNProtocol:
-    def __init__(self, node, node_id, port):
+    def __init__(self, node, node_id, port, *, wire_format=FRAMED_TLV, crypto_threads=0, search_config=None, ip_node=None, backend=None, data_key=None, mac_key=None, accept_unsigned=False):
         self.node = node
-        self.ip_node = IPNode(self, node_id, port)
+        self.metrics = node.metrics
+        self.tracer = node.tracer
+        self.crypto = DataCipher(data_key, threads=crypto_threads, metrics=self.metrics, backend=backend, mac_key=mac_key)
+        if mac_key is None:
+            logging.warning("No MAC key set (ICN_MAC_KEY or --mac-key-file): data produced here is sent unsigned and data from other nodes cannot be checked")
+        # Whether DATA without a MAC is accepted (from nodes that do not sign)
+        self.accept_unsigned = accept_unsigned
+        self.rejected = 0
+        # ip_node can be any object with IPNode's interface (eg the simulator's in-memory one)
+        if ip_node is None:
+            ip_node = IPNode(self, node_id, port, wire_format=wire_format, search_config=search_config, backend=backend, limits=node.limits)
+        else:
+            ip_node.icn_protocol = self
+        self.ip_node = ip_node
+        limits = node.limits
+        # Nodes that have sent a BATCH_REQUEST, so are known to understand BATCH_DATA
+        self.batch_faces = BoundedMap(limits.entries('batch_faces'), limits.bytes('batch_faces'), node.peers.__contains__)
+        # Produced names -> SealedData of their current value
+        self.sealed = BoundedMap(limits.entries('sealed'), limits.bytes('sealed'))
         logging.info("Looking for other nodes")
-        self.ip_node.search(self.sendMsg(ANNOUNCE, None, json.dumps({PRT: self.ip_node.getPort()}), 2))
-
-    def encrypt_data_val(self,data_val):
-        logging.info("Encrypting data")
-        key = b'5sb7hUkLx4O9eN0eyFT0rVl1TEXJ6C2Gm1FjGFydCBA='
-        f = Fernet(key)
-        token = f.encrypt(bytes(str(data_val),'UTF-8'))
-        return token.decode("utf-8")
-    
-    def decrypt_data_val(self,data_val):
-        logging.info("Decrypting data")
-        key = b'5sb7hUkLx4O9eN0eyFT0rVl1TEXJ6C2Gm1FjGFydCBA='
-        f = Fernet(key)
-        token = f.decrypt(bytes(data_val,'UTF-8'))
-        return  token.decode("utf-8")    
+        self.ip_node.search(self.sendMsg(ANNOUNCE, None, {PRT: self.ip_node.getPort()}, 2))
+
+    def encrypt_data_val(self, data_val):
+        return self.crypto.encrypt(data_val)
+
+    def decrypt_data_val(self, data_val):
+        return self.crypto.decrypt(data_val)
+
+    # Current value of a name this node produces, encrypted and signed once
+    # per sensor version rather than for every request
+    def seal(self, data_name):
+        version = self.node.dataVersion(data_name)
+        sealed = self.sealed.get(data_name)
+        if sealed is None or version is None or sealed.version != version:
+            data_val, ttu = self.node.getPublished(data_name)
+            token = self.encrypt_data_val(data_val)
+            sealed = SealedData(version, token, ttu, self.crypto.sign(data_name, token, ttu))
+            self.sealed[data_name] = sealed
+            self.metrics.inc('icn_data_sealed_total')
+        return sealed
+
+    # DATA for a produced name, built (and encoded) once per sensor version
+    def producedMessage(self, data_name, location):
+        sealed = self.seal(data_name)
+        msg = sealed.messages.get(location)
+        if msg is None:
+            content = {DN: data_name, DV: sealed.token, TTU: sealed.ttu, LOC: location}
+            if sealed.mac is not None:
+                content[MAC] = sealed.mac
+            msg = sealed.messages[location] = EncodedMessage(self.sendMsg(DATA, None, content))
+            # Counts the new message in the entry's size
+            self.sealed[data_name] = sealed
+        return msg
+
+    def producedItem(self, data_name, location=NO_ADDR):
+        sealed = self.seal(data_name)
+        return [data_name, sealed.token, sealed.ttu, location, sealed.mac]
+
+    # Items are [data_name, data_val, ttu, location, mac], where the mac may be
+    # left out. Only nodes that sent a BATCH_REQUEST get BATCH_DATA; anyone
+    # else gets one DATA per name.
+    def sendBatchData(self, node_name, items):
+        if len(items) > 1 and node_name in self.batch_faces:
+            for i in range(0, len(items), MAX_BATCH):
+                self.sendMsg(BATCH_DATA, node_name, {ITEMS: items[i:i + MAX_BATCH]})
+        else:
+            for data_name, data_val, ttu, location, *mac in items:
+                content = {DN: data_name, DV: data_val, TTU: ttu, LOC: location}
+                if mac and mac[0] is not None:
+                    content[MAC] = mac[0]
+                self.sendMsg(DATA, node_name, content)
+
+    def sendBatchRequest(self, node_name, data_names, ttw, ttl, nonce):
+        if len(data_names) == 1:
+            self.sendMsg(REQUEST, node_name, {DN: data_names[0], TTW: ttw, NONCE: nonce}, ttl)
+            return
+        for i in range(0, len(data_names), MAX_BATCH):
+            self.sendMsg(BATCH_REQUEST, node_name, {DNS: data_names[i:i + MAX_BATCH], TTW: ttw, NONCE: nonce}, ttl)
 
     # Sends a message with format {id:__, msg_type:__, content:__, ttl:__} where id is the sender's
-    # name, msg_type is the message type and content could be a piece of data, a location (node name)
-    # for some data, etc. TTL is time to live, i.e. how many hops for a request.
+    # name, msg_type is the message type and content is a dict that could hold a piece of data, a location
+    # (node name) for some data, etc. TTL is time to live, i.e. how many hops for a request.
+    # Serialisation happens per connection (see Codec).
     def sendMsg(self, msg_type, node_name, content="", ttl=1):
-        msg = json.dumps({'id': self.node.name, 'type': msg_type, 'content': content, 'ttl': ttl})
-        logging.debug(f"Message: {msg}")
+        msg = {'id': self.node.name, 'type': msg_type, 'content': content, 'ttl': ttl}
+        msg_log.debug("Message: %s", msg)
         if node_name is not None:
-            logging.info(f"[Sending message: {msg_type} to {node_name}] ")
-            self.ip_node.sendMsg(msg, node_name)
+            self.transmit(msg, node_name)
         return msg
 
-    # Handles a given message. Decides what to do based on the msg_type.
+    # Sends one message to every face in faces. It is encoded once per wire
+    # format rather than per face; fields are the encoded content fields of
+    # the message being forwarded, if it came in as TLV (see Codec.RawContent).
+    def sendToFaces(self, msg_type, faces, content, ttl=1, fields=None):
+        if not faces:
+            return
+        msg = self.sendMsg(msg_type, None, content, ttl)
+        if len(faces) > 1 or fields is not None:
+            msg = EncodedMessage(msg, fields)
+        for face in faces:
+            self.transmit(msg, face)
+
+    # Sends an already built message, eg a producer's EncodedMessage
+    def transmit(self, msg, node_name):
+        msg_type, content, ttl = msg['type'], msg['content'], msg['ttl']
+        msg_log.info("[Sending message: %s to %s] ", msg_type, node_name)
+        self.metrics.inc('icn_messages_out_total', msg_type)
+        if self.tracer.patterns:
+            self.tracer.trace('out', msg, node_name)
+        # A DIRECT_REQUEST only asks one node, so searches no hops around it
+        if msg_type == REQUEST:
+            self.node.requestSent(content[DN], node_name, ttl)
+        elif msg_type == DIR_REQUEST:
+            self.node.requestSent(content[DN], node_name, 0)
+        elif msg_type == BATCH_REQUEST:
+            for data_name in content[DNS]:
+                self.node.requestSent(data_name, node_name, ttl)
+        self.ip_node.sendMsg(msg, node_name)
+
+    # Handles a given (already decoded) message. Decides what to do based on the msg_type.
     def handleMsg(self, msg, source=None):
-        logging.debug(msg)
-        msg = json.loads(msg)
-        msg_type, node_name, content, ttl = msg['type'], msg['id'], msg['content'], msg['ttl']
-        c = json.loads(content)
+        if self.tracer.patterns:
+            self.tracer.trace('in', msg, msg['id'])
+        if not self.metrics.enabled:
+            return self.dispatchMsg(msg, source)
+        start = perf_counter()
+        self.metrics.inc('icn_messages_in_total', msg['type'])
+        self.dispatchMsg(msg, source)
+        self.metrics.observe('icn_handle_msg_seconds', perf_counter() - start)
+
+    def dispatchMsg(self, msg, source):
+        msg_log.debug("%s", msg)
+        msg_type, node_name, c, ttl = msg['type'], msg['id'], msg['content'], msg['ttl']
 
         if msg_type == ANNOUNCE:
             self.handleAnnounce(node_name, c[PRT], source, ttl)
@@ -77,19 +220,31 @@ class ICNProtocol:
                 self.handleAcknowledge(node_name, c[PRT], source, ttl)
 
         elif msg_type == REQUEST:
-            logging.info(f"[Request received from {node_name} for {c[DN]}, {ttl}]")
-            self.handleRequest(node_name, c[DN], c[TTW], ttl)
+            msg_log.info("[Request received from %s for %s, %s]", node_name, c[DN], ttl)
+            self.handleRequest(node_name, c[DN], c[TTW], ttl, c.get(NONCE))
 
         elif msg_type == FAIL:
-            self.handleFail(node_name, c[DN])
+            self.handleFail(node_name, c[DN], c.get(REASON))
 
         elif msg_type == DATA:
-            logging.info(f"[Data received from {node_name} for {c[DN]} : {c[DV]}]")
-            self.handleData(node_name, c[DN], c[DV], c[TTU], c[LOC])
+            msg_log.info("[Data received from %s for %s : %s]", node_name, c[DN], c[DV])
+            self.handleData(node_name, c[DN], c[DV], c[TTU], c[LOC], mac=c.get(MAC), fields=getattr(c, 'fields', None))
 
         elif msg_type == DIR_REQUEST:
             self.handleDirectRequest(node_name, c[DN], c[TTW], c[PRT], source)
 
+        elif msg_type == SUBSCRIBE:
+            msg_log.info("[Subscription from %s for %s]", node_name, c[DN])
+            self.handleSubscribe(node_name, c[DN], c[TTW], ttl)
+
+        elif msg_type == BATCH_REQUEST:
+            msg_log.info("[Batch request received from %s for %s names, %s]", node_name, len(c[DNS]), ttl)
+            self.handleBatchRequest(node_name, c[DNS], c[TTW], ttl, c.get(NONCE))
+
+        elif msg_type == BATCH_DATA:
+            msg_log.info("[Batch data received from %s for %s names]", node_name, len(c[ITEMS]))
+            self.handleBatchData(node_name, c[ITEMS])
+
     def handleAnnounce(self, node_name, port, source, ttl):
         if node_name == self.node.name:
             logging.info(f"Connection to self - {node_name} to {self.node.name}; disconnecting...")
@@ -101,18 +256,31 @@ class ICNProtocol:
             source.disconnect()
             return
 
+        if node_name not in self.node.peers and self.ip_node.full():
+            logging.info(f"Refusing {node_name}: already connected to {self.ip_node.max_peers} peers")
+            self.ip_node.refused += 1
+            source.disconnect()
+            return
+
         logging.info(f"[Announcement received from {node_name}]")
         self.ip_node.addNodeAddr(node_name, port, None, source)
         self.node.reactor.callLater(HANDSHAKE_TIME_LIMIT, self.ip_node.verifyPeer, node_name)
-        content = json.dumps({PRT: self.ip_node.getPort(), FB: self.ip_node.getFallback()})
+        content = {PRT: self.ip_node.getPort(), FB: self.ip_node.getFallback()}
         self.sendMsg(ACKNOWLEDGE, node_name, content, ttl)
 
     def handleAcknowledge(self, node_name, port, source, ttl, fallback=None):
         if fallback is not None:
             logging.debug(f"Updating fallback for {node_name}")
             self.ip_node.updateFallback(node_name, fallback)
+        if source is not None:
+            self.ip_node.acknowledged(source)
         if node_name in self.node.peers or source is None:
             return
+        if self.ip_node.full():
+            logging.info(f"Dropping {node_name}: already connected to {self.ip_node.max_peers} peers")
+            self.ip_node.refused += 1
+            source.disconnect()
+            return
         logging.info(f"[Acknowledgement received from {node_name}]")
         fb = self.ip_node.setFallback(node_name, fallback, source, port)
         self.ip_node.addNodeAddr(node_name, port, None, source)
@@ -123,98 +291,341 @@ class ICNProtocol:
             self.sendFallback(node_name, fb)
         elif ttl > 1:
             ttl -= 1
-            content = json.dumps({PRT: self.ip_node.getPort(), FB: self.ip_node.getFallback()})
+            content = {PRT: self.ip_node.getPort(), FB: self.ip_node.getFallback()}
             self.sendMsg(ACKNOWLEDGE, node_name, content, ttl)
 
-    def handleRequest(self, node_name, data_name, ttw, ttl):
+    def handleRequest(self, node_name, data_name, ttw, ttl, nonce=None):
         ttl -= 1
         # Has data -> reply with data
         if self.node.hasData(data_name):
-            data_val, ttu = self.node.getData(data_name)
-            data_val=self.encrypt_data_val(data_val)
-            content = json.dumps({DN: data_name, DV: data_val, TTU: ttu, LOC: NO_ADDR})
-            self.sendMsg(DATA, node_name, content)
+            self.transmit(self.producedMessage(data_name, NO_ADDR), node_name)
             return
         elif self.node.hasCache(data_name):
-            data_val, ttu = self.node.getCache(data_name)
-            content = json.dumps({DN: data_name, DV: data_val, TTU: ttu, LOC: NO_ADDR})
+            self.metrics.inc('icn_cache_hits_total')
+            data_val, ttu, mac = self.node.getCache(data_name)
+            content = {DN: data_name, DV: data_val, TTU: ttu, LOC: NO_ADDR}
+            if mac is not None:
+                content[MAC] = mac
             self.sendMsg(DATA, node_name, content)
             return
-        # Time to live has run out -> reply with fail
-        elif ttl == 0:
-            content = json.dumps({DN: data_name})
+        self.metrics.inc('icn_cache_misses_total')
+        # Time to live has run out, or recently not found -> reply with fail
+        if ttl == 0 or self.node.knownMissing(data_name, node_name, ttl):
+            content = {DN: data_name}
             self.sendMsg(FAIL, node_name, content)
-        # Data name already in PIT -> do nothing
-        elif self.node.hasPITEntry(data_name):
+        # Data name already in PIT -> add requester as another face, don't
+        # forward (unless it is a copy that can search further)
+        elif self.node.hasPITEntry(data_name) and not self.node.isRetransmission(data_name, node_name) and not self.node.searchesFurther(data_name, nonce, ttl):
+            self.aggregateRequest(node_name, data_name, ttw, nonce)
             return
         else:
-            # Propagate request
-            self.node.addToPIT(data_name, node_name, ttw)
-            content = json.dumps({DN: data_name, TTW: ttw})
-            if self.node.hasLocation(data_name) and self.node.getLocation(data_name) in self.node.peers:
+            # Requester already waiting -> it has retransmitted, so forward again
+            if self.node.hasPITEntry(data_name) and not self.node.searchesFurther(data_name, nonce, ttl):
+                self.node.backOffFaces(data_name)
+            # No room for another pending name -> tell the requester to back off
+            elif self.node.pitFull(data_name):
+                self.rejectRequest(node_name, data_name)
+                return
+            # Propagate request, keeping its nonce (nodes that do not send one
+            # get a new one here)
+            nonce = nonce if nonce is not None else newNonce()
+            self.node.addToPIT(data_name, node_name, ttw, nonce=nonce)
+            content = {DN: data_name, TTW: ttw, NONCE: nonce}
+            hop = self.node.nextHop(data_name)
+            if hop is not None:
                 # Send to guaranteed node
-                self.sendMsg(REQUEST, self.node.getLocation(data_name), content, ttl)
+                self.sendMsg(REQUEST, hop, content, ttl)
+            else:
+                # Send to the other peers the forwarding strategy picks
+                faces = self.node.forwardingFaces(data_name, node_name)
+                if faces:
+                    self.node.addToPIT(data_name, node_name, ttw, len(faces))
+                    self.sendToFaces(REQUEST, faces, content, ttl)
+                else:
+                    self.sendMsg(FAIL, node_name, {DN: data_name})
+
+    # A request for a name already pending. A copy of a pending request (same
+    # nonce) that came by another path is turned away, since waiting on it
+    # too would have this node and the sender each wait for the other until
+    # the time to wait runs out. Any other request joins the entry; if it came
+    # from a face the entry is waiting on, the two are waiting on each other,
+    # so the sender is told not to count on this node.
+    def aggregateRequest(self, node_name, data_name, ttw, nonce):
+        if self.node.isDuplicate(data_name, nonce):
+            self.sendMsg(FAIL, node_name, {DN: data_name, REASON: DUPLICATE})
+            return
+        looped = self.node.isLooped(data_name, node_name)
+        self.node.aggregateInPIT(data_name, node_name, ttw, nonce, looped)
+        if looped:
+            self.sendMsg(FAIL, node_name, {DN: data_name, REASON: PARTIAL})
+
+    # Same as handleRequest for many names: produced and cached names are
+    # answered in one reply, the rest get PIT entries and are forwarded together
+    def handleBatchRequest(self, node_name, data_names, ttw, ttl, nonce=None):
+        ttl -= 1
+        self.batch_faces[node_name] = None
+        items = []
+        missing = []
+        for data_name in data_names:
+            if self.node.hasData(data_name):
+                items.append(self.producedItem(data_name))
+            elif self.node.hasCache(data_name):
+                self.metrics.inc('icn_cache_hits_total')
+                data_val, ttu, mac = self.node.getCache(data_name)
+                items.append([data_name, data_val, ttu, NO_ADDR, mac])
+            else:
+                self.metrics.inc('icn_cache_misses_total')
+                missing.append(data_name)
+        # Recently not found -> reply with fail
+        if ttl > 0:
+            for data_name in [n for n in missing if self.node.knownMissing(n, node_name, ttl)]:
+                missing.remove(data_name)
+                self.sendMsg(FAIL, node_name, {DN: data_name})
+        if items:
+            self.sendBatchData(node_name, items)
+        if not missing:
+            return
+        # Time to live has run out -> reply with fail
+        if ttl == 0:
+            for data_name in missing:
+                self.sendMsg(FAIL, node_name, {DN: data_name})
+            return
+        self.forwardBatch(node_name, missing, ttw, ttl, nonce)
+
+    # Adds PIT entries for the names and forwards them in as few messages as
+    # possible: names already pending are aggregated, and the rest are grouped
+    # per next hop (from the FIB, or else the forwarding strategy)
+    def forwardBatch(self, node_name, data_names, ttw, ttl, nonce=None):
+        nonce = nonce if nonce is not None else newNonce()
+        routed = {}
+        flood = []
+        for data_name in data_names:
+            if self.node.hasPITEntry(data_name) and not self.node.searchesFurther(data_name, nonce, ttl):
+                if not self.node.isRetransmission(data_name, node_name):
+                    self.aggregateRequest(node_name, data_name, ttw, nonce)
+                    continue
+                self.node.backOffFaces(data_name)
+            elif self.node.pitFull(data_name):
+                self.rejectRequest(node_name, data_name)
+                continue
+            hop = self.node.nextHop(data_name)
+            if hop is not None:
+                self.node.addToPIT(data_name, node_name, ttw, nonce=nonce)
+                routed.setdefault(hop, []).append(data_name)
             else:
-                # Send to all other peers
-                count = 1
-                for n in self.node.peers:
-                    if n == node_name:
-                        continue
-                    self.node.addToPIT(data_name, node_name, ttw, count)
-                    count += 1
-                    self.sendMsg(REQUEST, n, content, ttl)
-                if count == 1:
-                    self.sendMsg(FAIL, node_name, content)
-
-    def handleFail(self, node_name, data_name):
+                flood.append(data_name)
+        for data_name in flood:
+            # Routed names may have taken the last free entries
+            if self.node.pitFull(data_name):
+                self.rejectRequest(node_name, data_name)
+                continue
+            faces = self.node.forwardingFaces(data_name, node_name)
+            if not faces:
+                self.sendMsg(FAIL, node_name, {DN: data_name})
+                continue
+            self.node.addToPIT(data_name, node_name, ttw, len(faces), nonce)
+            for n in faces:
+                routed.setdefault(n, []).append(data_name)
+        for dest, names in routed.items():
+            self.sendBatchRequest(dest, names, ttw, ttl, nonce)
+
+    # The PIT has no room for data_name, so rather than evict a pending request
+    # node_name is told to back off. This node's own requests are sent again
+    # by their retransmission timers.
+    def rejectRequest(self, node_name, data_name):
+        if node_name == self.node.name:
+            logging.warning(f"PIT full, delaying request for {data_name}")
+            return
+        self.sendMsg(FAIL, node_name, {DN: data_name, REASON: CONGESTION})
+
+    def handleFail(self, node_name, data_name, reason=None):
+        # Only upstream faces still owing an answer count (or this node giving
+        # up on its own request), so a late or repeated FAIL is not counted twice
+        owed = self.node.requestAnswered(node_name, data_name, failed=True, duplicate=reason == DUPLICATE)
+        if not owed and node_name != self.node.name:
+            return
+        searched = self.node.searchedTTL(data_name)
+        inconclusive = self.node.pitInconclusive(data_name, reason if reason in (CONGESTION, PARTIAL) else None)
+        forwarded = set(self.node.forwardedFor(data_name))
         # Remove count of item from PIT
-        dest, r = self.node.removeCountFromPIT(data_name)
+        faces, r = self.node.removeCountFromPIT(data_name)
         # Data not in PIT -> do nothing
-        if dest is None:
+        if faces is None:
             return
-        logging.info(f"[Fail from {node_name} for {data_name}]")
-        # If final count of item has been removed from PIT -> forward FAIL to destination
-        if r == 0 and dest != self.node.name:
-            content = json.dumps({DN: data_name})
-            self.sendMsg(FAIL, dest, content)
-        # If final count of item has been removed AND this node is the destination -> Data not found
-        elif r == 0 and dest == self.node.name:
+        msg_log.info("[Fail from %s for %s]", node_name, data_name)
+        if r != 0:
+            return
+        others = [dest for dest in faces if dest != self.node.name]
+        # An upstream was too busy or could only search in part -> the name is
+        # not known to be missing, so downstream faces are told the same
+        if inconclusive:
+            self.sendToFaces(FAIL, others, {DN: data_name, REASON: inconclusive})
+            if self.node.name in faces:
+                logging.warning(f"Request for {data_name} not fully searched ({inconclusive}), retrying")
+            return
+        # Faces that joined the request were only searched for in the
+        # directions it was sent, which may leave out their own
+        joined = [dest for dest in others if dest not in forwarded]
+        told = [dest for dest in faces if dest in forwarded]
+        # Every upstream failed -> remember for a while what the faces were told
+        if node_name != self.node.name:
+            self.node.addMissing(data_name, told, searched)
+        # Final count of item has been removed from PIT -> forward FAIL to every face
+        self.sendToFaces(FAIL, [dest for dest in told if dest != self.node.name], {DN: data_name})
+        self.sendToFaces(FAIL, joined, {DN: data_name, REASON: PARTIAL})
+        # This node is a destination -> Data not found
+        if self.node.name in faces:
+            if self.node.name not in forwarded:
+                logging.warning(f"Request for {data_name} not fully searched ({PARTIAL}), retrying")
+                return
+            # Only the learned location was asked -> search again without it
+            if searched <= 1 and node_name != self.node.name:
+                logging.warning(f"Location of {data_name} does not have it, retrying")
+                self.node.removeLocation(data_name)
+                return
             logging.warning(f"Data for {data_name} could not be found on network")
+            self.node.failData(data_name)
             self.node.removeLocation(data_name)
 
-    def handleData(self, node_name, data_name, data_val, ttu, location, dec=True):
-        dest, r = self.node.removeFromPIT(data_name)
-        # Data not in PIT -> do nothing
-        if dest is None:
+    # Downstream faces for arriving data: those of its PIT entry plus any
+    # subscribers to the name (pushed updates have no PIT entry at all)
+    def dataFaces(self, node_name, data_name, ttu, subscribed=True):
+        self.node.requestAnswered(node_name, data_name)
+        self.node.clearMissing(data_name)
+        faces, r = self.node.removeFromPIT(data_name)
+        subscribers = self.node.subscribedFaces(data_name, ttu) if subscribed else None
+        if subscribers:
+            subscribers.discard(node_name)
+            faces = list(subscribers.union(faces or ()))
+        return faces
+
+    # DATA whose MAC does not match was changed (or signed with another key) on
+    # the way. DATA without a MAC could have been too, so is only accepted with
+    # accept_unsigned (from nodes that do not sign), or from this node itself.
+    def verifyData(self, node_name, data_name, data_val, ttu, mac):
+        if mac is None:
+            if self.accept_unsigned or node_name == self.node.name:
+                return True
+            problem = "no MAC"
+        elif self.crypto.verify(data_name, data_val, ttu, mac):
+            return True
+        else:
+            problem = "MAC does not match"
+        logging.warning(f"Rejected data for {data_name} from {node_name}: {problem}")
+        self.metrics.inc('icn_data_rejected_total')
+        self.rejected += 1
+        return False
+
+    # fields are the encoded content fields the DATA arrived with, which are
+    # sent on as they are with only the location re-encoded
+    def handleData(self, node_name, data_name, data_val, ttu, location, dec=True, mac=None, fields=None):
+        if not self.verifyData(node_name, data_name, data_val, ttu, mac):
             return
-        # Data in PIT, requested by this node -> update location for data & use data
-        if dest == self.node.name:
-            location = self.updateMessageLocation(node_name, location)
+        # Unencrypted local data is never pushed to subscribers
+        faces = self.dataFaces(node_name, data_name, ttu, dec)
+        # Data not in PIT or subscribed to -> do nothing
+        if faces is None:
+            return
+        location = self.updateMessageLocation(node_name, location)
+        # Data requested by this node -> update location for data & use data
+        if self.node.name in faces:
             self.addLocation(data_name, location)
             if dec:
-                data_val = self.decrypt_data_val(data_val)
-            self.node.useData(data_name, data_val)
-        # Data in PIT, requested by other node -> forward data + cache data
-        else:
+                d = self.crypto.decryptDeferred(data_val)
+                d.addCallback(lambda val: self.node.deliverData(data_name, val))
+                d.addErrback(lambda e: logging.error(f"Could not decrypt {data_name}: {e.value!r}"))
+            else:
+                self.node.deliverData(data_name, data_val)
+        # Data requested by other nodes -> forward the same content to each
+        dests = [dest for dest in faces if dest != self.node.name]
+        if dests:
+            forward = {DN: data_name, DV: data_val, TTU: ttu, LOC: location}
+            if mac is not None:
+                forward[MAC] = mac
+            self.sendToFaces(DATA, dests, forward, fields=fields)
+            # Cache data that passed through
+            self.node.cacheData(data_name, data_val, ttu, mac)
+        if node_name not in self.node.peers:
+            self.ip_node.removePeer(node_name)
+
+    # Same as handleData for many names. Items for each downstream face are
+    # sent on together, and this node's own names are decrypted as one batch.
+    def handleBatchData(self, node_name, items):
+        forward = {}
+        own = []
+        for data_name, data_val, ttu, location, *mac in items:
+            mac = mac[0] if mac else None
+            if not self.verifyData(node_name, data_name, data_val, ttu, mac):
+                continue
+            faces = self.dataFaces(node_name, data_name, ttu)
+            # Data not in PIT or subscribed to -> skip it
+            if faces is None:
+                continue
             location = self.updateMessageLocation(node_name, location)
-            content = json.dumps({DN: data_name, DV: data_val, TTU: ttu, LOC: location})
-            self.sendMsg(DATA, dest, content)
-            self.node.cacheData(data_name, data_val, ttu)
+            item = None
+            for dest in faces:
+                if dest == self.node.name:
+                    self.addLocation(data_name, location)
+                    own.append((data_name, data_val))
+                else:
+                    if item is None:
+                        item = [data_name, data_val, ttu, location, mac]
+                        # Cache data that passed through
+                        self.node.cacheData(data_name, data_val, ttu, mac)
+                    forward.setdefault(dest, []).append(item)
+        for dest, dest_items in forward.items():
+            self.sendBatchData(dest, dest_items)
+        if own:
+            names = [data_name for data_name, data_val in own]
+            d = self.crypto.decryptBatchDeferred([data_val for data_name, data_val in own])
+            d.addCallback(lambda vals: [self.node.deliverData(n, v) for n, v in zip(names, vals)])
+            d.addErrback(lambda e: logging.error(f"Could not decrypt batch from {node_name}: {e.value!r}"))
         if node_name not in self.node.peers:
             self.ip_node.removePeer(node_name)
 
+    # Records the downstream face of a subscription. A producer of matching
+    # names is the root of the tree and sends new subscribers the current
+    # values; other nodes pass the lease upstream like a request.
+    def handleSubscribe(self, node_name, pattern, expiry, ttl):
+        ttl -= 1
+        new, forward = self.node.addSubscription(pattern, node_name, expiry)
+        if self.node.producedNames(pattern):
+            if new:
+                names = self.node.currentNames(pattern)
+                if names:
+                    self.sendBatchData(node_name, [self.producedItem(data_name) for data_name in names])
+            return
+        if forward and ttl > 0:
+            self.forwardSubscription(node_name, pattern, expiry, ttl)
+
+    def forwardSubscription(self, node_name, pattern, expiry, ttl):
+        content = {DN: pattern, TTW: expiry}
+        hop = self.node.nextHop(pattern)
+        if hop is not None:
+            self.sendMsg(SUBSCRIBE, hop, content, ttl)
+        else:
+            self.sendToFaces(SUBSCRIBE, [n for n in self.node.peers if n != node_name], content, ttl)
+
+    # Pushes a new value of a produced name to every face subscribed to it.
+    # The DATA sealed for it also answers requests until the next update.
+    def pushData(self, data_name, data_val, faces):
+        msg = None
+        for face in faces:
+            if face == self.node.name:
+                self.node.deliverData(data_name, data_val)
+            else:
+                msg = msg or self.producedMessage(data_name, NO_ADDR)
+                self.transmit(msg, face)
+
     def handleDirectRequest(self, node_name, data_name, ttw, port, source):
-        logging.info(f"[Direct Request received from {node_name}]")
+        msg_log.info("[Direct Request received from %s]", node_name)
         self.ip_node.addNodeAddr(node_name, port, None, source)
-        content = json.dumps({PRT: self.ip_node.getPort()})
+        content = {PRT: self.ip_node.getPort()}
 
         if self.node.hasData(data_name):
-            data_val, ttu = self.node.getData(data_name)
-            data_val=self.encrypt_data_val(data_val)
-            content = json.dumps({DN: data_name, DV: data_val, TTU: ttu, LOC: None})
-            self.sendMsg(DATA, node_name, content)
+            self.transmit(self.producedMessage(data_name, None), node_name)
         else:
-            content = json.dumps({DN: data_name})
+            content = {DN: data_name}
             self.sendMsg(FAIL, node_name, content)
         if node_name not in self.node.peers:
             self.node.reactor.callLater(HANDSHAKE_TIME_LIMIT, self.ip_node.removePeer, node_name)
@@ -244,42 +655,70 @@ class ICNProtocol:
             return f"{host}:{port}:{name}"
         return location
 
-    def requestData(self, data_name, ttw, ttl=5):
+    # retransmit sends the request out again even if this node is waiting on it
+    def requestData(self, data_name, ttw, ttl=5, retransmit=False):
+        # Already waiting on this name for another node -> join that entry
+        if not retransmit and self.node.hasPITEntry(data_name) and not self.node.hasData(data_name):
+            self.node.aggregateInPIT(data_name, self.node.name, ttw)
+            return
+        if self.node.pitFull(data_name):
+            self.rejectRequest(self.node.name, data_name)
+            return
         # Add data to PIT
-        self.node.addToPIT(data_name, self.node.name, ttw)
+        nonce = newNonce()
+        self.node.addToPIT(data_name, self.node.name, ttw, nonce=nonce)
         # If this node contains data, handle it
         if self.node.hasData(data_name):
             data_val, ttu = self.node.getData(data_name)
             self.handleData(self.node.name, data_name, data_val, ttu, self.ip_node.getPeerAddr(self.node.name), False)
         # If this node knows location of data, request directly
-        elif self.node.hasLocation(data_name):
-            node_name = self.node.getLocation(data_name)
-            if node_name in self.node.peers:
-                content = json.dumps({DN: data_name, TTW: ttw})
-                self.sendMsg(REQUEST, node_name, content, 1)
-            else:
-                content = json.dumps({DN: data_name, TTW: ttw, PRT: self.ip_node.getPort()})
-                self.sendMsg(DIR_REQUEST, self.node.getLocation(data_name), content, ttl)
+        elif self.node.nextHop(data_name) is not None:
+            content = {DN: data_name, TTW: ttw, NONCE: nonce}
+            self.sendMsg(REQUEST, self.node.nextHop(data_name), content, 1)
+        elif self.node.hasLocation(data_name) and self.node.getLocation(data_name) not in self.node.peers:
+            content = {DN: data_name, TTW: ttw, PRT: self.ip_node.getPort()}
+            self.sendMsg(DIR_REQUEST, self.node.getLocation(data_name), content, ttl)
+        # Recently not found -> fail at once
+        elif self.node.knownMissing(data_name, self.node.name, ttl):
+            self.handleFail(self.node.name, data_name)
         # If this node has no peers, search for peers
         elif len(self.node.peers) < 1:
             logging.warning(f"{self.node.name} has no peers for data request.")
-            self.handleFail(FAIL, self.node.name, data_name)
+            self.handleFail(self.node.name, data_name)
             # Search
             self.ip_node.search()
-        # Otherwise send requests to all peers
+        # Otherwise send requests to the peers the forwarding strategy picks
         else:
-            content = json.dumps({DN: data_name, TTW: ttw})
-            count = 1
-            for n in self.node.peers:
-                if n == self.node.name:
-                    continue
-                self.node.addToPIT(data_name, self.node.name, ttw, count)
-                count += 1
-                self.sendMsg(REQUEST, n, content, ttl)
+            faces = self.node.forwardingFaces(data_name, self.node.name)
+            if faces:
+                self.node.addToPIT(data_name, self.node.name, ttw, len(faces))
+                self.sendToFaces(REQUEST, faces, {DN: data_name, TTW: ttw, NONCE: nonce}, ttl)
+
+    # Requests many names at once. Names that need special handling (produced
+    # here, only reachable directly, or no peers yet) go through requestData.
+    def requestBatch(self, data_names, ttw, ttl=5):
+        batch = []
+        for data_name in dict.fromkeys(data_names):
+            direct = self.node.hasLocation(data_name) and self.node.getLocation(data_name) not in self.node.peers
+            missing = self.node.negative.contains(data_name, self.node.name, ttl)
+            if self.node.hasData(data_name) or direct or missing or len(self.node.peers) < 1:
+                self.requestData(data_name, ttw, ttl)
+            else:
+                batch.append(data_name)
+        if batch:
+            self.forwardBatch(self.node.name, batch, ttw, ttl)
+
+    # Subscribes (or renews) this node's lease on a name or prefix. An expiry in
+    # the past cancels it.
+    def subscribe(self, pattern, expiry, ttl=5):
+        self.node.addSubscription(pattern, self.node.name, expiry)
+        if self.node.producedNames(pattern):
+            return
+        self.forwardSubscription(self.node.name, pattern, expiry, ttl)
 
     def getAnnounce(self):
-        return self.sendMsg(ANNOUNCE, None, json.dumps({PRT: self.ip_node.getPort()}), 2)
+        return self.sendMsg(ANNOUNCE, None, {PRT: self.ip_node.getPort()}, 2)
 
     def sendFallback(self, node_name, addr):
-        content = json.dumps({PRT: self.ip_node.getPort(), FB: self.ip_node.getFallback()})
+        content = {PRT: self.ip_node.getPort(), FB: self.ip_node.getFallback()}
         self.sendMsg(ACKNOWLEDGE, node_name, content, 1)
@@ -1,9 +1,11 @@
 
 from twisted.internet.protocol import Protocol, Factory
-from twisted.internet.endpoints import TCP4ServerEndpoint
-from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
-from twisted.internet import reactor
 from twisted.internet.error import ConnectionRefusedError
+from Transport import TwistedBackend
+from Codec import FrameDecoder, CodecError, encodeFrame, FRAMED_TLV, LEGACY_JSON
+from collections import OrderedDict, deque
+from Logs import msg_log
+from Tables import BoundedMap, TableLimits
 import logging
 import random
 
@@ -18,6 +20,19 @@ NETWORKS = ["localhost", "127.0.0.1"]
 MIN_PORT = 33010
 MAX_PORT = 33016
 
+# Peer discovery defaults
+SEARCH_CONCURRENCY = 8
+SEARCH_TIMEOUT = 2
+SEARCH_SETTLE = 1
+SEARCH_BACKOFF = 5
+SEARCH_MAX_BACKOFF = 60
+SEARCH_MIN_PEERS = 1
+
+# Connections kept to nodes that are not peers (direct requests, DATA replies)
+POOL_SIZE = 16
+POOL_IDLE_TIMEOUT = 30
+POOL_QUEUE_LIMIT = 256
+
 
 # Represents a connection (could be client -> server or server -> client)
 class NodeProtocol(Protocol):
@@ -25,6 +40,9 @@ class NodeProtocol(Protocol):
         self.id = factory.id
         self.factory = factory
         self.incoming = incoming
+        self.decoder = FrameDecoder()
+        self.wire_format = factory.wire_format
+        self.pool = None
         logging.debug(f"[New node protocol]: {self.id}")
 
     def connectionMade(self):
@@ -32,40 +50,202 @@ class NodeProtocol(Protocol):
 
     def connectionLost(self, reason):
         logging.debug(f"[Disconnected]: {self.transport.getPeer()}")
+        self.factory.announcing.discard(self)
+        # Pooled connections never belong to a peer
+        if self.pool is not None:
+            self.pool.lost(self)
+            return
         self.factory.removeConnection(self.transport.getPeer())
 
+    # TCP may split or coalesce writes, so bytes are buffered until whole
+    # frames are available
     def dataReceived(self, data):
-        logging.debug(f"Data received: {data}")
-        self.handleMsg(data)
+        msg_log.debug("Data received: %s", data)
+        try:
+            msgs = self.decoder.feed(data)
+        except (CodecError, ValueError) as e:
+            logging.warning(f"Dropping connection after undecodable data: {e!r}")
+            self.disconnect()
+            return
+        # Peer speaks unframed JSON -> answer it the same way
+        if self.decoder.legacy:
+            self.wire_format = LEGACY_JSON
+        for msg in msgs:
+            self.handleMsg(msg)
 
     def sendMsg(self, msg):
-        self.transport.write(msg.encode())
+        self.transport.write(encodeFrame(msg, self.wire_format))
+
+    # Writes several messages in one call; frames of EncodedMessages are the
+    # same bytes objects every connection is given
+    def sendMsgs(self, msgs):
+        self.transport.writeSequence([encodeFrame(msg, self.wire_format) for msg in msgs])
 
-    def handleMsg(self, data):
-        self.factory.icn_protocol.handleMsg(data, self)
+    def handleMsg(self, msg):
+        self.factory.icn_protocol.handleMsg(msg, self)
 
     def disconnect(self):
         logging.debug(f"[Disconnecting...]: {self.transport.getPeer()}")
         self.transport.loseConnection()
 
 
+# Parses a port range given as MIN-MAX (or a single port)
+def parsePortRange(ports):
+    low, _, high = ports.partition('-')
+    return int(low), int(high or low)
+
+
+# Where and how a node looks for peers
+class SearchConfig:
+    def __init__(self, networks=None, min_port=MIN_PORT, max_port=MAX_PORT, concurrency=SEARCH_CONCURRENCY,
+                 timeout=SEARCH_TIMEOUT, min_peers=SEARCH_MIN_PEERS, backoff=SEARCH_BACKOFF, max_backoff=SEARCH_MAX_BACKOFF):
+        self.networks = list(networks or NETWORKS)
+        self.min_port = min_port
+        self.max_port = max_port
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.min_peers = min_peers
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # (addr, port) of former peers (eg from a snapshot), probed first
+        self.preferred = []
+
+    # Every (addr, port) to probe, in random order after any preferred ones.
+    # Local aliases are probed once.
+    def candidates(self, own_port):
+        hosts = []
+        for addr in self.networks:
+            if addr in LOCAL and any(h in LOCAL for h in hosts):
+                continue
+            if addr not in hosts:
+                hosts.append(addr)
+        found = [(addr, port) for addr in hosts for port in range(self.min_port, self.max_port + 1)
+                 if not (addr in LOCAL and port == own_port)]
+        random.shuffle(found)
+        preferred = [c for c in self.preferred if not (c[0] in LOCAL and c[1] == own_port)]
+        return preferred + [c for c in found if c not in preferred]
+
+
+class _PooledConnection:
+    def __init__(self, key):
+        self.key = key
+        self.protocol = None
+        self.queue = deque()
+        self.timer = None
+
+
+# Bounded set of outgoing connections keyed by (addr, port). Messages sent while
+# a connection is being made are queued and flushed once it is up. Connections
+# close after POOL_IDLE_TIMEOUT seconds unused, and the least recently used one
+# is closed when the pool is full.
+class ConnectionPool:
+    def __init__(self, factory, size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT, queue_limit=POOL_QUEUE_LIMIT):
+        self.factory = factory
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.queue_limit = queue_limit
+        self.conns = OrderedDict()
+
+    def send(self, addr, port, msg):
+        key = (addr, port)
+        c = self.conns.get(key)
+        if c is None:
+            if len(self.conns) >= self.size:
+                self.evict()
+            c = self.conns[key] = _PooledConnection(key)
+            self.connect(c)
+        else:
+            self.conns.move_to_end(key)
+        if c.protocol is not None:
+            c.protocol.sendMsg(msg)
+            self.touch(c)
+        elif len(c.queue) < self.queue_limit:
+            c.queue.append(msg)
+        else:
+            logging.warning(f"Dropping message to {addr}:{port}, connection queue full")
+
+    def connect(self, c):
+        addr, port = c.key
+        logging.debug(f"[Pool connecting]: {addr}:{port}")
+        prot = NodeProtocol(self.factory, True)
+        prot.pool = self
+        d = self.factory.backend.connect(addr, port, prot)
+        d.addCallbacks(self.connected, self.failed, callbackArgs=(c,), errbackArgs=(c,))
+
+    def connected(self, prot, c):
+        if self.conns.get(c.key) is not c:
+            prot.disconnect()
+            return
+        c.protocol = prot
+        if c.queue:
+            prot.sendMsgs(c.queue)
+            c.queue.clear()
+        self.touch(c)
+
+    def failed(self, e, c):
+        logging.warning(f"Could not connect to {c.key[0]}:{c.key[1]}: {e.getErrorMessage()}")
+        if self.conns.get(c.key) is c:
+            self.conns.pop(c.key)
+
+    def touch(self, c):
+        if c.timer is not None and c.timer.active():
+            c.timer.reset(self.idle_timeout)
+        else:
+            c.timer = self.factory.backend.callLater(self.idle_timeout, self.close, c.key)
+
+    def close(self, key):
+        c = self.conns.pop(key, None)
+        if c is None:
+            return
+        if c.timer is not None and c.timer.active():
+            c.timer.cancel()
+        if c.protocol is not None:
+            c.protocol.disconnect()
+
+    def evict(self):
+        key = next(iter(self.conns))
+        logging.debug(f"[Pool evicting]: {key[0]}:{key[1]}")
+        self.close(key)
+
+    def lost(self, prot):
+        for key, c in self.conns.items():
+            if c.protocol is prot:
+                self.close(key)
+                break
+
+    def __len__(self):
+        return len(self.conns)
+
+
 # Factory class used for persistent data since
 # protocol instance is created each time connection
-# is made
+# is made. Sockets and timers come from backend (see Transport).
 class IPNode(Factory):
 
-    def __init__(self, icnp, node_id, port):
+    def __init__(self, icnp, node_id, port, wire_format=FRAMED_TLV, search_config=None, backend=None, limits=None):
         # "Server"
         self.id = node_id
+        self.backend = backend or TwistedBackend()
         self.port = port
+        self.wire_format = wire_format
+        limits = limits or TableLimits()
         self.connections = {}
-        self.IP_map = {}
+        self.max_peers = limits.max_peers
+        # Announcements turned away with max_peers connected
+        self.refused = 0
+        # Addresses and fallbacks of connected peers are never evicted
+        self.IP_map = BoundedMap(limits.entries('addresses'), limits.bytes('addresses'), self.connections.__contains__)
         self.icn_protocol = icnp
         self.fallback_address = None
-        self.fallbacks = {}
+        self.fallbacks = BoundedMap(limits.entries('fallbacks'), limits.bytes('fallbacks'), self.connections.__contains__)
+        self.pool = ConnectionPool(self)
+        self.search_config = search_config or SearchConfig()
+        self.searching = False
+        self.search_failures = 0
+        # Outgoing connections whose ANNOUNCE has not been acknowledged yet
+        self.announcing = set()
 
-        endp = TCP4ServerEndpoint(reactor, port)
-        endp.listen(self)
+        self.backend.listen(port, self)
 
         self.part_of_network = False
         self.isolated = True
@@ -77,16 +257,12 @@ class IPNode(Factory):
         protocol.factory = self
         return protocol
 
-    def client(self, port, addr="localhost", announce_msg=None):
+    def client(self, port, addr="localhost", announce_msg=None, timeout=30):
         # "Client"
-        try:
-            endp = TCP4ClientEndpoint(reactor, addr, port)
-            d = connectProtocol(endp, NodeProtocol(self, True))
-            d.addCallback(self.confirmConnection, announce_msg)
-            d.addErrback(self.errorHandler)
-            return d
-        except ConnectionRefusedError:
-            return d
+        d = self.backend.connect(addr, port, NodeProtocol(self, True), timeout)
+        d.addCallback(self.confirmConnection, announce_msg)
+        d.addErrback(self.errorHandler)
+        return d
 
     def getConnection(self, node_id):
         if node_id in self.connections:
@@ -96,91 +272,98 @@ class IPNode(Factory):
         else:
             return None
 
-    def clientMsg(self, port, addr, msg):
-        try:
-            endp = TCP4ClientEndpoint(reactor, addr, port)
-            d = connectProtocol(endp, NodeProtocol(self, True))
-            d.addCallback(self.confirmMessage, msg)
-            d.addErrback(self.errorHandler)
-            return d
-        except ConnectionRefusedError:
-            return d
-
     def sendMsg(self, msg, node_name, connection=None):
         if node_name is None:
             connection = connection
         else:
             connection = self.getConnection(node_name)
         if connection is None:
-            logging.warning(f"No connection found or established with {node_name}")
+            logging.debug(f"No connection established with {node_name}, using pool")
+            # Unknown or malformed address
             try:
                 addr, port = self.IP_map[node_name].split(':')
                 port = int(port)
-                self.clientMsg(port, addr, msg)
-            except Exception as e:
-                logging.error(repr(e))
-                logging.warning(f"Could not connect to {node_name}")
-            finally:
+            except (KeyError, ValueError):
+                logging.warning(f"Could not connect to {node_name}: no usable address")
                 return
+            self.pool.send(addr, port, msg)
+            return
         connection.sendMsg(msg)
 
-    def search(self, msg, port_iter=None, addr="localhost", addr_iter=None):
-        if port_iter is None:
-            ports_to_check = [*range(MIN_PORT, MAX_PORT + 1)]
-            random.shuffle(ports_to_check)
-            port_iter = iter(ports_to_check)
-        if addr_iter is None:
-            networks_to_check = NETWORKS
-            random.shuffle(networks_to_check)
-            addr_iter = iter(networks_to_check)
-            addr = next(addr_iter)
-        try:
-            port = next(port_iter)
-            if port == self.port:
-                port = next(port_iter)
-        except StopIteration:
-            try:
-                addr = next(addr_iter)
-                self.search(msg, None, addr, addr_iter)
-                return
-            except StopIteration:
-                reactor.callLater(1, self.searchFailed, msg)
-                return
-        if len(self.connections) > 0:
-            logging.debug(f"Stopping search")
+    # Probes up to search_config.concurrency candidates at once and stops
+    # starting new probes once min_peers connections are established or
+    # awaiting an ACK
+    def search(self, msg=None):
+        if self.searching:
+            return
+        if msg is None:
+            msg = self.icn_protocol.getAnnounce()
+        self.searching = True
+        config = self.search_config
+        candidates = iter(config.candidates(self.port))
+        state = {'in_flight': 0, 'done': False}
+        for _ in range(config.concurrency):
+            self.probeNext(msg, candidates, state)
+
+    def probeNext(self, msg, candidates, state):
+        if len(self.connections) + len(self.announcing) >= self.search_config.min_peers:
+            logging.debug("Stopping search")
+            candidates = iter(())
+        for addr, port in candidates:
+            logging.debug(f"Looking on: {addr}:{port}")
+            state['in_flight'] += 1
+            d = self.client(port, addr=addr, announce_msg=msg, timeout=self.search_config.timeout)
+            d.addBoth(self.probeDone, msg, candidates, state)
             return
-        logging.debug(f"Looking on: {addr}:{port}")
-        d = self.client(port, addr=addr, announce_msg=msg)
-        d.addCallback(self.continueSearch, msg, port_iter, addr, addr_iter)
+        # Nothing left to probe -> give ACKs time to arrive once all probes finish
+        if state['in_flight'] == 0 and not state['done']:
+            state['done'] = True
+            self.backend.callLater(SEARCH_SETTLE, self.searchFailed, msg)
 
-    def continueSearch(self, prot, msg, port_iter, addr, addr_iter):
-        reactor.callLater(0.1, self.search, msg, port_iter, addr, addr_iter)
+    def probeDone(self, result, msg, candidates, state):
+        state['in_flight'] -= 1
+        self.probeNext(msg, candidates, state)
 
     def searchFailed(self, msg):
+        # ACKs have had SEARCH_SETTLE to arrive; any still missing never will
+        self.announcing.clear()
+        self.searching = False
         if len(self.connections) > 0:
+            self.search_failures = 0
             return
         elif self.isolated:
             logging.warning("No nodes found on network.")
             self.part_of_network = True
             return
         else:
-            logging.warning(f"Search failed.")
+            config = self.search_config
+            delay = min(config.backoff * 2 ** self.search_failures, config.max_backoff)
+            self.search_failures += 1
+            logging.warning(f"Search failed, retrying in {delay}s.")
             self.isolated = True
-            reactor.callLater(5, self.search, msg)
+            self.backend.callLater(delay, self.search, msg)
+
+    # Whether max_peers are connected, so no more are taken on
+    def full(self):
+        return len(self.connections) >= self.max_peers
 
     def addNodeConnection(self, node_name, source):
         self.connections[node_name] = source
         self.part_of_network = True
 
+    # An address heard over a connection from the node itself replaces any
+    # known one, which may be stale (eg reloaded from a snapshot)
     def addNodeAddr(self, node_name, port, host, source=None):
         if node_name == self.id:
             return
-        if node_name not in self.IP_map:
+        if source is not None:
+            addr = f"{source.transport.getPeer().host}:{port}"
+            if self.IP_map.get(node_name) != addr:
+                logging.debug(f"Setting address of {node_name} to {addr}")
+                self.IP_map[node_name] = addr
+        elif node_name not in self.IP_map:
             logging.debug(f"{node_name} not in IP map, adding...")
-            if source is not None:
-                host = source.transport.getPeer().host
-            addr = f"{host}:{port}"
-            self.IP_map[node_name] = addr
+            self.IP_map[node_name] = f"{host}:{port}"
 
     def getPort(self):
         return str(self.port)
@@ -198,12 +381,12 @@ class IPNode(Factory):
         p.disconnect()
 
     def confirmConnection(self, prot, msg):
+        self.announcing.add(prot)
         self.sendMsg(msg, None, prot)
         return prot
 
-    def confirmMessage(self, prot, msg):
-        prot.sendMsg(msg)
-        return prot
+    def acknowledged(self, source):
+        self.announcing.discard(source)
 
     def verifyPeer(self, node_name):
         if node_name in self.IP_map and node_name not in self.icn_protocol.node.peers:
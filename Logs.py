@@ -0,0 +1,177 @@
+from Subscriptions import matchesPattern
+from Fib import flatName
+from logging.handlers import QueueHandler
+from time import time
+import atexit
+import json
+import logging
+import queue
+import threading
+
+LOG_FORMAT = '%(levelname)-8s %(message)s'
+# Every message sent and received is logged here, so these logs can be
+# sampled without losing warnings or anything else
+MSG_LOG = 'icn.msgs'
+# Structured records of traced names, never sampled
+TRACE_LOG = 'icn.trace'
+# Seconds between writes of queued records
+FLUSH_INTERVAL = 0.05
+
+# Arguments that can be formatted later on another thread as they are
+_IMMUTABLE = (str, int, float, bool, type(None))
+
+
+# Logger that keeps one in every `every` calls of each kind, ie of each log
+# call, since per-message logs are lazy %-format strings rather than
+# f-strings. The rest are dropped before a record is made for them.
+class SampledLogger(logging.Logger):
+    def __init__(self, name, level=logging.NOTSET):
+        super().__init__(name, level)
+        self.every = 1
+        self.counts = {}
+
+    def _log(self, level, msg, args, **kwargs):
+        if self.every > 1:
+            n = self.counts.get(msg, 0)
+            self.counts[msg] = n + 1
+            if n % self.every:
+                return
+        super()._log(level, msg, args, **kwargs)
+
+
+logging.setLoggerClass(SampledLogger)
+msg_log = logging.getLogger(MSG_LOG)
+logging.setLoggerClass(logging.Logger)
+trace_log = logging.getLogger(TRACE_LOG)
+# Traces show whatever the node's logging level
+trace_log.setLevel(logging.INFO)
+
+
+# Hands records to the background thread as they are, so formatting happens
+# there rather than on the reactor thread. Records with arguments that may
+# change before then (eg a message dict) are formatted first.
+class DeferredQueueHandler(QueueHandler):
+    def prepare(self, record):
+        if record.args and not all(isinstance(a, _IMMUTABLE) for a in record.args):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+# Writes queued records from a background thread. It wakes every interval
+# and writes whatever has queued up at once, rather than taking the GIL from
+# the reactor thread (and writing and flushing) for every record.
+class LogWriter:
+    def __init__(self, records, handler, interval=FLUSH_INTERVAL):
+        self.records = records
+        self.handler = handler
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='log-writer', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        lines = []
+        while True:
+            try:
+                record = self.records.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                lines.append(self.handler.format(record))
+            except Exception:
+                self.handler.handleError(record)
+        if lines:
+            stream = self.handler.stream
+            stream.write('\n'.join(lines) + '\n')
+            stream.flush()
+
+
+# Logs to stderr as before, each line starting with label if given. With
+# queued, records go through a queue to a handler on a background thread, so
+# the reactor thread never blocks on writes. With sample > 1 only one in
+# sample of each per-message log is kept.
+def setupLogging(level, label=None, queued=False, sample=1):
+    handler = logging.StreamHandler()
+    prefix = '{0:8}'.format(label + ':') if label is not None else ''
+    handler.setFormatter(logging.Formatter(prefix + LOG_FORMAT))
+    root = logging.getLogger()
+    root.setLevel(level)
+    # The format uses none of these, so they need not be looked up per record.
+    # They are process-wide, so only main() functions set logging up this way.
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    listener = None
+    if queued:
+        records = queue.SimpleQueue()
+        listener = LogWriter(records, handler)
+        listener.start()
+        atexit.register(listener.stop)
+        root.addHandler(DeferredQueueHandler(records))
+    else:
+        root.addHandler(handler)
+    msg_log.every = sample
+    return listener
+
+
+# Names a message is about: one for most, several for batches
+def messageNames(msg):
+    c = msg['content']
+    if not isinstance(c, dict):
+        return ()
+    if 'data_name' in c:
+        return (c['data_name'],)
+    if 'data_names' in c:
+        return c['data_names']
+    if 'items' in c:
+        return [item[0] for item in c['items']]
+    return ()
+
+
+# Per-message tracing for chosen names or prefixes (eg dublin_*), which can be
+# switched on and off while the node runs. Each message sent or received for
+# a traced name is logged as one JSON object.
+class Tracer:
+    def __init__(self, node_name, patterns=()):
+        self.node_name = node_name
+        self.patterns = set()
+        self.traced = 0
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern):
+        self.patterns.add(flatName(pattern))
+
+    def remove(self, pattern):
+        self.patterns.discard(flatName(pattern))
+
+    def traces(self, data_name):
+        return any(matchesPattern(pattern, data_name) for pattern in self.patterns)
+
+    # direction is 'in' or 'out', and peer the node the message came from or
+    # goes to
+    def trace(self, direction, msg, peer):
+        names = [n for n in messageNames(msg) if self.traces(n)]
+        if not names:
+            return
+        self.traced += 1
+        # Values, MACs and batch lists can be long; their names are enough
+        content = {k: v for k, v in msg['content'].items() if k not in ('data_val', 'mac', 'items', 'data_names')}
+        record = {'t': round(time(), 6), 'node': self.node_name, 'dir': direction, 'type': msg['type'],
+                  'peer': peer, 'ttl': msg['ttl'], 'names': names, **content}
+        trace_log.info("TRACE %s", json.dumps(record))
+
+    def __str__(self):
+        return str(sorted(self.patterns))
@@ -0,0 +1,124 @@
+from twisted.internet.task import LoopingCall
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+import logging
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0]
+
+REACTOR_LAG_INTERVAL = 1
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        # Crypto may be timed on thread pool workers
+        self.lock = Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+
+# Counters and latency histograms for one node, rendered in the Prometheus text
+# format. Values owned by other objects (table sizes, PIT counters) are
+# registered as callables and only read when scraped.
+class Metrics:
+    enabled = True
+
+    def __init__(self, node_name):
+        self.node_name = node_name
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+        self.lag_call = None
+        self.last_tick = None
+
+    def inc(self, name, label=None, n=1):
+        key = (name, label)
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def observe(self, name, value):
+        h = self.histograms.get(name)
+        if h is None:
+            h = self.histograms[name] = Histogram()
+        h.observe(value)
+
+    # kind is 'counter' or 'gauge'; f returns a number
+    def register(self, name, kind, f):
+        self.collectors.append((name, kind, f))
+
+    # Measures how late a LoopingCall fires, i.e. how long the reactor was busy
+    def startReactorLag(self, clock):
+        self.last_tick = perf_counter()
+        self.lag_call = LoopingCall(self._tick)
+        self.lag_call.clock = clock
+        self.lag_call.start(REACTOR_LAG_INTERVAL, now=False)
+
+    def _tick(self):
+        now = perf_counter()
+        self.observe('icn_reactor_lag_seconds', max(0.0, now - self.last_tick - REACTOR_LAG_INTERVAL))
+        self.last_tick = now
+
+    def render(self):
+        node = f'node="{self.node_name}"'
+        lines = []
+        seen = set()
+        for (name, label), value in sorted(self.counters.items(), key=lambda kv: (kv[0][0], kv[0][1] or '')):
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            labels = node if label is None else f'{node},type="{label}"'
+            lines.append(f"{name}{{{labels}}} {value}")
+        for name, kind, f in self.collectors:
+            try:
+                value = f()
+            except Exception as e:
+                logging.debug(f"Metric {name} failed: {e!r}")
+                continue
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name}{{{node}}} {value}")
+        for name, h in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, c in zip(h.buckets, h.counts):
+                cumulative += c
+                lines.append(f'{name}_bucket{{{node},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{node},le="+Inf"}} {h.count}')
+            lines.append(f"{name}_sum{{{node}}} {h.sum}")
+            lines.append(f"{name}_count{{{node}}} {h.count}")
+        return '\n'.join(lines) + '\n'
+
+
+# Stand-in used when metrics are disabled; every call is a no-op
+class NullMetrics:
+    enabled = False
+    counters = {}
+
+    def inc(self, name, label=None, n=1):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+    def register(self, name, kind, f):
+        pass
+
+    def startReactorLag(self, clock):
+        pass
+
+    def render(self):
+        return ''
+
+
+# Serves GET /metrics (any path) on localhost:port through the node's backend
+def startMetricsServer(metrics, port, backend, interface='127.0.0.1'):
+    metrics.startReactorLag(backend)
+    logging.info(f"Serving metrics on {interface}:{port}")
+    return backend.serveHTTP(port, metrics.render, interface)
@@ -0,0 +1,107 @@
+from Tlru import TLRU_Table, HEAP_COMPACT_FACTOR
+from Fib import nameComponents
+from time import time
+
+# Seconds a name that could not be found is failed straight away (0 - never)
+NEGATIVE_TTL = 5
+# Names under one prefix that must fail before the whole prefix is taken as
+# missing (eg nowhere_temp and nowhere_hum for every nowhere_ name)
+PREFIX_FAILURES = 3
+
+
+# Names and prefixes that recently could not be found on the network, per
+# downstream face that was told so, with the TTL the search went out with.
+# A face asking again within NEGATIVE_TTL, with a TTL that would search no
+# further, is answered with FAIL at once instead of the name being flooded
+# again. A search excludes the face it came from, so another face asking is
+# still searched for. DATA under the name clears its entries.
+class NegativeCache:
+    def __init__(self, size, ttl=NEGATIVE_TTL, max_bytes=None):
+        # (name or prefix components, face) -> TTL searched with
+        self.entries = TLRU_Table(size, max_bytes=max_bytes)
+        # (prefix, face) -> {last component: TTL} of names that failed, until
+        # there are enough of them
+        self.failures = TLRU_Table(size, max_bytes=max_bytes)
+        # Name or prefix components -> faces with an entry for them in either
+        # table, so DATA clears its own entries without scanning the rest.
+        # Entries that expire or are evicted stay here until compactIndex.
+        self.faces = {}
+        self.ttl = ttl
+        self.added = 0
+        # Requests failed from the cache, ie floods avoided
+        self.hits = 0
+
+    def add(self, data_name, faces, searched):
+        if searched < 1 or self.ttl <= 0:
+            return
+        ttu = time() + self.ttl
+        components = nameComponents(data_name)
+        prefix = components[:-1]
+        for face in faces:
+            self.put((components, face), searched, ttu)
+            self.added += 1
+            if prefix:
+                self.addToPrefix(prefix, components[-1], face, searched, ttu)
+
+    def addToPrefix(self, prefix, last, face, searched, ttu):
+        key = (prefix, face)
+        names = self.failures.get(key)[0] if self.failures.contains(key) else {}
+        names[last] = max(names.get(last, 0), searched)
+        if len(names) >= PREFIX_FAILURES:
+            self.failures.remove(key)
+            # The prefix was searched for as far as its least searched name
+            self.put(key, min(names.values()), ttu)
+        else:
+            self.failures.add(key, names, ttu)
+            self.index(key)
+
+    # Keeps the furthest search while an entry lasts
+    def put(self, key, searched, ttu):
+        if self.entries.contains(key):
+            searched = max(searched, self.entries.get(key)[0])
+        self.entries.add(key, searched, ttu)
+        self.index(key)
+
+    def index(self, key):
+        components, face = key
+        self.faces.setdefault(components, set()).add(face)
+        self.compactIndex()
+
+    # Rebuilds the index once names no longer in either table dominate it
+    def compactIndex(self):
+        if len(self.faces) > HEAP_COMPACT_FACTOR * (len(self.entries.vals) + len(self.failures.vals)) + 16:
+            self.faces = {}
+            for table in (self.entries, self.failures):
+                for components, face in table.vals:
+                    self.faces.setdefault(components, set()).add(face)
+
+    # Whether a request from face for data_name, sent on with ttl, would search
+    # no further than one that failed
+    def contains(self, data_name, face, ttl):
+        if not len(self.entries):
+            return False
+        components = nameComponents(data_name)
+        for key in ((components, face), (components[:-1], face)):
+            if key[0] and self.entries.contains(key) and self.entries.get(key)[0] >= ttl:
+                return True
+        return False
+
+    # DATA arrived for data_name, so neither it nor its prefix is missing
+    def clear(self, data_name):
+        if not self.faces:
+            return
+        components = nameComponents(data_name)
+        for key in (components, components[:-1]):
+            for face in self.faces.pop(key, ()):
+                self.entries.remove((key, face))
+                self.failures.remove((key, face))
+
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.entries.usedBytes() + self.failures.usedBytes(),
+                'added': self.added, 'hits': self.hits}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return str({f"{'_'.join(k)}@{face}": searched for (k, face), searched in self.entries.vals.items()})
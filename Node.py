@@ -1,106 +1,450 @@
 from ICNProtocol import ICNProtocol
-from Sensor import Sensor, TempSensor, PerSensor, HumSensor, BarSensor, CloudSensor, SnowSensor, WaterSensor, WindSensor
-from twisted.internet import reactor
-from Tlru import TLRU_Table
+from Sensor import TempSensor, PerSensor, HumSensor, BarSensor, CloudSensor, SnowSensor, WaterSensor, WindSensor
+from twisted.internet import defer
+from twisted.internet.task import LoopingCall
+from twisted.python.failure import Failure
+from Pit import PIT
+from Subscriptions import SubscriptionTable, matchesPattern
+from Rtt import RttTable
+from Strategy import makeStrategy, STRATEGIES, FLOOD, FANOUT
+from NegativeCache import NegativeCache, NEGATIVE_TTL
+from ContentStore import makeContentStore, POLICIES, LRU
+from Fib import FIB, nameComponents, flatName, prefixName
+from Codec import WIRE_FORMATS, FRAMED_TLV
+from Metrics import Metrics, NullMetrics, startMetricsServer
+from Logs import Tracer, setupLogging, msg_log
+from Transport import makeBackend, TwistedBackend, BACKENDS, TWISTED
+from Snapshot import Snapshot, SNAPSHOT_INTERVAL
+from Tables import TableLimits, PeerSet, parseLimits, sizeOf, ENTRY_OVERHEAD, TABLE_LIMITS, MAX_PEERS
+from DataCipher import loadDataKey, loadMacKey, DATA_KEY_ENV, MAC_KEY_ENV
+from IPNode import SearchConfig, parsePortRange, NETWORKS, MIN_PORT, MAX_PORT, SEARCH_CONCURRENCY, SEARCH_TIMEOUT, SEARCH_MIN_PEERS
 import logging
 import argparse
-from time import time, sleep
-from threading import Thread
+from time import time
+
+# Seconds a subscription lasts unless renewed
+SUBSCRIPTION_LEASE = 60
+# Times a request is sent again when nothing answers it in time
+MAX_RETRIES = 3
+# Time to wait of each attempt, in RTOs of the faces it goes to, so upstream PIT
+# entries expire soon after the consumer has given up on that attempt
+TTW_RTOS = 4
+
+SENSOR_TYPES = {
+    "_temp": TempSensor,
+    "_per": PerSensor,
+    "_hum": HumSensor,
+    "_bar": BarSensor,
+    "_cloud": CloudSensor,
+    "_snow": SnowSensor,
+    "_water": WaterSensor,
+    "_wind": WindSensor,
+}
+
+
+# Raised to fetch callers when data could not be found or did not arrive in time
+class FetchError(Exception):
+    pass
 
 
 class Node:
 
-    def __init__(self, node_id=None, port=None, data_n=None, data_v=None):
+    def __init__(self, node_id=None, port=None, data_n=None, data_v=None, *, wire_format=FRAMED_TLV, crypto_threads=0, eager_sensors=False, metrics_port=None, search_config=None, ip_node=None, content_store=None, backend=None, strategy=None, negative_ttl=NEGATIVE_TTL, trace=(), snapshot=None, snapshot_interval=SNAPSHOT_INTERVAL, limits=None, data_key=None, mac_key=None, accept_unsigned=False):
         self.name = node_id
-        self.PIT = TLRU_Table(3)
-        self.cache = TLRU_Table(3)
-        self.locations = TLRU_Table(3)
-        self.peers = []
+        # Timers and sockets come from the backend (the Twisted reactor or an asyncio loop)
+        self.reactor = backend or TwistedBackend()
+        # Entry and byte budgets of the tables below, and of the IP node's
+        self.limits = limits or TableLimits()
+        self.PIT = PIT(self.limits.entries('pit'), self.limits.bytes('pit'))
+        self.cache = content_store if content_store is not None else makeContentStore(LRU, 3)
+        self.locations = FIB(self.limits.entries('fib'), self.limits.bytes('fib'))
+        self.negative = NegativeCache(self.limits.entries('negative'), negative_ttl, self.limits.bytes('negative'))
+        self.peers = PeerSet()
         self.data = {}
         self.sensors = {}
-
-        self.icn = ICNProtocol(self, self.name, port)
-
+        # When each produced value was last refreshed
+        self.versions = {}
+        self.subscriptions = SubscriptionTable(self.limits.entries('subscriptions'), self.limits.bytes('subscriptions'))
+        # Renewal calls for this node's own subscriptions
+        self.renewals = {}
+        # Deferreds waiting in fetch() per data name
+        self.fetches = {}
+        # Round trip times per upstream face
+        self.rtt = RttTable(self.limits.entries('rtt'), self.limits.bytes('rtt'), self.peers.__contains__)
+        # Picks the peers a request goes to when there is no next hop for it
+        self.strategy = strategy if strategy is not None else makeStrategy(FLOOD)
+        # Retransmission timer, deadline and attempt of this node's own pending requests
+        self.retransmissions = {}
+        self.retransmitted = 0
+        self.timed_out = 0
+        # Metrics are only collected when they can be scraped
+        self.metrics = Metrics(self.name) if metrics_port is not None else NullMetrics()
+        # Names and prefixes whose messages are logged in full
+        self.tracer = Tracer(self.name, trace)
+
+        # Cache, routes and addresses kept on disk for warm restarts. Former
+        # peers are probed first when searching, so they reconnect quickly.
+        self.snapshot = None
+        saved = None
+        if snapshot is not None:
+            self.snapshot = Snapshot(snapshot)
+            saved = self.snapshot.load()
+            search_config = search_config or SearchConfig()
+            search_config.preferred = self.snapshot.peerAddrs(saved)
+
+        # The keys data is encrypted and signed with come from ICN_DATA_KEY and
+        # ICN_MAC_KEY unless given
+        data_key = data_key if data_key is not None else loadDataKey()
+        mac_key = mac_key if mac_key is not None else loadMacKey()
+        self.icn = ICNProtocol(self, self.name, port, wire_format=wire_format, crypto_threads=crypto_threads, search_config=search_config,
+                               ip_node=ip_node, backend=self.reactor, data_key=data_key, mac_key=mac_key, accept_unsigned=accept_unsigned)
+
+        if self.snapshot is not None:
+            self.snapshot.restore(self, saved)
+            self.snapshot_call = LoopingCall(self.saveSnapshot)
+            self.snapshot_call.clock = self.reactor
+            self.snapshot_call.start(snapshot_interval, now=False)
+
+        # Sensors refresh lazily when their value is read after going stale.
+        # With eager_sensors each one also gets its own LoopingCall on the reactor.
+        self.sensor_calls = {}
+        self.eager_sensors = eager_sensors
         if data_n is not None:
-            # Temperature sensor with a time to use of 60 (since it updates once per min)
-            self.sensors[data_n+"_temp"] = TempSensor(data_n, 60)
-            self.sensors[data_n+"_temp"].update()
-            self.data[data_n+"_temp"] = self.sensors[data_n+"_temp"].getValue()
-
-            self.sensors[data_n+"_per"] = PerSensor(data_n, 60)
-            self.sensors[data_n+"_per"].update()
-            self.data[data_n+"_per"] = self.sensors[data_n+"_per"].getValue()
-
-            self.sensors[data_n+"_hum"] = HumSensor(data_n, 60)
-            self.sensors[data_n+"_hum"].update()
-            self.data[data_n+"_hum"] = self.sensors[data_n+"_hum"].getValue()
-
-            self.sensors[data_n+"_bar"] = BarSensor(data_n, 60)
-            self.sensors[data_n+"_bar"].update()
-            self.data[data_n+"_bar"] = self.sensors[data_n+"_bar"].getValue()
-
-            self.sensors[data_n+"_cloud"] = CloudSensor(data_n, 60)
-            self.sensors[data_n+"_cloud"].update()
-            self.data[data_n+"_cloud"] = self.sensors[data_n+"_cloud"].getValue()
-
-            self.sensors[data_n+"_snow"] = SnowSensor(data_n, 60)
-            self.sensors[data_n+"_snow"].update()
-            self.data[data_n+"_snow"] = self.sensors[data_n+"_snow"].getValue()
-
-            self.sensors[data_n+"_water"] = WaterSensor(data_n, 60)
-            self.sensors[data_n+"_water"].update()
-            self.data[data_n+"_water"] = self.sensors[data_n+"_water"].getValue()
+            # Sensors with a time to use of 60 (since they update once per min)
+            for suffix, sensor_type in SENSOR_TYPES.items():
+                self.sensors[data_n+suffix] = sensor_type(data_n, 60)
+                self.refreshSensor(data_n+suffix)
+            if eager_sensors:
+                for data_name in self.sensors:
+                    self.scheduleSensor(data_name)
+
+        if metrics_port is not None:
+            self.registerMetrics()
+            startMetricsServer(self.metrics, metrics_port, self.reactor)
+
+    def addToPIT(self, data_name, node_name, ttw, count=1, nonce=None):
+        self.PIT.addFace(data_name, node_name, ttw, count, nonce)
+
+    # Adds node_name as another downstream face of an existing entry
+    def aggregateInPIT(self, data_name, node_name, ttw, nonce=None, looped=False):
+        self.PIT.aggregate(data_name, node_name, ttw, nonce, looped)
+
+    # Returns the downstream faces of the entry and the upstream count left
+    def removeCountFromPIT(self, data_name):
+        faces, count = self.PIT.removeCount(data_name)
+        return faces, count
 
-            self.sensors[data_n+"_wind"] = WindSensor(data_n, 60)
-            self.sensors[data_n+"_wind"].update()
-            self.data[data_n+"_wind"] = self.sensors[data_n+"_wind"].getValue()
+    def removeFromPIT(self, data_name):
+        faces, count = self.PIT.remove(data_name)
+        return faces, count
 
+    def pitStats(self):
+        return self.PIT.stats()
 
-        th = Thread(target=self.updateData, daemon=True)
-        th.start()
+    # Whether there is no room in the PIT for a new entry for data_name.
+    # Pending requests are never evicted for new ones; callers turn them away.
+    def pitFull(self, data_name):
+        if self.PIT.full(data_name):
+            self.PIT.rejected += 1
+            return True
+        return False
+
+    # Why an upstream face could not fully search for data_name, eg it was
+    # too busy (recording reason if it is the first), or None
+    def pitInconclusive(self, data_name, reason=None):
+        return self.PIT.inconclusive(data_name, reason)
+
+    # Entries and approximate bytes of each table, with their budgets (None if
+    # unlimited). Content Store bytes are those of the cached values.
+    def memoryReport(self):
+        ip_node = self.icn.ip_node
+        limits = self.limits
+        report = {
+            'cache': (len(self.cache), self.cache.bytes, self.cache.max_entries, self.cache.max_bytes),
+            'pit': (len(self.PIT), self.PIT.usedBytes(), self.PIT.size, self.PIT.max_bytes),
+            'fib': (len(self.locations), self.locations.bytes, self.locations.size, self.locations.max_bytes),
+            'negative': (len(self.negative.entries) + len(self.negative.failures),
+                         self.negative.entries.usedBytes() + self.negative.failures.usedBytes(),
+                         limits.entries('negative'), limits.bytes('negative')),
+            'addresses': (len(ip_node.IP_map), sizeOf(dict(ip_node.IP_map)) + ENTRY_OVERHEAD * len(ip_node.IP_map),
+                          limits.entries('addresses'), limits.bytes('addresses')),
+            'fallbacks': (len(ip_node.fallbacks), sizeOf(dict(ip_node.fallbacks)) + ENTRY_OVERHEAD * len(ip_node.fallbacks),
+                          limits.entries('fallbacks'), limits.bytes('fallbacks')),
+            'peers': (len(self.peers), sizeOf(list(self.peers)) + ENTRY_OVERHEAD * len(self.peers), limits.max_peers, None),
+            'sealed': (len(self.icn.sealed), self.icn.sealed.bytes, limits.entries('sealed'), limits.bytes('sealed')),
+            'batch_faces': (len(self.icn.batch_faces), self.icn.batch_faces.bytes, limits.entries('batch_faces'), limits.bytes('batch_faces')),
+            'rtt': (len(self.rtt), self.rtt.faces.bytes, limits.entries('rtt'), limits.bytes('rtt')),
+            'subscriptions': (len(self.subscriptions.patterns) + len(self.subscriptions.upstream) + len(self.subscriptions.delivered),
+                              self.subscriptions.usedBytes(), limits.entries('subscriptions'), limits.bytes('subscriptions')),
+        }
+        return {table: {'entries': e, 'bytes': b, 'max_entries': me, 'max_bytes': mb} for table, (e, b, me, mb) in report.items()}
+
+    def cacheHitRatio(self):
+        hits = self.metrics.counters.get(('icn_cache_hits_total', None), 0)
+        misses = self.metrics.counters.get(('icn_cache_misses_total', None), 0)
+        return hits / (hits + misses) if hits + misses else 0.0
+
+    def registerMetrics(self):
+        m = self.metrics
+        m.register('icn_pit_entries', 'gauge', lambda: len(self.PIT))
+        m.register('icn_pit_created_total', 'counter', lambda: self.PIT.created)
+        m.register('icn_pit_aggregated_total', 'counter', lambda: self.PIT.aggregated)
+        m.register('icn_pit_duplicates_total', 'counter', lambda: self.PIT.duplicates)
+        m.register('icn_pit_loops_total', 'counter', lambda: self.PIT.loops)
+        m.register('icn_pit_satisfied_total', 'counter', lambda: self.PIT.satisfied)
+        m.register('icn_pit_failed_total', 'counter', lambda: self.PIT.failed)
+        m.register('icn_pit_expired_total', 'counter', lambda: self.PIT.expired)
+        m.register('icn_cache_entries', 'gauge', lambda: len(self.cache))
+        m.register('icn_cache_bytes', 'gauge', lambda: self.cache.bytes)
+        m.register('icn_cache_rejected_total', 'counter', lambda: self.cache.rejected)
+        m.register('icn_cache_evicted_total', 'counter', lambda: self.cache.evicted)
+        m.register('icn_cache_hit_ratio', 'gauge', self.cacheHitRatio)
+        m.register('icn_fib_entries', 'gauge', lambda: len(self.locations))
+        m.register('icn_negative_entries', 'gauge', lambda: len(self.negative))
+        m.register('icn_negative_added_total', 'counter', lambda: self.negative.added)
+        m.register('icn_floods_avoided_total', 'counter', lambda: self.negative.hits)
+        m.register('icn_peers', 'gauge', lambda: len(self.peers))
+        m.register('icn_subscriptions', 'gauge', lambda: len(self.subscriptions))
+        m.register('icn_subscription_pushes_total', 'counter', lambda: self.subscriptions.pushed)
+        m.register('icn_retransmissions_total', 'counter', lambda: self.retransmitted)
+        m.register('icn_request_timeouts_total', 'counter', lambda: self.timed_out)
+        m.register('icn_rtt_samples_total', 'counter', lambda: self.rtt.samples)
+        m.register('icn_pending_requests', 'gauge', lambda: len(self.retransmissions))
+        m.register('icn_sealed_entries', 'gauge', lambda: len(self.icn.sealed))
+        m.register('icn_traced_messages_total', 'counter', lambda: self.tracer.traced)
+        m.register('icn_pit_bytes', 'gauge', self.PIT.usedBytes)
+        m.register('icn_pit_rejected_total', 'counter', lambda: self.PIT.rejected)
+        m.register('icn_fib_bytes', 'gauge', lambda: self.locations.bytes)
+        m.register('icn_address_entries', 'gauge', lambda: len(self.icn.ip_node.IP_map))
+        m.register('icn_address_evicted_total', 'counter', lambda: self.icn.ip_node.IP_map.evicted)
+        m.register('icn_peers_refused_total', 'counter', lambda: self.icn.ip_node.refused)
+        m.register('icn_table_bytes', 'gauge', lambda: sum(t['bytes'] for t in self.memoryReport().values()))
+        m.register('icn_snapshot_rows_total', 'counter', lambda: self.snapshot.rows if self.snapshot else 0)
+
+    # Returns (new face, forward upstream) like SubscriptionTable.subscribe.
+    # Sensors with subscribers refresh on their own so updates can be pushed.
+    def addSubscription(self, pattern, face, expiry):
+        new, forward = self.subscriptions.subscribe(pattern, face, expiry)
+        if expiry > time():
+            for data_name in self.producedNames(pattern):
+                if data_name in self.sensors:
+                    self.scheduleSensor(data_name)
+        return new, forward
+
+    def subscribedFaces(self, data_name, ttu):
+        return self.subscriptions.faces(data_name, ttu)
+
+    def producedNames(self, pattern):
+        return [data_name for data_name in self.data if matchesPattern(pattern, data_name)]
+
+    # Keeps a lease on a name or prefix (eg dublin_*) alive so updates are
+    # pushed to this node, renewing it every third of the lease
+    def subscribe(self, pattern, lease=SUBSCRIPTION_LEASE):
+        pattern = flatName(pattern)
+        if pattern in self.renewals:
+            return
+        call = LoopingCall(self.renewSubscription, pattern, lease)
+        call.clock = self.reactor
+        self.renewals[pattern] = call
+        call.start(lease / 3)
+
+    def renewSubscription(self, pattern, lease):
+        self.icn.subscribe(pattern, time() + lease)
+
+    # Logs every message for a name or prefix (eg dublin_*) until untraced
+    def trace(self, pattern):
+        self.tracer.add(pattern)
+
+    def untrace(self, pattern):
+        self.tracer.remove(pattern)
+
+    def unsubscribe(self, pattern):
+        pattern = flatName(pattern)
+        call = self.renewals.pop(pattern, None)
+        if call is None:
+            return
+        if call.running:
+            call.stop()
+        self.icn.subscribe(pattern, time())
+
+    # Pushes a refreshed value to its subscribers. Sensors nobody subscribes
+    # to any more go back to refreshing lazily.
+    def publish(self, data_name):
+        data_val, ttu = self.getPublished(data_name)
+        faces = self.subscribedFaces(data_name, ttu)
+        if faces:
+            self.subscriptions.pushed += len(faces)
+            self.icn.pushData(data_name, data_val, faces)
+        elif data_name in self.sensor_calls and not self.eager_sensors:
+            self.unscheduleSensor(data_name)
+
+    # Value of a produced name as last published. Its ttu is fixed per refresh,
+    # so copies of one update arriving over different paths can be recognised.
+    def getPublished(self, data_name):
+        data_val, ttu = self.data[data_name]
+        return data_val, self.versions.get(data_name, time()) + ttu
+
+    # Produced names covered by pattern whose current value a new subscriber
+    # should be sent. Stale sensors are refreshed instead, which pushes their
+    # new value to every subscriber.
+    def currentNames(self, pattern):
+        return [data_name for data_name in self.producedNames(pattern)
+                if data_name not in self.sensors or not self.refreshSensor(data_name)]
+
+    # When a produced value was last refreshed, refreshing it first if stale.
+    # Replies are sealed once per version (see ICNProtocol.seal).
+    def dataVersion(self, data_name):
+        if data_name in self.sensors:
+            self.refreshSensor(data_name)
+        return self.versions.get(data_name)
 
-    def addToPIT(self, data_name, node_name, ttw, count=1):
-        self.PIT.add(data_name, node_name, ttw, count)
+    def hasPITEntry(self, data_name):
+        return self.PIT.contains(data_name)
 
-    def removeCountFromPIT(self, data_name):
-        dest, count = self.PIT.removeCount(data_name)
-        return dest, count
+    # Whether a request from node_name is it asking again after its own
+    # timeout, rather than a copy of one request arriving over another path.
+    # Copies arrive within half an RTO of this node sending the request on.
+    def isRetransmission(self, data_name, node_name):
+        if not self.PIT.hasFace(data_name, node_name):
+            return False
+        out = self.PIT.unanswered(data_name)
+        if not out:
+            return True
+        last = max(sent for face, sent in out)
+        return time() - last >= self.rtt.timeout([face for face, sent in out]) / 2
+
+    # Whether a request with nonce is a copy of one pending here that came by
+    # another path, and so is being searched for already. Counted if so.
+    def isDuplicate(self, data_name, nonce):
+        if self.PIT.seen(data_name, nonce):
+            self.PIT.duplicates += 1
+            return True
+        return False
+
+    # Whether a copy of a pending request (same nonce) came by a shorter path,
+    # so has more hops left than the request was sent on with. It is sent on
+    # again to search that much further.
+    def searchesFurther(self, data_name, nonce, ttl):
+        return self.PIT.seen(data_name, nonce) and ttl > self.PIT.searched(data_name)
+
+    # Whether this node sent node_name its own request for data_name and is
+    # still waiting on it, ie each would be waiting on the other
+    def isLooped(self, data_name, node_name):
+        return self.PIT.sentTo(data_name, node_name)
+
+    # Downstream faces the pending request for data_name was sent on for.
+    # Faces that joined it were only searched for in part.
+    def forwardedFor(self, data_name):
+        return self.PIT.forwardedFor(data_name)
+
+    # Out-records give each upstream face's round trip time when it answers
+    def requestSent(self, data_name, node_name, ttl):
+        self.PIT.sent(data_name, node_name, time(), ttl)
+
+    # Called with every DATA and FAIL. Returns whether node_name still owed an
+    # answer. Round trip times are only sampled from requests sent once
+    # (Karn's algorithm). A face that failed a duplicate of a request it had
+    # already is not held against it.
+    def requestAnswered(self, node_name, data_name, failed=False, duplicate=False):
+        out = self.PIT.answered(data_name, node_name)
+        if out is None:
+            return False
+        sent, repeated = out
+        if failed:
+            if not duplicate:
+                self.strategy.failed(node_name, data_name)
+            return True
+        rtt = None if repeated else time() - sent
+        if rtt is not None:
+            self.rtt.sample(node_name, rtt)
+        self.strategy.answered(node_name, data_name, rtt)
+        return True
+
+    # Backs off the RTO of every face that has had longer than it to answer
+    def backOffFaces(self, data_name):
+        now = time()
+        for face, sent in self.PIT.unanswered(data_name):
+            if now - sent >= self.rtt.rto(face):
+                self.rtt.backoff(face)
+                self.strategy.timedOut(face, data_name)
+
+    # Known next hop for data_name, unless it has stopped answering (requests
+    # are then flooded until it answers again)
+    def nextHop(self, data_name):
+        if not self.hasLocation(data_name):
+            return None
+        hop = self.getLocation(data_name)
+        if hop not in self.peers or self.rtt.failing(hop):
+            return None
+        return hop
 
-    def removeFromPIT(self, data_name):
-        dest, count = self.PIT.remove(data_name)
-        return dest, count
+    # Peers other than exclude (the requester) that the strategy picks for data_name
+    def forwardingFaces(self, data_name, exclude=None):
+        faces = [n for n in self.peers if n != exclude]
+        return self.strategy.choose(data_name, faces) if faces else []
 
-    def hasPITEntry(self, data_name):
-        return self.PIT.contains(data_name)
+    # Faces a request from this node for data_name is likely to go to
+    def requestFaces(self, data_name):
+        hop = self.nextHop(data_name)
+        return [hop] if hop is not None else self.strategy.ranked(data_name, self.peers)[:1] or list(self.peers)
 
     def canRequestFrom(self, node_name):
         for d in self.PIT:
-            print(d)
-            if d in self.locations:
-                if self.locations[d] == node_name:
+            if self.hasLocation(d):
+                if self.getLocation(d) == node_name:
                     v, t = self.PIT.get(d)
                     return True, d, v, t
         return False, None, None, None
 
+    # Whether node_name was recently told data_name (or its prefix) could not
+    # be found within ttl hops of here. Callers fail the request instead of
+    # flooding it again, which is counted.
+    def knownMissing(self, data_name, node_name, ttl):
+        if self.negative.contains(data_name, node_name, ttl):
+            self.negative.hits += 1
+            return True
+        return False
+
+    # How many hops out the pending request for data_name was sent
+    def searchedTTL(self, data_name):
+        return self.PIT.searched(data_name)
+
+    def addMissing(self, data_name, faces, ttl):
+        self.negative.add(data_name, faces, ttl)
+
+    def clearMissing(self, data_name):
+        self.negative.clear(data_name)
+
     def hasLocation(self, data_name):
         if self.locations.contains(data_name):
             return True
         else:
             return False
 
+    # Learns a route for the name and for its producer prefix (eg /dublin for
+    # dublin_temp), so later requests for sibling names skip flooding
     def addLocation(self, data_name, location):
+        prefix = nameComponents(data_name)[:-1]
+        if prefix:
+            self.locations.add(prefixName(prefix), location)
         self.locations.add(data_name, location)
 
+    # Drops the route a request for the name would take, and the producer
+    # prefix route added with it if that points at the same node
     def removeLocation(self, data_name):
         dest, count = self.locations.remove(data_name)
+        prefix = nameComponents(data_name)[:-1]
+        if dest is not None and prefix and self.locations.entries.get(prefix) == dest:
+            self.locations.removePrefix(prefix)
         return dest, count
 
     def getLocation(self, data_name):
-        location, t = self.locations.get(data_name)
-        return location
+        return self.locations.get(data_name)
 
-    def cacheData(self, data_name, data_val, ttu):
-        self.cache.add(data_name, data_val, ttu)
+    # The MAC, if the producer signed the data, is kept with it so replies
+    # from the cache can still be verified downstream
+    def cacheData(self, data_name, data_val, ttu, mac=None):
+        self.cache.add(data_name, (data_val, mac) if mac is not None else data_val, ttu)
 
     def hasCache(self, data_name):
         if self.cache.contains(data_name):
@@ -108,17 +452,18 @@ class Node:
         else:
             return False
 
+    # Returns (data_val, ttu, mac), mac being None for unsigned data
     def getCache(self, data_name):
         data, ttu = self.cache.get(data_name)
-        return data, ttu
+        if isinstance(data, tuple):
+            return data[0], ttu, data[1]
+        return data, ttu, None
 
     def addPeer(self, node_name):
-        if node_name not in self.peers:
-            self.peers.append(node_name)
+        self.peers.add(node_name)
 
     def removePeer(self, node_name):
-        if node_name in self.peers:
-            self.peers.remove(node_name)
+        self.peers.discard(node_name)
 
     def hasData(self, data_name):
         if data_name in self.data:
@@ -127,10 +472,24 @@ class Node:
             return False
 
     def run(self):
-        self.reactor = reactor
         self.reactor.run()
+        self.saveSnapshot()
+
+    # Writes what changed in the cache, routes and addresses since last time
+    def saveSnapshot(self):
+        if self.snapshot is None:
+            return
+        try:
+            rows = self.snapshot.save(self)
+        except Exception as e:
+            logging.warning(f"Could not save snapshot to {self.snapshot.path}: {e}")
+            return
+        if rows:
+            logging.debug(f"Saved {rows} changed rows to {self.snapshot.path}")
 
     def getData(self, data_name):
+        if data_name in self.sensors:
+            self.refreshSensor(data_name)
         if data_name in self.data:
             data_val, ttu = self.data[data_name]
             ttu += time()
@@ -138,36 +497,184 @@ class Node:
         else:
             return None
 
+    # Requests data_name, sending the request again with backoff while nothing
+    # answers, until it arrives, FAIL comes back or ttw seconds have passed
     def requestData(self, data_name, ttw=10):
-        ttw += time()
-        self.icn.requestData(data_name, ttw)
+        data_name = flatName(data_name)
+        deadline = time() + ttw
+        if not self.extendRequest(data_name, deadline):
+            self.sendRequest(data_name, deadline, 0)
+
+    def requestBatch(self, data_names, ttw=10):
+        deadline = time() + ttw
+        data_names = [n for n in dict.fromkeys(map(flatName, data_names)) if not self.extendRequest(n, deadline)]
+        if not data_names:
+            return
+        ttw, retry_at = self.attemptTimes(self.peers, deadline, 0)
+        for data_name in data_names:
+            self.watchRequest(data_name, deadline, 0, retry_at)
+        self.icn.requestBatch(data_names, ttw)
+
+    # A request already pending just waits until the later deadline
+    def extendRequest(self, data_name, deadline):
+        pending = self.retransmissions.get(data_name)
+        if pending is None:
+            return False
+        pending[1] = max(pending[1], deadline)
+        return True
+
+    # (time to wait, time to retransmit or give up) of an attempt going to
+    # faces. The last attempt is given up on once its time to wait is over.
+    def attemptTimes(self, faces, deadline, attempt):
+        now = time()
+        rto = self.rtt.timeout(faces)
+        ttw = min(deadline, now + TTW_RTOS * rto)
+        if attempt >= MAX_RETRIES:
+            return ttw, ttw
+        return ttw, min(ttw, now + rto)
+
+    def sendRequest(self, data_name, deadline, attempt):
+        ttw, retry_at = self.attemptTimes(self.requestFaces(data_name), deadline, attempt)
+        # The answer may come back before requestData returns (eg local data)
+        self.watchRequest(data_name, deadline, attempt, retry_at)
+        self.icn.requestData(data_name, ttw, retransmit=attempt > 0)
+
+    def watchRequest(self, data_name, deadline, attempt, retry_at):
+        call = self.reactor.callLater(max(0, retry_at - time()), self.requestTimedOut, data_name)
+        self.retransmissions[data_name] = [call, deadline, attempt]
+
+    def requestTimedOut(self, data_name):
+        call, deadline, attempt = self.retransmissions.pop(data_name)
+        self.backOffFaces(data_name)
+        if attempt >= MAX_RETRIES or time() >= deadline:
+            self.timed_out += 1
+            logging.warning(f"Request for {data_name} timed out")
+            self.PIT.removeFace(data_name, self.name)
+            self.failData(data_name, "timed out")
+            return
+        self.retransmitted += 1
+        msg_log.info("Retransmitting request for %s (attempt %s)", data_name, attempt + 2)
+        self.sendRequest(data_name, deadline, attempt + 1)
+
+    def stopRetransmission(self, data_name):
+        pending = self.retransmissions.pop(data_name, None)
+        if pending is not None and pending[0].active():
+            pending[0].cancel()
+
+    # Requests data_name and returns something to wait on for its value: a
+    # Deferred under Twisted or an asyncio future under asyncio, so
+    # `await node.fetch(name)` works there. Fails with FetchError if the
+    # network answers FAIL or nothing arrives within timeout seconds.
+    def fetch(self, data_name, timeout=10):
+        data_name = flatName(data_name)
+        d = defer.Deferred()
+        self.fetches.setdefault(data_name, []).append(d)
+        d.addTimeout(timeout, self.reactor)
+        d.addBoth(self.fetchDone, data_name, d)
+        self.requestData(data_name, timeout)
+        return self.reactor.wrap(d)
+
+    def fetchDone(self, result, data_name, d):
+        waiting = self.fetches.get(data_name)
+        if waiting is not None and d in waiting:
+            waiting.remove(d)
+            if not waiting:
+                del self.fetches[data_name]
+        if isinstance(result, Failure) and result.check(defer.TimeoutError):
+            raise FetchError(f"Timed out waiting for {data_name}")
+        return result
+
+    # Called by the protocol with every value that arrives for this node
+    def deliverData(self, data_name, data_val):
+        self.stopRetransmission(data_name)
+        for d in self.fetches.pop(data_name, ()):
+            d.callback(data_val)
+        self.useData(data_name, data_val)
+
+    def failData(self, data_name, reason="could not be found on network"):
+        self.stopRetransmission(data_name)
+        for d in self.fetches.pop(data_name, ()):
+            d.errback(FetchError(f"{data_name} {reason}"))
 
     def useData(self, data_name, data_val):
-        logging.info(f"Received {data_name} with a value of {data_val}")
-
-    # Update data sources loop
-    def updateData(self):
-        while True:
-            for k, s in self.sensors.items():
-                s.update()
-                self.data[k] = s.getValue()
-            sleep(10)
+        logging.info("Received %s with a value of %s", data_name, data_val)
+
+    # Updates a sensor if its value is stale. Runs on the reactor thread and
+    # replaces the (value, ttu) tuple in one assignment, so reads never see
+    # a partial update. Returns True if the value was refreshed.
+    def refreshSensor(self, data_name, force=False):
+        sensor = self.sensors[data_name]
+        if sensor.update(force) or data_name not in self.data:
+            self.data[data_name] = sensor.getValue()
+            self.versions[data_name] = time()
+            self.publish(data_name)
+            return True
+        return False
+
+    # Refreshes a sensor every interval seconds, independent of requests
+    def scheduleSensor(self, data_name):
+        if data_name in self.sensor_calls:
+            return
+        sensor = self.sensors[data_name]
+        call = LoopingCall(self.refreshSensor, data_name, True)
+        call.clock = self.reactor
+        call.start(sensor.interval, now=False)
+        self.sensor_calls[data_name] = call
+
+    def unscheduleSensor(self, data_name):
+        call = self.sensor_calls.pop(data_name, None)
+        if call is not None and call.running:
+            call.stop()
 
     def __str__(self):
-        str = f"Name: {self.name}\nPIT:\n{self.PIT}\nCache:\n{self.cache}\nLocations:\n{self.locations}\nPeers:\n{self.peers}\n"
+        str = f"Name: {self.name}\nPIT:\n{self.PIT}\n{self.pitStats()}\nCache:\n{self.cache}\n{self.cache.stats()}\nSubscriptions:\n{self.subscriptions}\n{self.subscriptions.stats()}\nRTT:\n{self.rtt}\nStrategy:\n{self.strategy}\n{self.strategy.stats()}\nLocations:\n{self.locations}\nNegative:\n{self.negative}\n{self.negative.stats()}\nTraced:\n{self.tracer}\nPeers:\n{self.peers}\n"
         str += f"Data:\n{self.data}\nIP map:\n{self.icn.ip_node.IP_map}\nConnections:\n{self.icn.ip_node.connections}\nFallback:"
-        return str + f"\n{self.icn.ip_node.fallback_address}\nFallbacks:\n{self.icn.ip_node.fallbacks}"
+        str += f"\n{self.icn.ip_node.fallback_address}\nFallbacks:\n{self.icn.ip_node.fallbacks}"
+        str += f"\nMemory:\n{self.memoryReport()}"
+        return str + (f"\nSnapshot:\n{self.snapshot.stats()}" if self.snapshot is not None else "")
 
 
-def main():
+# Command line options of a node, shared by Node.py and UserNode.py
+def nodeArgParser():
     parser = argparse.ArgumentParser()
     parser.add_argument('--node-name', help='Name for node in this network', type=str)
     parser.add_argument('--port', help='Port for this node', type=int, default=5789)
     parser.add_argument('--data-n', help='Data name for this node', type=str, default=None)
     parser.add_argument('--data-v', help='Data for the node', type=str, default="10")
     parser.add_argument('--logging-level', help='Logging level: 10 - Debug, 20 - Info, 30 - Warnings', type=int, default=20)
-    args = parser.parse_args()
-
+    parser.add_argument('--wire-format', help='Wire format for outgoing connections', choices=WIRE_FORMATS, default=FRAMED_TLV)
+    parser.add_argument('--crypto-threads', help='Threads to offload encryption to (0 - encrypt on the reactor thread)', type=int, default=0)
+    parser.add_argument('--eager-sensors', help='Refresh sensors every interval instead of only when read', action='store_true')
+    parser.add_argument('--metrics-port', help='Serve metrics on this localhost port (disabled if not set)', type=int, default=None)
+    parser.add_argument('--search-hosts', help='Addresses to look for peers on', type=str, nargs='+', default=NETWORKS)
+    parser.add_argument('--search-ports', help='Port range to look for peers on, MIN-MAX', type=str, default=f"{MIN_PORT}-{MAX_PORT}")
+    parser.add_argument('--search-concurrency', help='Connection attempts to make at once while searching', type=int, default=SEARCH_CONCURRENCY)
+    parser.add_argument('--search-timeout', help='Seconds to wait for each connection attempt', type=float, default=SEARCH_TIMEOUT)
+    parser.add_argument('--cache-policy', help='Content Store replacement policy', choices=POLICIES, default=LRU)
+    parser.add_argument('--cache-entries', help='Content Store capacity in entries', type=int, default=3)
+    parser.add_argument('--cache-bytes', help='Content Store capacity in bytes (unlimited if not set)', type=int, default=None)
+    parser.add_argument('--cache-admit', help='Probability of caching Data that passes through (cache-less-for-more)', type=float, default=1.0)
+    parser.add_argument('--backend', help='Event loop to run the node on', choices=BACKENDS, default=TWISTED)
+    parser.add_argument('--strategy', help='Forwarding strategy for requests with no known next hop', choices=STRATEGIES, default=FLOOD)
+    parser.add_argument('--fanout', help='Peers the probabilistic strategy sends each request to', type=int, default=FANOUT)
+    parser.add_argument('--negative-ttl', help='Seconds to answer requests for a name that could not be found with FAIL (0 - never)', type=float, default=NEGATIVE_TTL)
+    parser.add_argument('--log-queue', help='Write logs from a background thread instead of the reactor thread', action='store_true')
+    parser.add_argument('--log-sample', help='Keep one in this many per-message logs', type=int, default=1)
+    parser.add_argument('--trace', help='Names or prefixes (eg dublin_*) to log every message of', type=str, nargs='+', default=[])
+    parser.add_argument('--snapshot', help='File to keep the cache, routes and addresses in across restarts', type=str, default=None)
+    parser.add_argument('--snapshot-interval', help='Seconds between snapshots', type=float, default=SNAPSHOT_INTERVAL)
+    parser.add_argument('--table-limits', help=f"Entry and byte budgets of node tables, TABLE=ENTRIES[:BYTES] (tables: {', '.join(TABLE_LIMITS)})", type=str, nargs='+', default=[])
+    parser.add_argument('--max-peers', help='Most peers to stay connected to', type=int, default=MAX_PEERS)
+    parser.add_argument('--min-peers', help='Stop searching once this many peers are connected', type=int, default=SEARCH_MIN_PEERS)
+    parser.add_argument('--data-key-file', help=f"File holding the key data values are encrypted with (default: the {DATA_KEY_ENV} environment variable)", type=str, default=None)
+    parser.add_argument('--mac-key-file', help=f"File holding the key DATA is signed with (default: the {MAC_KEY_ENV} environment variable)", type=str, default=None)
+    parser.add_argument('--accept-unsigned', help='Accept DATA without a MAC, from nodes that do not sign it', action='store_true')
+    return parser
+
+
+# Node keyword arguments for parsed options (see nodeArgParser); exits if the
+# node has no name, port or data key
+def nodeKwargs(args):
     if args.node_name is None:
         print("Please specify a node name")
         exit(1)
@@ -176,9 +683,42 @@ def main():
         print("Please specify the port for this node")
         exit(1)
 
-    logging.basicConfig(level=args.logging_level, format='{0:8}%(levelname)-8s %(message)s'.format(args.node_name + ':'))
+    data_key = loadDataKey(args.data_key_file)
+    if data_key is None:
+        print(f"Please set the data key ({DATA_KEY_ENV} or --data-key-file)")
+        exit(1)
+
+    min_port, max_port = parsePortRange(args.search_ports)
+    return {
+        'node_id': args.node_name,
+        'port': args.port,
+        'data_n': args.data_n,
+        'data_v': args.data_v,
+        'wire_format': args.wire_format,
+        'crypto_threads': args.crypto_threads,
+        'eager_sensors': args.eager_sensors,
+        'metrics_port': args.metrics_port,
+        'search_config': SearchConfig(args.search_hosts, min_port, max_port, args.search_concurrency, args.search_timeout, args.min_peers),
+        'content_store': makeContentStore(args.cache_policy, args.cache_entries, args.cache_bytes, args.cache_admit),
+        'backend': makeBackend(args.backend),
+        'strategy': makeStrategy(args.strategy, args.fanout),
+        'negative_ttl': args.negative_ttl,
+        'trace': args.trace,
+        'snapshot': args.snapshot,
+        'snapshot_interval': args.snapshot_interval,
+        'limits': TableLimits(parseLimits(args.table_limits), args.max_peers),
+        'data_key': data_key,
+        'mac_key': loadMacKey(args.mac_key_file),
+        'accept_unsigned': args.accept_unsigned,
+    }
+
+
+def main():
+    args = nodeArgParser().parse_args()
+    kwargs = nodeKwargs(args)
+    setupLogging(args.logging_level, args.node_name, args.log_queue, args.log_sample)
     logging.debug(f"Running node {args.node_name}")
-    n = Node(args.node_name, args.port, args.data_n, args.data_v)
+    n = Node(**kwargs)
     n.run()
 
 
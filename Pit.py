@@ -0,0 +1,212 @@
+from Tlru import TLRU_Table
+from Tables import ENTRY_OVERHEAD
+from time import time
+
+# Rough bytes per downstream face or out-record of an entry, face name included
+FACE_BYTES = 48
+
+
+# Downstream faces waiting on one data name, each with its own time to wait,
+# and the upstream faces it was sent to with when (out-records)
+class PITEntry:
+    __slots__ = ('faces', 'out', 'ttl', 'inconclusive', 'nonces', 'forwarded')
+
+    def __init__(self):
+        self.faces = {}
+        # face -> (time last sent, whether it was sent there more than once)
+        self.out = {}
+        # Largest TTL the request was sent on with, ie how far it was searched for
+        self.ttl = 0
+        # Reason an upstream face gave for not searching fully (eg its PIT was
+        # full), if one did
+        self.inconclusive = None
+        # Nonces of the requests sent on or joined, to tell copies of one
+        # request coming back by another path from other nodes' requests
+        self.nonces = set()
+        # Downstream faces the request was sent on for, as opposed to faces
+        # that joined it (see ICNProtocol.handleFail)
+        self.forwarded = set()
+
+    def liveFaces(self, now=None):
+        now = now or time()
+        return [f for f, ttw in self.faces.items() if ttw >= now]
+
+    def __repr__(self):
+        return repr(list(self.faces))
+
+
+# Pending Interest Table. Each entry records every downstream face that asked
+# for the name, so repeated requests are aggregated instead of forwarded again.
+# The count is the number of upstream requests still outstanding, as before.
+# Once size entries or max_bytes are taken, new names are refused rather than
+# evicting requests still in flight (see full).
+class PIT(TLRU_Table):
+    evicts = False
+
+    def __init__(self, size, max_bytes=None):
+        super().__init__(size, max_bytes=max_bytes)
+        self.created = 0
+        self.aggregated = 0
+        # Copies of a pending request turned away, and requests from faces the
+        # entry was waiting on itself
+        self.duplicates = 0
+        self.loops = 0
+        self.satisfied = 0
+        self.failed = 0
+        # New names turned away while full
+        self.rejected = 0
+
+    def entryBytes(self, data_name, entry):
+        return ENTRY_OVERHEAD + len(data_name) + FACE_BYTES * (len(entry.faces) + len(entry.out))
+
+    # Whether there is no room for a new entry for data_name
+    def full(self, data_name):
+        if self.contains(data_name):
+            return False
+        if len(self.vals) >= self.size:
+            return True
+        return self.max_bytes is not None and self.bytes + ENTRY_OVERHEAD + len(data_name) + FACE_BYTES > self.max_bytes
+
+    # Adds a downstream face. count sets the outstanding upstream count, ie
+    # how many faces the request is about to be sent to, on top of those yet
+    # to answer an earlier send (see sent). None leaves it unchanged: the face
+    # joined the request rather than it being sent on for the face. Returns
+    # True if this created the entry.
+    def addFace(self, data_name, face, ttw, count=None, nonce=None):
+        if self.contains(data_name):
+            entry = self.vals[data_name]
+            entry.faces[face] = max(entry.faces.get(face, 0), ttw)
+            if nonce is not None:
+                entry.nonces.add(nonce)
+            if count is not None:
+                self.counts[data_name] = count + len(entry.out)
+                entry.forwarded.add(face)
+            if ttw > self.times[data_name]:
+                self.add(data_name, entry, ttw, self.counts[data_name])
+            else:
+                self.resize(data_name)
+            return False
+        if time() > ttw:
+            return False
+        if self.full(data_name):
+            self.rejected += 1
+            return False
+        entry = PITEntry()
+        entry.faces[face] = ttw
+        if nonce is not None:
+            entry.nonces.add(nonce)
+        entry.forwarded.add(face)
+        self.add(data_name, entry, ttw, 1 if count is None else count)
+        self.created += 1
+        return True
+
+    # Records a request that was absorbed by an existing entry, looped if it
+    # came from a face the entry is waiting on
+    def aggregate(self, data_name, face, ttw, nonce=None, looped=False):
+        self.addFace(data_name, face, ttw, None, nonce)
+        if looped:
+            self.loops += 1
+        else:
+            self.aggregated += 1
+
+    # Whether a request with nonce is a copy of one already pending
+    def seen(self, data_name, nonce):
+        entry = self.vals.get(data_name)
+        return nonce is not None and entry is not None and nonce in entry.nonces
+
+    def forwardedFor(self, data_name):
+        entry = self.vals.get(data_name)
+        return entry.forwarded if entry is not None else set()
+
+    def hasFace(self, data_name, face):
+        return self.contains(data_name) and face in self.vals[data_name].faces
+
+    # Drops one downstream face, and the entry once no face is left
+    def removeFace(self, data_name, face):
+        if not self.contains(data_name):
+            return
+        entry = self.vals[data_name]
+        entry.faces.pop(face, None)
+        if not entry.faces:
+            super().remove(data_name)
+        else:
+            self.resize(data_name)
+
+    # Records that the request was sent upstream to face with ttl. A face sent
+    # it again only answers once (see answered), so is only counted once.
+    def sent(self, data_name, face, now, ttl):
+        entry = self.vals.get(data_name)
+        if entry is not None:
+            repeated = face in entry.out
+            entry.out[face] = (now, repeated)
+            entry.ttl = max(entry.ttl, ttl)
+            if not repeated:
+                self.resize(data_name)
+            elif self.counts[data_name] > 1:
+                self.counts[data_name] -= 1
+
+    # The reason an upstream face gave for not searching fully, first
+    # recording reason if there was none yet
+    def inconclusive(self, data_name, reason=None):
+        entry = self.vals.get(data_name)
+        if entry is None:
+            return None
+        if entry.inconclusive is None:
+            entry.inconclusive = reason
+        return entry.inconclusive
+
+    # Whether the request was sent to face, which has not answered yet
+    def sentTo(self, data_name, face):
+        entry = self.vals.get(data_name)
+        return entry is not None and face in entry.out
+
+    def searched(self, data_name):
+        entry = self.vals.get(data_name)
+        return entry.ttl if entry is not None else 0
+
+    # Removes and returns face's out-record (time sent, sent more than once)
+    # when it answers, or None if the request was not sent to face
+    def answered(self, data_name, face):
+        entry = self.vals.get(data_name)
+        if entry is None:
+            return None
+        out = entry.out.pop(face, None)
+        if out is not None:
+            self.resize(data_name)
+        return out
+
+    # (face, time sent) of upstream faces that have not answered yet
+    def unanswered(self, data_name):
+        entry = self.vals.get(data_name)
+        if entry is None:
+            return []
+        return [(face, sent) for face, (sent, repeated) in entry.out.items()]
+
+    # Returns (live faces, remaining count) like TLRU_Table.removeCount
+    def removeCount(self, data_name):
+        entry, count = super().removeCount(data_name)
+        if entry is None:
+            return None, count
+        if count == 0:
+            self.failed += 1
+        return entry.liveFaces(), count
+
+    def remove(self, data_name):
+        entry, r = super().remove(data_name)
+        if entry is None:
+            return None, r
+        self.satisfied += 1
+        return entry.liveFaces(), r
+
+    def stats(self):
+        return {
+            'size': len(self),
+            'bytes': self.usedBytes(),
+            'created': self.created,
+            'aggregated': self.aggregated,
+            'duplicates': self.duplicates,
+            'loops': self.loops,
+            'satisfied': self.satisfied,
+            'failed': self.failed,
+            'rejected': self.rejected,
+        }
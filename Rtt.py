@@ -0,0 +1,88 @@
+from Tables import BoundedMap
+
+# Round trip time estimation per face (the peer a request was sent to), as in
+# TCP (RFC 6298): a smoothed RTT and its variation give the retransmission
+# timeout, which doubles for every timeout until the face answers again.
+
+# Timeout before a face has answered anything
+INITIAL_RTO = 1.0
+MIN_RTO = 0.05
+MAX_RTO = 10.0
+ALPHA = 1 / 8
+BETA = 1 / 4
+
+
+class RttEstimator:
+    __slots__ = ('srtt', 'rttvar', 'rto', 'timeouts')
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = INITIAL_RTO
+        # Timeouts since the last answer
+        self.timeouts = 0
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+        self.rto = min(MAX_RTO, max(MIN_RTO, self.srtt + 4 * self.rttvar))
+        self.timeouts = 0
+
+    def backoff(self):
+        self.rto = min(MAX_RTO, self.rto * 2)
+        self.timeouts += 1
+
+
+# Estimators beyond max_entries are evicted oldest first (see BoundedMap),
+# skipping faces keep(face) holds on to; an evicted face starts again from
+# INITIAL_RTO
+class RttTable:
+    def __init__(self, size, max_bytes=None, keep=None):
+        self.faces = BoundedMap(size, max_bytes, keep)
+        self.samples = 0
+
+    def estimator(self, face):
+        est = self.faces.get(face)
+        if est is None:
+            est = self.faces[face] = RttEstimator()
+        return est
+
+    def sample(self, face, rtt):
+        self.samples += 1
+        self.estimator(face).sample(rtt)
+
+    def backoff(self, face):
+        self.estimator(face).backoff()
+
+    def rto(self, face):
+        est = self.faces.get(face)
+        return est.rto if est is not None else INITIAL_RTO
+
+    # Time to wait for an answer to a request sent to all of faces, ie the
+    # timeout of the quickest
+    def timeout(self, faces):
+        return min((self.rto(face) for face in faces), default=INITIAL_RTO)
+
+    # Whether face has stopped answering since its last reply
+    def failing(self, face):
+        est = self.faces.get(face)
+        return est is not None and est.timeouts > 0
+
+    def srtt(self, face):
+        est = self.faces.get(face)
+        return est.srtt if est is not None else None
+
+    def stats(self):
+        return {face: {'srtt': est.srtt, 'rttvar': est.rttvar, 'rto': est.rto, 'timeouts': est.timeouts}
+                for face, est in self.faces.items()}
+
+    def __len__(self):
+        return len(self.faces)
+
+    def __str__(self):
+        return str({face: (round(est.srtt, 4) if est.srtt is not None else None, round(est.rto, 4))
+                    for face, est in self.faces.items()})
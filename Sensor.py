@@ -4,9 +4,19 @@ Created on Tue Nov 22 14:40:44 2022
 @author: Jeroen Lemsom
 """
 import numpy as np
-import time
+from time import time
 import datetime
 import math
+from Dataset import load_dataset
+
+#Multiplier for (month, day) keys into the per-day tables
+DAY_KEY = 32
+
+#Retrieve historical weather data over the last 10 years
+DATES = np.arange('2012-01-01', '2021-12-31', dtype='datetime64[D]')
+
+#Per-day tables already built by this process, keyed by dataset path
+_day_tables = {}
 
 
 class Sensor:
@@ -17,74 +27,79 @@ class Sensor:
         self.interval = interval
         self.last_update = 0
         path = './temps/temperatures_' + self.name + '.csv'
-        df = np.genfromtxt(path, delimiter=',')
-        df = df[1:,:]
-        start = datetime.datetime(2012, 1, 1) #Retrieve historical weather data over the last 10 years
-        end = datetime.datetime(2021, 12, 31)
-        difference = end - start
-        numdays = difference.days
-        dates = [start + datetime.timedelta(days=x) for x in range(numdays)]
-        
-        self.time = np.array(dates)
+        dataset = load_dataset(path)
+        df = dataset[1:,:]
+
+        self.time = DATES
         self.tavg = df[1:,1]
         self.tmin = df[1:,2]
         self.tmax = df[1:,3]
+        #Sensors on the same dataset share one set of per-day tables
+        cached = _day_tables.get(path)
+        if cached is not None and cached[0] is dataset:
+            self.day_tavg, self.day_tmin, self.day_tmax = cached[1]
+        else:
+            self.build_day_index()
+            _day_tables[path] = (dataset, (self.day_tavg, self.day_tmin, self.day_tmax))
 
         self.lastvalue = self.get_longtermaverage()
     
     def getValue(self):
         return (self.lastvalue, self.interval)
 
-    def update(self):
-        t = time.time()
-        if t >= (self.last_update + self.interval):
+    #Returns True if the value was stale (or force is set) and has been updated
+    def update(self, force=False):
+        t = time()
+        if force or t >= (self.last_update + self.interval):
             self.last_update = t
             self.get_update()
+            return True
+        return False
+
+    #Precomputes the kernel weighted tavg/tmin/tmax for every (month, day) so that lookups are O(1)
+    #Rows with the same date (eg 23rd of November) in different years get weights 1.5*(1 - t^2) by year order t
+    def build_day_index(self):
+        n = min(len(self.time), len(self.tavg))
+        days = self.time[:n]
+        months = days.astype('datetime64[M]')
+        month = months.astype(int) % 12 + 1
+        day = (days - months).astype(int) + 1
+        keys = month * DAY_KEY + day
+
+        #Position of each row among the rows sharing its date (rows are in date order)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        group_start = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        group_sizes = np.diff(np.r_[group_start, n])
+        rank = np.empty(n, dtype=int)
+        rank[order] = np.arange(n) - np.repeat(group_start, group_sizes) + 1
+
+        utilities = 1.5 * (1 - np.power(rank, 2))
+        totals = np.bincount(keys, weights=utilities, minlength=13 * DAY_KEY)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weights = utilities / totals[keys]
+        self.day_tavg = np.bincount(keys, weights=weights * self.tavg[:n], minlength=13 * DAY_KEY)
+        self.day_tmin = np.bincount(keys, weights=weights * self.tmin[:n], minlength=13 * DAY_KEY)
+        self.day_tmax = np.bincount(keys, weights=weights * self.tmax[:n], minlength=13 * DAY_KEY)
+
+    def day_key(self, now=None):
+        now = now or datetime.datetime.now()
+        return now.month * DAY_KEY + now.day
 
     #This method returns a kernel weighted longterm average for a specific day in the year
     def get_longtermaverage(self):
-        month = datetime.datetime.now().month
-        day = datetime.datetime.now().day
-        #Filter historical data on data which has the same date (eg 23st of November) in different years
-        tavg_sub = []
-
-        for i in range(len(self.time)):
-            if(self.time[i].day == day and self.time[i].month == month):
-                tavg_sub.append(self.tavg[i])
-
-        t = np.arange(1,len(tavg_sub)+1) 
-        utilities = 1.5 * (1 - np.power(t,2))
-        weights = utilities/sum(utilities)
-
-        weighted_values = weights * tavg_sub
-        weighted_tavg = sum(weighted_values)
-        return weighted_tavg
+        return self.day_tavg[self.day_key()]
     
     
     #On top of the get_longtermaverage method, this method adjusts the average for specific hours during the day using linear interpolation
     def get_longtermaverage_corrected_for_dayhour(self):
+        now = datetime.datetime.now()
+        key = self.day_key(now)
+        weighted_tmin = self.day_tmin[key]
+        weighted_tmax = self.day_tmax[key]
         
-        month = datetime.datetime.now().month
-        day = datetime.datetime.now().day
-        #Filter historical data on data which has the same date (eg 23st of November) in different years
-        tmin_sub = []
-        tmax_sub = []
-        
-        for i in range(len(self.time)):
-            if(self.time[i].day == day and self.time[i].month == month):
-                tmin_sub.append(self.tmin[i])
-                tmax_sub.append(self.tmax[i])
-
-        t = np.arange(1,len(tmin_sub)+1) 
-        utilities = 1.5 * (1 - np.power(t,2))
-        weights = utilities/sum(utilities)
-
-        weighted_tmin = sum(weights * tmin_sub)
-        weighted_tmax = sum(weights * tmax_sub)
-        
-        hour = datetime.datetime.now().hour
+        hour = now.hour
         corrected_hour = abs(hour - 12) #difference in hours from 12
-        longterm_avg_temp = self.get_longtermaverage()
         half_interval = weighted_tmax - weighted_tmin
         increment = half_interval/12
         longtermaverage_corrected_for_dayhour = weighted_tmax - increment*corrected_hour
@@ -92,27 +107,8 @@ class Sensor:
     
     #This method calculates the historical standard deviation 
     def get_longtermstandarddev(self):
-        #Filter historical data on data which has the same date (eg 23st of November) in different years
-        month = datetime.datetime.now().month
-        day = datetime.datetime.now().day
-        
-        tmin_sub = []
-        tmax_sub = []
-
-        for i in range(len(self.time)):
-            if(self.time[i].day == day and self.time[i].month == month):
-                tmin_sub.append(self.tmin[i])
-                tmax_sub.append(self.tmax[i])
-                
-        t = np.arange(1,len(tmin_sub)+1) 
-        utilities = 1.5 * (1 - np.power(t,2))
-        weights = utilities/sum(utilities)
-
-        weighted_tmin = sum(weights * tmin_sub)
-        weighted_tmax = sum(weights * tmax_sub)        
-
-        daily_stddev = (weighted_tmax - weighted_tmin)/4 #appromate std deviation using range
-        
+        key = self.day_key()
+        daily_stddev = (self.day_tmax[key] - self.day_tmin[key])/4 #appromate std deviation using range
         return daily_stddev
     
     #Update of the Prediction
@@ -0,0 +1,464 @@
+from Node import Node, SENSOR_TYPES
+from ICNProtocol import DATA, DN, TTU, MAC
+from Codec import encodeFrame, FrameDecoder, FRAMED_TLV
+import Tlru
+import Pit
+import ContentStore
+import NegativeCache
+import Subscriptions
+import Sensor
+from ContentStore import makeContentStore, POLICIES, LRU
+from Strategy import makeStrategy, STRATEGIES, FLOOD, FANOUT
+from NegativeCache import NEGATIVE_TTL
+from Tables import TableLimits, parseLimits, TABLE_LIMITS
+from Logs import setupLogging
+import Node as NodeModule
+import numpy as np
+import argparse
+import heapq
+import random
+import time as walltime
+
+# Runs many Node/ICNProtocol instances in one process. Nodes talk through an
+# in-memory stand-in for IPNode and all timers run on a simulated clock, so
+# hundreds of nodes can be benchmarked without sockets or real waiting.
+
+CITIES = ['dublin', 'beijing', 'capetown', 'doha', 'amsterdam', 'losangeles', 'stockholm', 'sydney', 'tokyo', 'toronto']
+TOPOLOGIES = ['line', 'tree', 'random']
+# Simulated time seeded runs start at, so they do not depend on when they are
+# run (rounding of times to use, and so what expires first, does)
+SIM_START = 1700000000.0
+
+
+class _SimCall:
+    __slots__ = ('time', 'seq', 'f', 'args', 'cancelled', 'called')
+
+    def __init__(self, t, seq, f, args):
+        self.time = t
+        self.seq = seq
+        self.f = f
+        self.args = args
+        self.cancelled = False
+        self.called = False
+
+    def __lt__(self, other):
+        return (self.time, self.seq) < (other.time, other.seq)
+
+    def active(self):
+        return not (self.cancelled or self.called)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def getTime(self):
+        return self.time
+
+
+# Discrete event clock with the callLater interface nodes use on the reactor
+class SimClock:
+    def __init__(self, start=None):
+        self.now = walltime.time() if start is None else start
+        self.queue = []
+        self.seq = 0
+        self.events = 0
+
+    def seconds(self):
+        return self.now
+
+    def callLater(self, delay, f, *args, **kwargs):
+        self.seq += 1
+        if kwargs:
+            call = _SimCall(self.now + delay, self.seq, lambda *a: f(*a, **kwargs), args)
+        else:
+            call = _SimCall(self.now + delay, self.seq, f, args)
+        heapq.heappush(self.queue, call)
+        return call
+
+    def callFromThread(self, f, *args, **kwargs):
+        return self.callLater(0, f, *args, **kwargs)
+
+    def run(self, until=None):
+        queue = self.queue
+        while queue:
+            if until is not None and queue[0].time > until:
+                self.now = until
+                return
+            call = heapq.heappop(queue)
+            if call.cancelled:
+                continue
+            self.now = max(self.now, call.time)
+            call.called = True
+            self.events += 1
+            call.f(*call.args)
+
+
+# Makes the table, sensor and node modules read time from the simulated clock
+def installClock(clock):
+    for module in (Tlru, Pit, ContentStore, NegativeCache, Subscriptions, Sensor, NodeModule):
+        module.time = clock.seconds
+
+
+# In-memory replacement for IPNode. Peers are fixed by the topology, so the
+# discovery and fallback parts of the interface do nothing.
+class SimIPNode:
+    def __init__(self, net, index, node_id):
+        self.net = net
+        self.index = index
+        self.id = node_id
+        self.port = index
+        self.addr = 'sim'
+        self.icn_protocol = None
+        self.IP_map = {}
+        self.connections = {}
+        self.fallback_address = None
+        self.fallbacks = {}
+        self.isolated = False
+        self.part_of_network = True
+        # Hop count of the last DATA received per name, and the name of the
+        # DATA currently being handled (so forwards can be told from origins)
+        self.rx_hops = {}
+        self.handling = None
+
+    def sendMsg(self, msg, node_name, connection=None):
+        self.net.send(self, msg, node_name)
+
+    def search(self, msg=None):
+        pass
+
+    def getPort(self):
+        return str(self.port)
+
+    def getFallback(self):
+        return None
+
+    def setFallback(self, node_name, addr, source, port):
+        return None
+
+    def updateFallback(self, node_name, addr):
+        pass
+
+    def getPeerAddr(self, node_name):
+        node = self.net.nodes.get(node_name)
+        if node is None:
+            return None
+        return f"{self.addr}:{node.icn.ip_node.port}"
+
+    def addNodeAddr(self, node_name, port, host, source=None):
+        pass
+
+    def addNodeConnection(self, node_name, source):
+        pass
+
+    def verifyPeer(self, node_name):
+        pass
+
+    def removePeer(self, node_name):
+        pass
+
+
+class SimNode(Node):
+    def useData(self, data_name, data_val):
+        self.icn.ip_node.net.satisfied(self, data_name)
+
+    def failData(self, data_name, *args):
+        super().failData(data_name, *args)
+        self.icn.ip_node.net.failed(self, data_name)
+
+
+class SimNetwork:
+    def __init__(self, *, latency=0.005, jitter=0.0, codec=False, seed=None, cache=(LRU, 3, None, 1.0), loss=0.0, strategy=(FLOOD, FANOUT), negative_ttl=NEGATIVE_TTL, limits=None, tamper=0.0):
+        self.clock = SimClock(SIM_START if seed is not None else None)
+        self.cache = cache
+        self.strategy = strategy
+        self.negative_ttl = negative_ttl
+        # {table: (entries, bytes)} budgets of every node's tables
+        self.limits = limits
+        installClock(self.clock)
+        self.latency = latency
+        self.jitter = jitter
+        # Share of messages dropped on the way
+        self.loss = loss
+        self.lost = 0
+        # Share of DATA messages changed on the way (see tamperData), and the
+        # (name, time to use) of those given a later time to use
+        self.tamper = tamper
+        self.tampered = 0
+        self.stretched = set()
+        self.codec = codec
+        self.rng = random.Random(seed)
+        # Key every node signs and checks DATA with
+        self.data_key = self.rng.randbytes(32)
+        self.mac_key = self.rng.randbytes(32)
+        self.nodes = {}
+        self.links = {}
+        self.paths = {}
+        self.messages = {}
+        self.transmissions = 0
+        self.origins = {'producer': 0, 'cache': 0}
+        self.outstanding = {}
+        self.latencies = []
+        self.hops = []
+        self.issued = 0
+        self.failures = 0
+
+    def addNode(self, name, city=None):
+        ip_node = SimIPNode(self, len(self.nodes), name)
+        strategy = makeStrategy(*self.strategy, random.Random(self.rng.random()))
+        node = SimNode(name, ip_node.port, city, ip_node=ip_node, content_store=makeContentStore(*self.cache), strategy=strategy, negative_ttl=self.negative_ttl, limits=TableLimits(self.limits), data_key=self.data_key, mac_key=self.mac_key)
+        node.reactor = self.clock
+        self.nodes[name] = node
+        self.links[name] = {}
+        return node
+
+    def link(self, a, b):
+        latency = self.latency * (1 + self.rng.uniform(-self.jitter, self.jitter))
+        self.links[a][b] = latency
+        self.links[b][a] = latency
+        self.nodes[a].addPeer(b)
+        self.nodes[b].addPeer(a)
+
+    # Hops on the shortest path, used for messages sent to non-neighbours
+    def pathHops(self, src, dest):
+        key = (src, dest)
+        if key not in self.paths:
+            seen = {src: 0}
+            frontier = [src]
+            while frontier and dest not in seen:
+                nxt = []
+                for n in frontier:
+                    for m in self.links[n]:
+                        if m not in seen:
+                            seen[m] = seen[n] + 1
+                            nxt.append(m)
+                frontier = nxt
+            self.paths[key] = seen.get(dest)
+        return self.paths[key]
+
+    def send(self, src, msg, dest_name):
+        dest = self.nodes.get(dest_name)
+        if dest is None:
+            return
+        latency = self.links[src.id].get(dest_name)
+        hops = 1
+        if latency is None:
+            hops = self.pathHops(src.id, dest_name)
+            if hops is None:
+                return
+            latency = hops * self.latency
+        msg_type = msg['type']
+        self.messages[msg_type] = self.messages.get(msg_type, 0) + 1
+        self.transmissions += hops
+        if self.loss and self.rng.random() < self.loss:
+            self.lost += 1
+            return
+        if msg_type == DATA and self.tamper and self.rng.random() < self.tamper:
+            msg = self.tamperData(msg)
+
+        data_hops = 0
+        if msg_type == DATA:
+            name = msg['content']['data_name']
+            if src.handling == name:
+                data_hops = src.rx_hops.get(name, 0) + hops
+            else:
+                data_hops = hops
+                node = self.nodes[src.id]
+                self.origins['producer' if node.hasData(name) else 'cache'] += 1
+        if self.codec:
+            msg = encodeFrame(msg, FRAMED_TLV)
+        self.clock.callLater(latency, self.deliver, dest, msg, data_hops)
+
+    # A copy of a DATA message with its MAC stripped, or with a later time to
+    # use so caches would serve it for longer. Nodes should drop either.
+    def tamperData(self, msg):
+        content = dict(msg['content'])
+        if MAC in content and self.rng.random() < 0.5:
+            content[TTU] += 3600
+            self.stretched.add((content[DN], content[TTU]))
+        else:
+            content.pop(MAC, None)
+        self.tampered += 1
+        return {'id': msg['id'], 'type': msg['type'], 'content': content, 'ttl': msg['ttl']}
+
+    # Cache entries across the network that came from tampered DATA
+    def tamperedCached(self):
+        count = 0
+        for node in self.nodes.values():
+            cache = node.cache
+            for name in cache:
+                val = cache.vals[name]
+                if not isinstance(val, tuple) or val[1] is None or (name, cache.times[name]) in self.stretched:
+                    count += 1
+        return count
+
+    def deliver(self, dest, msg, data_hops):
+        if self.codec:
+            msg = FrameDecoder().feed(msg)[0]
+        ip_node = dest.icn.ip_node
+        if msg['type'] == DATA:
+            name = msg['content']['data_name']
+            ip_node.rx_hops[name] = data_hops
+            ip_node.handling = name
+            dest.icn.handleMsg(msg, None)
+            ip_node.handling = None
+        else:
+            dest.icn.handleMsg(msg, None)
+
+    def request(self, node_name, data_name, ttw):
+        node = self.nodes[node_name]
+        self.issued += 1
+        self.outstanding.setdefault((node_name, data_name), []).append(self.clock.seconds())
+        node.requestData(data_name, ttw)
+
+    def satisfied(self, node, data_name):
+        started = self.outstanding.pop((node.name, data_name), [])
+        hops = node.icn.ip_node.rx_hops.get(data_name, 0) if node.icn.ip_node.handling == data_name else 0
+        now = self.clock.seconds()
+        for t in started:
+            self.latencies.append(now - t)
+            self.hops.append(hops)
+
+    def failed(self, node, data_name):
+        self.failures += len(self.outstanding.pop((node.name, data_name), []))
+
+
+def buildTopology(net, names, topology, degree, rng):
+    if topology == 'line':
+        for a, b in zip(names, names[1:]):
+            net.link(a, b)
+    elif topology == 'tree':
+        for i in range(1, len(names)):
+            net.link(names[(i - 1) // degree], names[i])
+    else:
+        # Random spanning tree for connectivity, then extra edges up to the average degree
+        edges = set()
+        for i in range(1, len(names)):
+            j = rng.randrange(i)
+            edges.add((j, i))
+        target = max(len(names) - 1, int(len(names) * degree / 2))
+        attempts = 0
+        while len(edges) < target and attempts < target * 10:
+            attempts += 1
+            a, b = rng.sample(range(len(names)), 2)
+            edges.add((min(a, b), max(a, b)))
+        for a, b in edges:
+            net.link(names[a], names[b])
+
+
+# Zipf distributed choice over the names, most popular first
+def zipfWeights(n, s):
+    ranks = np.arange(1, n + 1)
+    weights = 1 / np.power(ranks, s)
+    return weights / weights.sum()
+
+
+def simulate(nodes=100, topology='random', degree=3, *, producers=4, requests=2000, rate=200.0, zipf=1.0,
+             latency=0.005, jitter=0.0, ttw=20, codec=False, seed=None, cache=(LRU, 3, None, 1.0), loss=0.0, strategy=(FLOOD, FANOUT), unknown=0.0, negative_ttl=NEGATIVE_TTL, limits=None, tamper=0.0):
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    net = SimNetwork(latency=latency, jitter=jitter, codec=codec, seed=seed, cache=cache, loss=loss, strategy=strategy,
+                     negative_ttl=negative_ttl, limits=limits, tamper=tamper)
+
+    names = [f"N{i}" for i in range(nodes)]
+    producers = min(producers, len(CITIES), nodes)
+    producer_ids = rng.sample(range(nodes), producers)
+    cities = {names[i]: CITIES[k] for k, i in enumerate(producer_ids)}
+    for name in names:
+        net.addNode(name, cities.get(name))
+    buildTopology(net, names, topology, degree, rng)
+
+    data_names = [city + suffix for city in cities.values() for suffix in SENSOR_TYPES]
+    rng.shuffle(data_names)
+    choices = np_rng.choice(len(data_names), size=requests, p=zipfWeights(len(data_names), zipf))
+    consumers = [n for n in names if n not in cities] or names
+    # Names nobody produces, for the share of requests set by unknown
+    missing = [city + suffix for city in ('atlantis', 'eldorado') for suffix in SENSOR_TYPES]
+
+    t = 0.0
+    for i in range(requests):
+        t += rng.expovariate(rate)
+        data_name = rng.choice(missing) if unknown and rng.random() < unknown else data_names[choices[i]]
+        net.clock.callLater(t, net.request, rng.choice(consumers), data_name, ttw)
+
+    start = walltime.perf_counter()
+    net.clock.run()
+    wall = walltime.perf_counter() - start
+    return report(net, wall, t)
+
+
+def report(net, wall, duration):
+    satisfied = len(net.latencies)
+    origins = net.origins['producer'] + net.origins['cache']
+    lat = np.array(net.latencies) if net.latencies else np.zeros(1)
+    return {
+        'nodes': len(net.nodes),
+        'links': sum(len(v) for v in net.links.values()) // 2,
+        'issued': net.issued,
+        'satisfied': satisfied,
+        'failed': net.failures,
+        'retransmissions': sum(node.retransmitted for node in net.nodes.values()),
+        'floods_avoided': sum(node.negative.hits for node in net.nodes.values()),
+        'pit_rejected': sum(node.PIT.rejected for node in net.nodes.values()),
+        'pit_evicted': sum(node.PIT.evicted for node in net.nodes.values()),
+        'lost': net.lost,
+        'tampered': net.tampered,
+        'rejected': sum(node.icn.rejected for node in net.nodes.values()),
+        'tampered_cached': net.tamperedCached(),
+        'sim_seconds': duration,
+        'throughput': satisfied / duration if duration else 0.0,
+        'wall_seconds': wall,
+        'events_per_sec': net.clock.events / wall if wall else 0.0,
+        'mean_hops': float(np.mean(net.hops)) if net.hops else 0.0,
+        'mean_latency': float(lat.mean()),
+        'p95_latency': float(np.percentile(lat, 95)),
+        'cache_hit_ratio': net.origins['cache'] / origins if origins else 0.0,
+        'messages': dict(net.messages),
+        'transmissions': net.transmissions,
+        'transmissions_per_satisfied': net.transmissions / satisfied if satisfied else float('inf'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', help='Number of nodes', type=int, default=100)
+    parser.add_argument('--topology', help='Topology', choices=TOPOLOGIES, default='random')
+    parser.add_argument('--degree', help='Tree fan-out or random graph average degree', type=int, default=3)
+    parser.add_argument('--producers', help='Nodes holding sensor data (max 10)', type=int, default=4)
+    parser.add_argument('--requests', help='Requests to issue', type=int, default=2000)
+    parser.add_argument('--rate', help='Requests per simulated second across the network', type=float, default=200.0)
+    parser.add_argument('--zipf', help='Zipf exponent of name popularity', type=float, default=1.0)
+    parser.add_argument('--unknown', help='Share of requests for names nobody produces', type=float, default=0.0)
+    parser.add_argument('--latency', help='Link latency in seconds', type=float, default=0.005)
+    parser.add_argument('--jitter', help='Relative link latency jitter', type=float, default=0.0)
+    parser.add_argument('--loss', help='Probability of each message being dropped', type=float, default=0.0)
+    parser.add_argument('--tamper', help='Probability of each DATA message having its MAC stripped or its time to use changed on the way', type=float, default=0.0)
+    parser.add_argument('--ttw', help='Time to wait for each request', type=float, default=20)
+    parser.add_argument('--codec', help='Encode and decode every message with the wire codec', action='store_true')
+    parser.add_argument('--cache-policy', help='Content Store replacement policy', choices=POLICIES, default=LRU)
+    parser.add_argument('--cache-entries', help='Content Store capacity in entries', type=int, default=3)
+    parser.add_argument('--cache-bytes', help='Content Store capacity in bytes (unlimited if not set)', type=int, default=None)
+    parser.add_argument('--cache-admit', help='Probability of caching Data that passes through', type=float, default=1.0)
+    parser.add_argument('--strategy', help='Forwarding strategy', choices=STRATEGIES, default=FLOOD)
+    parser.add_argument('--fanout', help='Peers the probabilistic strategy sends each request to', type=int, default=FANOUT)
+    parser.add_argument('--negative-ttl', help='Seconds to fail requests for names that could not be found (0 - never)', type=float, default=NEGATIVE_TTL)
+    parser.add_argument('--table-limits', help=f"Entry and byte budgets of node tables, TABLE=ENTRIES[:BYTES] (tables: {', '.join(TABLE_LIMITS)})", type=str, nargs='+', default=[])
+    parser.add_argument('--seed', help='Random seed', type=int, default=None)
+    parser.add_argument('--logging-level', help='Logging level: 10 - Debug, 20 - Info, 30 - Warnings', type=int, default=40)
+    parser.add_argument('--log-queue', help='Write logs from a background thread', action='store_true')
+    parser.add_argument('--log-sample', help='Keep one in this many per-message logs', type=int, default=1)
+    args = parser.parse_args()
+
+    setupLogging(args.logging_level, None, args.log_queue, args.log_sample)
+    result = simulate(args.nodes, args.topology, args.degree, producers=args.producers, requests=args.requests, rate=args.rate,
+                      zipf=args.zipf, latency=args.latency, jitter=args.jitter, ttw=args.ttw, codec=args.codec, seed=args.seed,
+                      cache=(args.cache_policy, args.cache_entries, args.cache_bytes, args.cache_admit), loss=args.loss,
+                      strategy=(args.strategy, args.fanout), unknown=args.unknown, negative_ttl=args.negative_ttl,
+                      limits=parseLimits(args.table_limits), tamper=args.tamper)
+    messages = result.pop('messages')
+    for k, v in result.items():
+        print(f"{k:<28} {v:.4g}" if isinstance(v, float) else f"{k:<28} {v}")
+    for k, v in sorted(messages.items()):
+        print(f"{'messages ' + k:<28} {v}")
+
+
+if __name__ == "__main__":
+    main()
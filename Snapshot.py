@@ -0,0 +1,121 @@
+from Fib import prefixName
+from time import time
+import logging
+import sqlite3
+
+# Seconds between snapshots
+SNAPSHOT_INTERVAL = 5
+
+TABLES = {
+    # Content Store entries; mac is NULL for unsigned data
+    'cache': 'name TEXT PRIMARY KEY, val, mac TEXT, ttu REAL',
+    # FIB routes, keyed by prefix (eg /dublin)
+    'locations': 'prefix TEXT PRIMARY KEY, hop TEXT',
+    # IP_map, with peer set for the nodes that have been peers at that address
+    'addrs': 'node TEXT PRIMARY KEY, addr TEXT, peer INTEGER',
+    'fallbacks': 'node TEXT PRIMARY KEY, addr TEXT',
+}
+
+
+# Keeps a node's Content Store, FIB, IP_map and fallbacks in an SQLite file so
+# a restarted node starts warm: cache hits straight away, known routes, and its
+# old peers probed before any other address. Each save only writes the rows
+# that changed since the last one.
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        for table, columns in TABLES.items():
+            self.db.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+        self.db.commit()
+        # table -> {key: row} as last written
+        self.written = {table: {} for table in TABLES}
+        self.saves = 0
+        self.rows = 0
+        self.restored = 0
+
+    # {table: [rows]} as saved, leaving out cache entries that have expired
+    def load(self):
+        saved = {}
+        for table in TABLES:
+            rows = self.db.execute(f"SELECT * FROM {table}").fetchall()
+            self.written[table] = {row[0]: row for row in rows}
+            saved[table] = rows
+        now = time()
+        saved['cache'] = [row for row in saved['cache'] if row[3] > now]
+        return saved
+
+    def restore(self, node, saved):
+        for name, val, mac, ttu in saved['cache']:
+            node.cache.add(name, (val, mac) if mac is not None else val, ttu, admit=False)
+        for prefix, hop in saved['locations']:
+            node.locations.add(prefix, hop)
+        ip_node = node.icn.ip_node
+        for node_name, addr, peer in saved['addrs']:
+            ip_node.IP_map.setdefault(node_name, addr)
+        for node_name, addr in saved['fallbacks']:
+            ip_node.fallbacks.setdefault(node_name, addr)
+        self.restored = sum(len(rows) for rows in saved.values())
+        logging.info(f"Restored {len(saved['cache'])} cached names, {len(saved['locations'])} routes and "
+                     f"{len(saved['addrs'])} addresses from {self.path}")
+
+    # Addresses (host, port) of the nodes that were peers when last saved
+    def peerAddrs(self, saved):
+        addrs = []
+        for node_name, addr, peer in saved['addrs']:
+            host, _, port = addr.rpartition(':')
+            if peer and host and port.isdigit():
+                addrs.append((host, int(port)))
+        return addrs
+
+    def current(self, node):
+        ip_node = node.icn.ip_node
+        cache = node.cache
+        peers = set(node.peers)
+        current = {'cache': {}, 'locations': {}, 'addrs': {}, 'fallbacks': {}}
+        for name in cache:
+            val = cache.vals[name]
+            val, mac = val if isinstance(val, tuple) else (val, None)
+            current['cache'][name] = (name, val, mac, cache.times[name])
+        for components, hop in node.locations.entries.items():
+            prefix = prefixName(components)
+            current['locations'][prefix] = (prefix, hop)
+        # Nodes stay marked as peers while their address is unchanged, since
+        # the last save (on shutdown) comes after every connection is lost
+        last = self.written['addrs']
+        for node_name, addr in ip_node.IP_map.items():
+            was_peer = node_name in last and last[node_name][1:] == (addr, 1)
+            current['addrs'][node_name] = (node_name, addr, int(node_name in peers or was_peer))
+        for node_name, addr in ip_node.fallbacks.items():
+            current['fallbacks'][node_name] = (node_name, addr)
+        return current
+
+    # Writes what changed since the last save in one transaction
+    def save(self, node):
+        current = self.current(node)
+        written = 0
+        with self.db:
+            for table, rows in current.items():
+                last = self.written[table]
+                changed = [row for key, row in rows.items() if last.get(key) != row]
+                gone = [(key,) for key in last if key not in rows]
+                if changed:
+                    marks = ', '.join('?' * len(changed[0]))
+                    self.db.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({marks})", changed)
+                if gone:
+                    key = TABLES[table].split()[0]
+                    self.db.executemany(f"DELETE FROM {table} WHERE {key} = ?", gone)
+                written += len(changed) + len(gone)
+                self.written[table] = rows
+        self.saves += 1
+        self.rows += written
+        return written
+
+    def close(self):
+        self.db.close()
+
+    def stats(self):
+        return {'path': self.path, 'saves': self.saves, 'rows': self.rows, 'restored': self.restored}
+
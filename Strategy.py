@@ -0,0 +1,175 @@
+from Rtt import RttEstimator
+from Fib import nameComponents
+from collections import OrderedDict
+import random
+
+# Forwarding strategies decide which peers a request goes to when the FIB has
+# no usable next hop for it. They learn per name prefix (eg dublin for
+# dublin_temp) and face from what comes back: DATA (with its round trip time),
+# FAIL, or nothing before the request times out.
+FLOOD = 'flood'
+BEST_ROUTE = 'best-route'
+ASF = 'asf'
+PROBABILISTIC = 'probabilistic'
+STRATEGIES = [FLOOD, BEST_ROUTE, ASF, PROBABILISTIC]
+
+# Prefixes measured per node; the least recently used is forgotten when full
+PREFIXES = 256
+# ASF sends one in PROBE_EVERY requests to another face as well
+PROBE_EVERY = 8
+# Faces the probabilistic strategy sends each request to
+FANOUT = 2
+
+
+# What one face has shown for one prefix
+class FaceInfo:
+    __slots__ = ('rtt', 'successes', 'failures')
+
+    def __init__(self):
+        self.rtt = RttEstimator()
+        self.successes = 0
+        # Failures and timeouts since the last DATA
+        self.failures = 0
+
+    # Brought DATA for the prefix and has not failed since
+    def working(self):
+        return self.successes > 0 and self.failures == 0
+
+    def srtt(self):
+        return self.rtt.srtt if self.rtt.srtt is not None else self.rtt.rto
+
+    def __repr__(self):
+        return f"({self.srtt():.4f}, {self.successes}, {self.failures})"
+
+
+# Sends every request to every face, as before strategies existed. Also the
+# base class: it keeps the per-prefix measurements the others choose from.
+class Strategy:
+    name = FLOOD
+
+    def __init__(self, rng=None):
+        self.prefixes = OrderedDict()
+        self.rng = rng or random.Random()
+
+    def key(self, data_name):
+        components = nameComponents(data_name)
+        return components[:-1] or components
+
+    # Measurements for data_name's prefix, without adding an entry for it
+    def lookup(self, data_name):
+        return self.prefixes.get(self.key(data_name), {})
+
+    # Same, adding an entry if there is none; only used when recording results
+    def table(self, data_name):
+        key = self.key(data_name)
+        faces = self.prefixes.get(key)
+        if faces is None:
+            if len(self.prefixes) >= PREFIXES:
+                self.prefixes.popitem(last=False)
+            faces = self.prefixes[key] = {}
+        else:
+            self.prefixes.move_to_end(key)
+        return faces
+
+    def info(self, data_name, face):
+        faces = self.table(data_name)
+        info = faces.get(face)
+        if info is None:
+            info = faces[face] = FaceInfo()
+        return info
+
+    # Faces working for data_name's prefix among faces, quickest first
+    def ranked(self, data_name, faces):
+        table = self.lookup(data_name)
+        working = [f for f in faces if f in table and table[f].working()]
+        return sorted(working, key=lambda f: table[f].srtt())
+
+    # Faces out of faces (the peers a request may go to) to send it to
+    def choose(self, data_name, faces):
+        return list(faces)
+
+    # rtt is None if it cannot be measured (eg the request was sent twice)
+    def answered(self, face, data_name, rtt):
+        info = self.info(data_name, face)
+        info.successes += 1
+        info.failures = 0
+        if rtt is not None:
+            info.rtt.sample(rtt)
+
+    def failed(self, face, data_name):
+        self.info(data_name, face).failures += 1
+
+    def timedOut(self, face, data_name):
+        info = self.info(data_name, face)
+        info.failures += 1
+        info.rtt.backoff()
+
+    def stats(self):
+        return {'strategy': self.name, 'prefixes': len(self.prefixes)}
+
+    def __str__(self):
+        return str({'_'.join(k): faces for k, faces in self.prefixes.items()})
+
+
+# Sends to the quickest face that has brought DATA for the prefix, and floods
+# only while no face is known to work
+class BestRouteStrategy(Strategy):
+    name = BEST_ROUTE
+
+    def choose(self, data_name, faces):
+        ranked = self.ranked(data_name, faces)
+        return ranked[:1] if ranked else list(faces)
+
+
+# Adaptive SRTT-based forwarding: best route, plus now and then a probe of
+# one other face (untried faces first) so a quicker path is noticed
+class AsfStrategy(Strategy):
+    name = ASF
+
+    def choose(self, data_name, faces):
+        ranked = self.ranked(data_name, faces)
+        if not ranked:
+            return list(faces)
+        others = [f for f in faces if f != ranked[0]]
+        if not others or self.rng.random() >= 1 / PROBE_EVERY:
+            return ranked[:1]
+        table = self.lookup(data_name)
+        untried = [f for f in others if f not in table]
+        return [ranked[0], self.rng.choice(untried or others)]
+
+
+# Sends each request to k faces picked at random, favouring faces that have
+# brought DATA for the prefix over those that have failed since
+class ProbabilisticStrategy(Strategy):
+    name = PROBABILISTIC
+
+    def __init__(self, rng=None, k=FANOUT):
+        super().__init__(rng)
+        self.k = k
+
+    def choose(self, data_name, faces):
+        faces = list(faces)
+        if len(faces) <= self.k:
+            return faces
+        table = self.lookup(data_name)
+        weights = []
+        for f in faces:
+            info = table.get(f)
+            # Success ratio with one success and one failure assumed up front
+            weights.append((info.successes + 1) / (info.successes + info.failures + 2) if info else 0.5)
+        chosen = []
+        for _ in range(self.k):
+            i = self.rng.choices(range(len(faces)), weights)[0]
+            chosen.append(faces.pop(i))
+            weights.pop(i)
+        return chosen
+
+
+def makeStrategy(name=FLOOD, k=FANOUT, rng=None):
+    if name == BEST_ROUTE:
+        return BestRouteStrategy(rng)
+    if name == ASF:
+        return AsfStrategy(rng)
+    if name == PROBABILISTIC:
+        return ProbabilisticStrategy(rng, k)
+    return Strategy(rng)
@@ -0,0 +1,140 @@
+from Fib import nameComponents
+from Tables import BoundedMap
+from Tlru import HEAP_COMPACT_FACTOR
+from time import time
+import heapq
+
+# Last component of a prefix subscription, eg dublin_* for every dublin reading
+WILDCARD = '*'
+
+# Kinds of expiry heap records
+FACE_LEASE = 0
+UPSTREAM_LEASE = 1
+DELIVERED = 2
+
+
+# Whether data_name is covered by pattern (an exact name or a prefix ending in *)
+def matchesPattern(pattern, data_name):
+    key = nameComponents(pattern)
+    components = nameComponents(data_name)
+    if key[-1:] == (WILDCARD,):
+        return components[:len(key) - 1] == key[:-1]
+    return components == key
+
+
+# Long-lived interest in names and prefixes. Each pattern maps the downstream
+# faces that subscribed to it to their lease expiry, so following the faces
+# from a producer gives a multicast tree down to every subscriber. Each of the
+# tables below is kept to size entries and max_bytes, evicting the least
+# recently subscribed patterns first; their faces subscribe again on renewal.
+class SubscriptionTable:
+    def __init__(self, size, max_bytes=None):
+        self.patterns = BoundedMap(size, max_bytes)
+        # Lease expiry last sent upstream per pattern
+        self.upstream = BoundedMap(size, max_bytes)
+        # ttu of the last update passed on per data name, to drop duplicates
+        # arriving over more than one path
+        self.delivered = BoundedMap(size, max_bytes)
+        # Min-heap of (expiry, kind, key, face) over the three tables, as in
+        # TLRU_Table: a record is stale once its entry has been renewed,
+        # cancelled or evicted, and is dropped when it comes up
+        self.expiry = []
+        self.compact_at = 16
+        self.pushed = 0
+
+    # Adds, renews or (with an expiry in the past) cancels face's lease on
+    # pattern. Returns (new, forward): whether the face was not subscribed
+    # before, and whether the change should be sent upstream. Renewals from many
+    # faces are aggregated by only forwarding once the upstream lease is down to
+    # half of the new one.
+    def subscribe(self, pattern, face, expiry):
+        self.expire()
+        now = time()
+        key = nameComponents(pattern)
+        faces = self.patterns.get(key, {})
+        new = face not in faces
+        if expiry <= now:
+            faces.pop(face, None)
+            if faces or key not in self.patterns:
+                return False, False
+            del self.patterns[key]
+            return False, self.upstream.pop(pattern, None) is not None
+        faces[face] = expiry
+        self.patterns[key] = faces
+        self.expires(expiry, FACE_LEASE, key, face)
+        if self.upstream.get(pattern, 0) - now < (expiry - now) / 2:
+            self.upstream[pattern] = expiry
+            self.expires(expiry, UPSTREAM_LEASE, pattern)
+            return new, True
+        return new, False
+
+    # Faces subscribed to data_name, or an empty set if there are none or this
+    # update (identified by its ttu) has already been passed on
+    def faces(self, data_name, ttu):
+        if not self.patterns:
+            return set()
+        now = time()
+        components = nameComponents(data_name)
+        found = set()
+        for key in [components] + [components[:i] + (WILDCARD,) for i in range(len(components))]:
+            faces = self.patterns.get(key)
+            if faces:
+                found.update(f for f, expiry in faces.items() if expiry >= now)
+        if not found or ttu < now or ttu <= self.delivered.get(data_name, 0):
+            return set()
+        self.delivered[data_name] = ttu
+        self.expires(ttu, DELIVERED, data_name)
+        return found
+
+    # Records an expiry, compacting the heap once it has outgrown the tables
+    def expires(self, expiry, kind, key, face=None):
+        heapq.heappush(self.expiry, (expiry, kind, key, face))
+        if len(self.expiry) > self.compact_at:
+            self.compactExpiry()
+
+    # Drops what has expired, touching only expired (or stale) heap records
+    def expire(self):
+        now = time()
+        expiry = self.expiry
+        while expiry and expiry[0][0] < now:
+            when, kind, key, face = heapq.heappop(expiry)
+            if kind == FACE_LEASE:
+                faces = self.patterns.get(key)
+                if faces is None or faces.get(face) != when:
+                    continue
+                del faces[face]
+                if not faces:
+                    del self.patterns[key]
+                else:
+                    # Resets the entry's size
+                    self.patterns[key] = faces
+            elif kind == UPSTREAM_LEASE:
+                if self.upstream.get(key) == when:
+                    del self.upstream[key]
+            elif self.delivered.get(key) == when:
+                del self.delivered[key]
+
+    # Rebuilds the heap from the tables once stale records dominate it
+    def compactExpiry(self):
+        records = [(expiry, FACE_LEASE, key, face) for key, faces in self.patterns.items() for face, expiry in faces.items()]
+        records += [(expiry, UPSTREAM_LEASE, pattern, None) for pattern, expiry in self.upstream.items()]
+        records += [(ttu, DELIVERED, data_name, None) for data_name, ttu in self.delivered.items()]
+        heapq.heapify(records)
+        self.expiry = records
+        self.compact_at = HEAP_COMPACT_FACTOR * len(records) + 16
+
+    def stats(self):
+        return {
+            'patterns': len(self.patterns),
+            'faces': sum(len(faces) for faces in self.patterns.values()),
+            'pushed': self.pushed,
+        }
+
+    def usedBytes(self):
+        return self.patterns.bytes + self.upstream.bytes + self.delivered.bytes
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __str__(self):
+        return str({'_'.join(k): list(faces) for k, faces in self.patterns.items()})
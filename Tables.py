@@ -0,0 +1,162 @@
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+# Rough bytes of bookkeeping per table entry (dict slots, timers, heap
+# records), on top of the names and values it holds
+ENTRY_OVERHEAD = 64
+
+# Most peers (connections) a node keeps; announcements beyond it are refused
+MAX_PEERS = 32
+
+# Default (entries, bytes) budget of each node table. None bytes is unlimited.
+TABLE_LIMITS = {
+    # Pending names; large enough for a batch covering every reading of a few cities
+    'pit': (64, None),
+    # Prefixes held in the FIB
+    'fib': (64, None),
+    # Names and prefixes remembered as missing
+    'negative': (256, None),
+    # Node addresses (IP_map); those of connected peers are never evicted
+    'addresses': (256, None),
+    # Fallback addresses of peers
+    'fallbacks': (256, None),
+    # Round trip time estimators per face; those of connected peers are never evicted
+    'rtt': (256, None),
+    # Faces known to understand BATCH_DATA; connected peers are never evicted
+    'batch_faces': (256, None),
+    # Sealed DATA of produced names, resealed on the next request if evicted
+    'sealed': (256, None),
+    # Subscribed patterns, and the upstream leases and last pushed updates
+    # (each kept to this budget); evicted subscribers resubscribe on renewal
+    'subscriptions': (256, None),
+}
+
+
+# Approximate bytes of the names and values a table entry holds
+def sizeOf(value):
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (tuple, list, set, frozenset)):
+        return sum(len(v) if isinstance(v, str) else sizeOf(v) for v in value)
+    if value is None:
+        return 0
+    if isinstance(value, (bool, int, float)):
+        return 8
+    if isinstance(value, dict):
+        return sum(sizeOf(k) + sizeOf(v) for k, v in value.items())
+    if hasattr(value, '__slots__'):
+        return sum(sizeOf(getattr(value, slot, None)) for slot in value.__slots__)
+    return len(str(value))
+
+
+# Parses TABLE=ENTRIES[:BYTES] (eg pit=128:65536) into {table: (entries, bytes)}
+def parseLimits(specs):
+    limits = {}
+    for spec in specs:
+        table, _, budget = spec.partition('=')
+        if table not in TABLE_LIMITS or not budget:
+            raise ValueError(f"Bad table limit {spec!r}; expected one of {', '.join(TABLE_LIMITS)}=ENTRIES[:BYTES]")
+        entries, _, max_bytes = budget.partition(':')
+        limits[table] = (int(entries), int(max_bytes) if max_bytes else None)
+    return limits
+
+
+# Entry and byte budgets of a node's tables, the defaults overridden by limits
+# ({table: (entries, bytes)}), and how many peers it keeps
+class TableLimits:
+    def __init__(self, limits=None, max_peers=MAX_PEERS):
+        self.limits = dict(TABLE_LIMITS)
+        self.limits.update(limits or {})
+        self.max_peers = max_peers
+
+    def entries(self, table):
+        return self.limits[table][0]
+
+    def bytes(self, table):
+        return self.limits[table][1]
+
+
+# Dict with entry and byte budgets (see sizeOf). Setting a key past either
+# evicts the least recently set entries, skipping any that keep(key) holds on
+# to (eg the addresses of connected peers).
+class BoundedMap(MutableMapping):
+    def __init__(self, max_entries, max_bytes=None, keep=None):
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.evicted = 0
+
+    def __getitem__(self, key):
+        return self.entries[key]
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        return self.entries.get(key, default)
+
+    def __setitem__(self, key, val):
+        if key in self.entries:
+            self.bytes -= self.sizes[key]
+            self.entries.move_to_end(key)
+        size = ENTRY_OVERHEAD + sizeOf(key) + sizeOf(val)
+        self.entries[key] = val
+        self.sizes[key] = size
+        self.bytes += size
+        if self.overBudget():
+            self.evict(key)
+
+    def __delitem__(self, key):
+        del self.entries[key]
+        self.bytes -= self.sizes.pop(key)
+
+    def overBudget(self):
+        return len(self.entries) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes)
+
+    def evict(self, added):
+        for key in list(self.entries):
+            if key == added or (self.keep is not None and self.keep(key)):
+                continue
+            del self[key]
+            self.evicted += 1
+            if not self.overBudget():
+                return
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return repr(dict(self.entries))
+
+    def stats(self):
+        return {'entries': len(self), 'bytes': self.bytes, 'evicted': self.evicted}
+
+
+# Peers in the order they connected, with O(1) membership checks
+class PeerSet:
+    def __init__(self):
+        self.members = {}
+
+    def add(self, node_name):
+        self.members[node_name] = None
+
+    def discard(self, node_name):
+        self.members.pop(node_name, None)
+
+    def __contains__(self, node_name):
+        return node_name in self.members
+
+    def __iter__(self):
+        return iter(self.members)
+
+    def __len__(self):
+        return len(self.members)
+
+    def __repr__(self):
+        return repr(list(self.members))
@@ -1,14 +1,33 @@
-
-from time import time, sleep
+from time import time
 from collections import OrderedDict
+from Tables import ENTRY_OVERHEAD, sizeOf
+import heapq
+
+# Rebuild the expiry heap once stale entries outnumber live ones by this factor
+HEAP_COMPACT_FACTOR = 2
 
 
+# Holds at most size entries and, if max_bytes is set, about that many bytes
+# (see entryBytes), dropping the least recently used entries to stay within both.
+# Bytes are only kept count of with a budget; otherwise usedBytes adds them up.
 class TLRU_Table:
-    def __init__(self, size, count=1):
+    # Whether entries are dropped to make room; tables that refuse new entries
+    # when full instead (eg the PIT) turn this off
+    evicts = True
+
+    def __init__(self, size, count=1, max_bytes=None):
         self.vals = OrderedDict()
         self.times = {}
         self.counts = {}
         self.size = size
+        self.max_bytes = max_bytes
+        self.sizes = {}
+        self.bytes = 0
+        self.evicted = 0
+        # Min-heap of (ttu, data_name) used as an expiry index. Entries are removed
+        # lazily: an entry is stale if its ttu no longer matches self.times.
+        self.expiry = []
+        self.expired = 0
 
     def contains(self, data_name):
         self.evalutateTTU()
@@ -17,11 +36,19 @@ class TLRU_Table:
         else:
             return False
 
+    # Pops expired entries off the expiry heap, so only entries that have
+    # actually expired (or stale heap records) are touched.
     def evalutateTTU(self):
-        for data_name, use_time in self.times.copy().items():
-            if time() > use_time:
+        now = time()
+        expiry = self.expiry
+        while expiry and expiry[0][0] < now:
+            use_time, data_name = heapq.heappop(expiry)
+            if self.times.get(data_name) == use_time:
                 self.vals.pop(data_name)
                 self.times.pop(data_name)
+                self.counts.pop(data_name, None)
+                self.bytes -= self.sizes.pop(data_name, 0)
+                self.expired += 1
 
     def get(self, data_name):
         self.vals.move_to_end(data_name)
@@ -31,6 +58,28 @@ class TLRU_Table:
         (k, v) = self.vals.popitem(last=False)
         self.times.pop(k)
         self.counts.pop(k)
+        self.bytes -= self.sizes.pop(k, 0)
+        self.evicted += 1
+
+    # Approximate bytes an entry takes up
+    def entryBytes(self, data_name, data_val):
+        return ENTRY_OVERHEAD + sizeOf(data_name) + sizeOf(data_val)
+
+    # Accounts for an entry whose value has changed in place
+    def resize(self, data_name):
+        if self.max_bytes is None:
+            return
+        size = self.entryBytes(data_name, self.vals[data_name])
+        self.bytes += size - self.sizes.get(data_name, 0)
+        self.sizes[data_name] = size
+
+    def overBytes(self):
+        return self.max_bytes is not None and self.bytes > self.max_bytes
+
+    def usedBytes(self):
+        if self.max_bytes is not None:
+            return self.bytes
+        return sum(self.entryBytes(k, v) for k, v in self.vals.items())
 
     def add(self, data_name, data_val, ttu=32500000000, count=1):
         if time() > ttu:
@@ -38,11 +87,17 @@ class TLRU_Table:
         elif self.contains(data_name):
             if ttu < self.times[data_name]:
                 return
-        elif len(self.vals) >= self.size:
+        elif len(self.vals) >= self.size and self.evicts:
             self.removeLRU()
+        if self.times.get(data_name) != ttu:
+            heapq.heappush(self.expiry, (ttu, data_name))
         self.times[data_name] = ttu
         self.vals[data_name] = data_val
         self.counts[data_name] = count
+        self.resize(data_name)
+        while self.evicts and self.overBytes() and len(self.vals) > 1:
+            self.removeLRU()
+        self.compactExpiry()
 
     def removeCount(self, data_name):
         if self.contains(data_name):
@@ -50,6 +105,7 @@ class TLRU_Table:
                 val = self.vals.pop(data_name)
                 self.times.pop(data_name)
                 self.counts.pop(data_name)
+                self.bytes -= self.sizes.pop(data_name, 0)
                 return val, 0
             else:
                 self.counts[data_name] -= 1
@@ -61,10 +117,21 @@ class TLRU_Table:
             val = self.vals.pop(data_name)
             self.times.pop(data_name)
             self.counts.pop(data_name)
+            self.bytes -= self.sizes.pop(data_name, 0)
             return val, 0
         else:
             return None, -1
 
+    # Drops stale heap records once they dominate the heap, keeping memory
+    # proportional to the number of live entries.
+    def compactExpiry(self):
+        if len(self.expiry) > HEAP_COMPACT_FACTOR * len(self.times) + 16:
+            self.expiry = [(t, k) for k, t in self.times.items()]
+            heapq.heapify(self.expiry)
+
+    def __len__(self):
+        return len(self.vals)
+
     def __str__(self):
         return str(self.vals) + '\n' + str(self.counts)
 
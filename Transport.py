@@ -0,0 +1,225 @@
+from twisted.internet import defer, error, threads
+from twisted.internet import reactor as twisted_reactor
+from twisted.internet.address import IPv4Address
+from twisted.internet.endpoints import TCP4ServerEndpoint, TCP4ClientEndpoint, connectProtocol
+from twisted.python.failure import Failure
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import logging
+
+# Networking and timer backends. Everything above IPNode (the protocol, the
+# connection pool, Node's timers) talks to a backend through the same small
+# reactor-like interface: callLater/seconds/callFromThread for timers, listen
+# and connect for TCP, deferToThread for offloaded work and serveHTTP for the
+# metrics endpoint. Results are passed around as Deferreds on both backends.
+TWISTED = 'twisted'
+ASYNCIO = 'asyncio'
+BACKENDS = [TWISTED, ASYNCIO]
+
+
+# Serves the text returned by render for any GET
+class TextResource(Resource):
+    isLeaf = True
+
+    def __init__(self, render):
+        super().__init__()
+        self.render_text = render
+
+    def render_GET(self, request):
+        request.setHeader(b'content-type', b'text/plain; version=0.0.4')
+        return self.render_text().encode()
+
+
+# The global Twisted reactor
+class TwistedBackend:
+    name = TWISTED
+
+    def __init__(self, reactor=None):
+        self.reactor = reactor or twisted_reactor
+
+    def callLater(self, delay, f, *args, **kwargs):
+        return self.reactor.callLater(delay, f, *args, **kwargs)
+
+    def seconds(self):
+        return self.reactor.seconds()
+
+    def callFromThread(self, f, *args, **kwargs):
+        self.reactor.callFromThread(f, *args, **kwargs)
+
+    def listen(self, port, factory):
+        return TCP4ServerEndpoint(self.reactor, port).listen(factory)
+
+    # Fires with protocol once connected
+    def connect(self, addr, port, protocol, timeout=30):
+        return connectProtocol(TCP4ClientEndpoint(self.reactor, addr, port, timeout=timeout), protocol)
+
+    def setThreadPoolSize(self, threads):
+        self.reactor.suggestThreadPoolSize(threads)
+
+    def deferToThread(self, f, *args):
+        return threads.deferToThreadPool(self.reactor, self.reactor.getThreadPool(), f, *args)
+
+    def serveHTTP(self, port, render, interface='127.0.0.1'):
+        site = Site(TextResource(render))
+        site.noisy = False
+        return self.reactor.listenTCP(port, site, interface=interface)
+
+    # Returns something the caller can wait on: a Deferred is already that here
+    def wrap(self, d):
+        return d
+
+    def run(self, installSignalHandlers=True):
+        self.reactor.run(installSignalHandlers=installSignalHandlers)
+
+    def stop(self):
+        self.reactor.stop()
+
+
+# Timer handle with the parts of Twisted's IDelayedCall that callers use
+class _AsyncioCall:
+    def __init__(self, loop, delay, f):
+        self.loop = loop
+        self.f = f
+        self.called = False
+        self.handle = loop.call_later(delay, self._fire)
+
+    def _fire(self):
+        self.called = True
+        self.f()
+
+    def active(self):
+        return not (self.called or self.handle.cancelled())
+
+    def cancel(self):
+        self.handle.cancel()
+
+    def reset(self, delay):
+        self.handle.cancel()
+        self.handle = self.loop.call_later(delay, self._fire)
+
+    def getTime(self):
+        return self.handle.when()
+
+
+# Gives an asyncio transport the part of Twisted's ITransport NodeProtocol uses
+class _AsyncioStream:
+    def __init__(self, transport):
+        self.transport = transport
+        peer = transport.get_extra_info('peername') or ('', 0)
+        self.peer = IPv4Address('TCP', peer[0], peer[1])
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def writeSequence(self, data):
+        self.transport.writelines(data)
+
+    def getPeer(self):
+        return self.peer
+
+    def loseConnection(self):
+        self.transport.close()
+
+
+# Drives a Twisted-style protocol (NodeProtocol) from asyncio callbacks
+class _AsyncioProtocol(asyncio.Protocol):
+    def __init__(self, protocol):
+        self.protocol = protocol
+
+    def connection_made(self, transport):
+        self.protocol.makeConnection(_AsyncioStream(transport))
+
+    def data_received(self, data):
+        self.protocol.dataReceived(data)
+
+    def connection_lost(self, exc):
+        self.protocol.connectionLost(Failure(exc or error.ConnectionDone()))
+
+
+# An asyncio event loop. Many nodes may share one loop (and one backend).
+class AsyncioBackend:
+    name = ASYNCIO
+
+    def __init__(self, loop=None):
+        if loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = asyncio.new_event_loop()
+        self.loop = loop
+        self.executor = None
+        # Servers still starting. Twisted listens synchronously, so connections
+        # wait for these to keep the same ordering between nodes on one loop.
+        self.starting = set()
+
+    def callLater(self, delay, f, *args, **kwargs):
+        return _AsyncioCall(self.loop, delay, functools.partial(f, *args, **kwargs))
+
+    def seconds(self):
+        return self.loop.time()
+
+    def callFromThread(self, f, *args, **kwargs):
+        self.loop.call_soon_threadsafe(functools.partial(f, *args, **kwargs))
+
+    def listen(self, port, factory):
+        coro = self.loop.create_server(lambda: _AsyncioProtocol(factory.buildProtocol(None)), '0.0.0.0', port)
+        server = self.loop.create_task(coro)
+        self.starting.add(server)
+        server.add_done_callback(self.starting.discard)
+        d = defer.Deferred.fromFuture(server)
+        d.addErrback(lambda e: logging.error(f"Could not listen on {port}: {e.getErrorMessage()}"))
+        return d
+
+    def connect(self, addr, port, protocol, timeout=30):
+        return defer.Deferred.fromFuture(self.loop.create_task(self._connect(addr, port, protocol, timeout)))
+
+    # Connection errors are raised as Twisted's so callers handle both backends alike
+    async def _connect(self, addr, port, protocol, timeout):
+        if self.starting:
+            await asyncio.wait(list(self.starting))
+        try:
+            await asyncio.wait_for(self.loop.create_connection(lambda: _AsyncioProtocol(protocol), addr, port), timeout)
+        except asyncio.TimeoutError:
+            raise error.TCPTimedOutError(addr, f"after {timeout}s")
+        except ConnectionRefusedError as e:
+            raise error.ConnectionRefusedError(addr, e.strerror)
+        except OSError as e:
+            raise error.ConnectError(addr, e.strerror)
+        return protocol
+
+    def setThreadPoolSize(self, threads):
+        self.executor = ThreadPoolExecutor(threads)
+
+    def deferToThread(self, f, *args):
+        return defer.Deferred.fromFuture(self.loop.run_in_executor(self.executor, f, *args))
+
+    def serveHTTP(self, port, render, interface='127.0.0.1'):
+        async def handle(reader, writer):
+            try:
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                body = render().encode()
+                writer.write(b'HTTP/1.1 200 OK\r\ncontent-type: text/plain; version=0.0.4\r\n'
+                             + f'content-length: {len(body)}\r\nconnection: close\r\n\r\n'.encode() + body)
+                await writer.drain()
+            finally:
+                writer.close()
+        return defer.Deferred.fromFuture(self.loop.create_task(asyncio.start_server(handle, interface, port)))
+
+    # Deferreds are turned into asyncio futures so callers can await them
+    def wrap(self, d):
+        return d.asFuture(self.loop)
+
+    def run(self, installSignalHandlers=True):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self):
+        self.loop.stop()
+
+
+def makeBackend(name=TWISTED):
+    return AsyncioBackend() if name == ASYNCIO else TwistedBackend()
@@ -1,54 +1,65 @@
 
-from Node import Node
-from twisted.internet import reactor
+from Node import Node, SENSOR_TYPES, nodeArgParser, nodeKwargs
+from Logs import setupLogging
 from threading import Thread
-import logging
-import argparse
 import time
 
-
 class UserNode(Node):
 
     def readInput(self):
-        inp = input("Data name or quit: \n")
+        inp = input("Data name(s) or quit: \n")
         if inp == "quit":
             return False
         if inp == "state":
             print(self)
+        elif inp == "memory":
+            for table, usage in self.memoryReport().items():
+                print(f"{table:<14} {usage}")
+        elif inp.startswith("subscribe "):
+            for pattern in inp.split()[1:]:
+                self.reactor.callFromThread(self.subscribe, pattern)
+        elif inp.startswith("unsubscribe "):
+            for pattern in inp.split()[1:]:
+                self.reactor.callFromThread(self.unsubscribe, pattern)
+        elif inp.startswith("trace "):
+            for pattern in inp.split()[1:]:
+                self.reactor.callFromThread(self.trace, pattern)
+        elif inp.startswith("untrace "):
+            for pattern in inp.split()[1:]:
+                self.reactor.callFromThread(self.untrace, pattern)
         else:
-            self.reactor.callFromThread(self.requestData, inp, 20)
+            # Several names (or city_* for every reading of a city) are requested as one batch
+            names = []
+            for name in inp.split():
+                if name.endswith('_*'):
+                    names += [name[:-2] + suffix for suffix in SENSOR_TYPES]
+                else:
+                    names.append(name)
+            if len(names) == 1:
+                self.reactor.callFromThread(self.requestData, names[0], 20)
+            elif names:
+                self.reactor.callFromThread(self.requestBatch, names, 20)
         time.sleep(1)
         return True
 
     def run(self):
-        self.reactor = reactor
         self.reactor.run(installSignalHandlers=0)
+        self.saveSnapshot()
 
 
 def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--node-name', help='Name for node in this network', type=str)
-    parser.add_argument('--port', help='Port for this node', type=int, default=5789)
-    parser.add_argument('--data-n', help='Data name for this node', type=str, default=None)
-    parser.add_argument('--data-v', help='Data for the node', type=str, default="10")
-    parser.add_argument('--logging-level', help='Logging level: 10 - Debug, 20 - Info, 30 - Warnings', type=int, default=20)
-    args = parser.parse_args()
-
-    if args.node_name is None:
-        print("Please specify a node name")
-        exit(1)
-
-    if args.port is None:
-        print("Please specify the port for this node")
-        exit(1)
-
-    logging.basicConfig(level=args.logging_level, format='{0:8}%(levelname)-8s %(message)s'.format(args.node_name + ':'))
-    n = UserNode(args.node_name, args.port, args.data_n, args.data_v)
+    args = nodeArgParser().parse_args()
+    kwargs = nodeKwargs(args)
+    setupLogging(args.logging_level, args.node_name, args.log_queue, args.log_sample)
+    n = UserNode(**kwargs)
     th = Thread(target=n.run, daemon=True)
     th.start()
     receive_input = True
     while receive_input:
         receive_input = n.readInput()
+    # Stops the reactor so the node saves its last snapshot
+    n.reactor.callFromThread(n.reactor.stop)
+    th.join(5)
 
 
 if __name__ == "__main__":
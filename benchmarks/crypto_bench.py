@@ -0,0 +1,78 @@
+# Messages/sec for producing and consuming DATA messages with crypto on and
+# off, and with the old per-message Fernet construction for comparison. Also
+# how fast a producer frames replies to requests for one value: encrypted per
+# request, or sealed (encrypted, signed and encoded) once and reused.
+#
+#   python3 -m benchmarks.crypto_bench [--messages 20000]
+from DataCipher import DataCipher, fernetKey
+from Codec import encodeFrame, FrameDecoder, EncodedMessage
+from cryptography.fernet import Fernet
+from time import time, perf_counter
+import argparse
+import os
+
+DATA_KEY = os.urandom(32)
+FERNET_KEY = fernetKey(DATA_KEY)
+
+
+def roundTrip(n, encrypt, decrypt):
+    decoder = FrameDecoder()
+    start = perf_counter()
+    for i in range(n):
+        val = encrypt(20.0 + i / n)
+        frame = encodeFrame({'id': 'Pi1', 'type': 'DATA', 'ttl': 1,
+                             'content': {'data_name': 'dublin_temp', 'data_val': val, 'time_to_use': time(), 'location': None}})
+        for msg in decoder.feed(frame):
+            decrypt(msg['content']['data_val'])
+    return n / (perf_counter() - start)
+
+
+def perMessageFernet(n):
+    def encrypt(v):
+        return Fernet(FERNET_KEY).encrypt(str(v).encode()).decode()
+
+    def decrypt(v):
+        return Fernet(FERNET_KEY).decrypt(v.encode()).decode()
+    return roundTrip(n, encrypt, decrypt)
+
+
+def batch(n, cipher, size=8):
+    start = perf_counter()
+    vals = [20.0 + i / size for i in range(size)]
+    for _ in range(n // size):
+        cipher.decryptBatch(cipher.encryptBatch(vals))
+    return (n // size) * size / (perf_counter() - start)
+
+
+def replies(n, cipher, sealed):
+    ttu = time() + 60
+    msg = None
+    start = perf_counter()
+    for i in range(n):
+        if msg is None or not sealed:
+            token = cipher.encrypt(20.5)
+            msg = EncodedMessage({'id': 'Pi1', 'type': 'DATA', 'ttl': 1,
+                                  'content': {'data_name': 'dublin_temp', 'data_val': token, 'time_to_use': ttu,
+                                              'location': 'NO_ADDRESS', 'mac': cipher.sign('dublin_temp', token, ttu)}})
+        encodeFrame(msg)
+    return n / (perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', help='Messages per run', type=int, default=20000)
+    args = parser.parse_args()
+    n = args.messages
+    cipher = DataCipher(DATA_KEY, mac_key=os.urandom(32))
+
+    print(f"{'mode':<30} {'msgs/sec':>12}")
+    print(f"{'crypto off':<30} {roundTrip(n, str, str):>12.0f}")
+    print(f"{'crypto on (shared Fernet)':<30} {roundTrip(n, cipher.encrypt, cipher.decrypt):>12.0f}")
+    print(f"{'crypto on (Fernet per msg)':<30} {perMessageFernet(n):>12.0f}")
+    print(f"{'crypto batch of 8':<30} {batch(n, cipher):>12.0f}")
+    print(f"{'replies encrypted per request':<30} {replies(n, cipher, False):>12.0f}")
+    print(f"{'replies sealed once':<30} {replies(n, cipher, True):>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
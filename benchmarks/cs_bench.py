@@ -0,0 +1,63 @@
+# Content Store hit ratio per replacement policy and admission probability,
+# replayed over a request trace. The default trace is Zipf popularity mixed with
+# one-hit wonders; --trace reads one data name per line instead.
+#
+#   python3 -m benchmarks.cs_bench [--requests 200000] [--names 10000] [--alpha 0.8]
+#                                  [--one-hit 0.3] [--capacities 10 100 1000] [--trace FILE]
+from ContentStore import makeContentStore, POLICIES
+from time import perf_counter
+import numpy as np
+import argparse
+
+
+def zipfTrace(requests, names, alpha, one_hit, seed):
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, names + 1) ** alpha
+    popular = rng.choice(names, size=requests, p=weights / weights.sum())
+    trace = [f"/sim/name{i}" for i in popular]
+    # Names requested exactly once
+    for i in np.flatnonzero(rng.random(requests) < one_hit):
+        trace[i] = f"/sim/once{i}"
+    return trace
+
+
+def replay(cs, trace):
+    for name in trace:
+        if cs.contains(name):
+            cs.get(name)
+        else:
+            cs.add(name, name)
+    return cs.hits / len(trace)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', help='Requests in the generated trace', type=int, default=200000)
+    parser.add_argument('--names', help='Distinct popular names', type=int, default=10000)
+    parser.add_argument('--alpha', help='Zipf exponent', type=float, default=0.8)
+    parser.add_argument('--one-hit', help='Share of requests for names seen once', type=float, default=0.3)
+    parser.add_argument('--capacities', help='Content Store sizes in entries', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--admit', help='Admission probabilities', type=float, nargs='+', default=[1.0, 0.1])
+    parser.add_argument('--trace', help='File with one data name per line')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.trace:
+        with open(args.trace) as f:
+            trace = [line.strip() for line in f if line.strip()]
+    else:
+        trace = zipfTrace(args.requests, args.names, args.alpha, args.one_hit, args.seed)
+
+    print(f"{'policy':<10} {'admit':>6} {'capacity':>9} {'hit ratio':>10} {'ops/sec':>10}")
+    for capacity in args.capacities:
+        for policy in POLICIES:
+            for p in args.admit:
+                cs = makeContentStore(policy, capacity, None, p)
+                start = perf_counter()
+                ratio = replay(cs, trace)
+                rate = len(trace) / (perf_counter() - start)
+                print(f"{policy:<10} {p:>6} {capacity:>9} {ratio:>10.4f} {rate:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
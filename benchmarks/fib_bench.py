@@ -0,0 +1,40 @@
+# FIB longest-prefix-match lookups/sec against a table of many prefixes.
+#
+#   python3 -m benchmarks.fib_bench [--prefixes 100000] [--lookups 200000]
+from Fib import FIB
+from time import perf_counter
+import argparse
+import random
+
+READINGS = ['temp', 'per', 'hum', 'bar', 'cloud', 'snow', 'water', 'wind']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--prefixes', help='Prefixes in the FIB', type=int, default=100000)
+    parser.add_argument('--lookups', help='Lookups to time', type=int, default=200000)
+    args = parser.parse_args()
+
+    # Mix of producer prefixes (/region/city) and a few exact names
+    fib = FIB(args.prefixes)
+    prefixes = [f"/region{i % 100}/city{i}" for i in range(args.prefixes)]
+    start = perf_counter()
+    for i, p in enumerate(prefixes):
+        fib.add(p, f"Pi{i % 50}")
+    insert_rate = args.prefixes / (perf_counter() - start)
+
+    names = [f"{random.choice(prefixes)}/{random.choice(READINGS)}" for _ in range(args.lookups)]
+    names += [f"/region{random.randrange(100)}/unknown/temp" for _ in range(args.lookups // 10)]
+    random.shuffle(names)
+    start = perf_counter()
+    for n in names:
+        fib.lookup(n)
+    lookup_rate = len(names) / (perf_counter() - start)
+
+    print(f"{'prefixes':<12} {len(fib):>12}")
+    print(f"{'inserts/sec':<12} {insert_rate:>12.0f}")
+    print(f"{'lookups/sec':<12} {lookup_rate:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# Frames/sec on the send path: a REQUEST flooded to several peers, encoded
+# per face or once and shared, and DATA forwarded by a node, re-encoded in full
+# or sent on with only its location field patched.
+#
+#   python3 -m benchmarks.send_bench [--messages 50000] [--faces 4]
+from Codec import encodeFrame, FrameDecoder, EncodedMessage
+from DataCipher import DataCipher
+from time import time, perf_counter
+import argparse
+import os
+
+
+def flood(n, faces, shared):
+    content = {'data_name': 'dublin_temp', 'time_to_wait': time() + 10}
+    start = perf_counter()
+    for _ in range(n // faces):
+        msg = {'id': 'Pi1', 'type': 'REQUEST', 'content': content, 'ttl': 4}
+        if shared:
+            msg = EncodedMessage(msg)
+        for _ in range(faces):
+            encodeFrame(msg)
+    return (n // faces) * faces / (perf_counter() - start)
+
+
+def forward(n, patched):
+    cipher = DataCipher(os.urandom(32), mac_key=os.urandom(32))
+    token = cipher.encrypt(20.5)
+    ttu = time() + 60
+    frame = encodeFrame({'id': 'Pi1', 'type': 'DATA', 'ttl': 1,
+                         'content': {'data_name': 'dublin_temp', 'data_val': token, 'time_to_use': ttu,
+                                     'location': 'NO_ADDRESS', 'mac': cipher.sign('dublin_temp', token, ttu)}})
+    c = FrameDecoder().feed(frame)[0]['content']
+    start = perf_counter()
+    for _ in range(n):
+        content = dict(c, location='127.0.0.1:33010:Pi1')
+        msg = {'id': 'Pi2', 'type': 'DATA', 'content': content, 'ttl': 1}
+        encodeFrame(EncodedMessage(msg, c.fields) if patched else msg)
+    return n / (perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', help='Frames per run', type=int, default=50000)
+    parser.add_argument('--faces', help='Peers each request is flooded to', type=int, default=4)
+    args = parser.parse_args()
+    n = args.messages
+
+    print(f"{'mode':<30} {'frames/sec':>12}")
+    print(f"{f'flood to {args.faces}, encode per face':<30} {flood(n, args.faces, False):>12.0f}")
+    print(f"{f'flood to {args.faces}, encode once':<30} {flood(n, args.faces, True):>12.0f}")
+    print(f"{'forward DATA, re-encode':<30} {forward(n, False):>12.0f}")
+    print(f"{'forward DATA, patch location':<30} {forward(n, True):>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
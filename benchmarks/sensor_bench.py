@@ -0,0 +1,57 @@
+# Sensor update latency: the old per-update scan over every historical date
+# against the precomputed (month, day) tables.
+#
+#   python3 -m benchmarks.sensor_bench [--city dublin] [--updates 200]
+from Sensor import TempSensor
+from time import perf_counter
+import numpy as np
+import argparse
+import datetime
+
+
+# The pre-index implementation: select same-day rows by walking all dates
+def scanWeighted(dates, values):
+    now = datetime.datetime.now()
+    sub = []
+    for i in range(len(dates)):
+        if dates[i].day == now.day and dates[i].month == now.month:
+            sub.append(values[i])
+    t = np.arange(1, len(sub) + 1)
+    utilities = 1.5 * (1 - np.power(t, 2))
+    weights = utilities / sum(utilities)
+    return sum(weights * sub)
+
+
+def scanUpdate(sensor, dates):
+    # get_update did five scans: corrected average (tmin, tmax + tavg) and stddev (tmin, tmax)
+    tmin, tmax = scanWeighted(dates, sensor.tmin), scanWeighted(dates, sensor.tmax)
+    scanWeighted(dates, sensor.tavg)
+    corrected = tmax - (tmax - tmin) / 12 * abs(datetime.datetime.now().hour - 12)
+    tmin, tmax = scanWeighted(dates, sensor.tmin), scanWeighted(dates, sensor.tmax)
+    return corrected, (tmax - tmin) / 4
+
+
+def timeIt(f, n):
+    start = perf_counter()
+    for _ in range(n):
+        f()
+    return (perf_counter() - start) / n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--city', help='City dataset to load', type=str, default='dublin')
+    parser.add_argument('--updates', help='Updates to time', type=int, default=200)
+    args = parser.parse_args()
+
+    sensor = TempSensor(args.city, 60)
+    dates = sensor.time.astype(object)
+    before = timeIt(lambda: scanUpdate(sensor, dates), max(1, args.updates // 20))
+    after = timeIt(sensor.get_update, args.updates)
+    print(f"{'scan per update':<24} {before * 1e6:>12.1f} us")
+    print(f"{'indexed update':<24} {after * 1e6:>12.1f} us")
+    print(f"{'speedup':<24} {before / after:>12.1f} x")
+
+
+if __name__ == "__main__":
+    main()
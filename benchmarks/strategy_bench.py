@@ -0,0 +1,39 @@
+# Messages per satisfied request for each forwarding strategy on simulated
+# topologies (see Simulator.py), with the share of requests satisfied and
+# their latency so savings in traffic can be weighed against them.
+#
+#   python3 -m benchmarks.strategy_bench [--nodes 100] [--requests 2000] [--topologies line tree random]
+#                                        [--strategies flood best-route asf probabilistic] [--loss 0.0]
+from Simulator import simulate, TOPOLOGIES
+from Strategy import STRATEGIES, FANOUT
+import argparse
+import logging
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', help='Number of nodes', type=int, default=100)
+    parser.add_argument('--requests', help='Requests per run', type=int, default=2000)
+    parser.add_argument('--degree', help='Tree fan-out or random graph average degree', type=int, default=3)
+    parser.add_argument('--topologies', choices=TOPOLOGIES, nargs='+', default=TOPOLOGIES)
+    parser.add_argument('--strategies', choices=STRATEGIES, nargs='+', default=STRATEGIES)
+    parser.add_argument('--fanout', help='Peers the probabilistic strategy sends each request to', type=int, default=FANOUT)
+    parser.add_argument('--loss', help='Probability of each message being dropped', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    print(f"{'topology':<9} {'strategy':<14} {'satisfied':>9} {'msgs/sat':>9} {'hops/sat':>9} {'latency':>8} {'retx':>6}")
+    for topology in args.topologies:
+        for strategy in args.strategies:
+            r = simulate(args.nodes, topology, args.degree, requests=args.requests, seed=args.seed, loss=args.loss,
+                         strategy=(strategy, args.fanout))
+            satisfied = r['satisfied']
+            messages = sum(r['messages'].values())
+            per = messages / satisfied if satisfied else float('inf')
+            print(f"{topology:<9} {strategy:<14} {satisfied / r['issued']:>9.3f} {per:>9.1f} "
+                  f"{r['transmissions_per_satisfied']:>9.1f} {r['mean_latency']:>8.4f} {r['retransmissions']:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# Micro-benchmark for TLRU_Table: per-operation cost of add/contains/get/expiry
+# at increasing table sizes.
+#
+#   python3 -m benchmarks.tlru_bench [--sizes 10000 100000 1000000]
+from Tlru import TLRU_Table
+from time import time, sleep, perf_counter
+import argparse
+import random
+
+
+def bench(size, ops):
+    table = TLRU_Table(size)
+    now = time()
+    names = [f"name_{i}" for i in range(size)]
+    ttus = [now + 3600 + random.random() * 3600 for _ in range(size)]
+
+    start = perf_counter()
+    for n, t in zip(names, ttus):
+        table.add(n, 1, t)
+    add_cost = (perf_counter() - start) / size
+
+    sample = random.choices(names, k=ops)
+    start = perf_counter()
+    for n in sample:
+        table.contains(n)
+    contains_cost = (perf_counter() - start) / ops
+
+    start = perf_counter()
+    for n in sample:
+        table.get(n)
+    get_cost = (perf_counter() - start) / ops
+
+    # Let a tenth of the entries expire and measure the amortised cost of the
+    # lookups that pay for evicting them
+    table = TLRU_Table(size)
+    for i, n in enumerate(names):
+        table.add(n, 1, time() + 0.2 if i % 10 == 0 else ttus[i])
+    sleep(0.3)
+    start = perf_counter()
+    for n in sample:
+        table.contains(n)
+    expire_cost = (perf_counter() - start) / ops
+
+    return add_cost, contains_cost, get_cost, expire_cost
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', help='Table sizes to benchmark', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--ops', help='Lookups per size', type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{'entries':>10} {'add':>10} {'contains':>10} {'get':>10} {'expiry':>10}   (us/op)")
+    for size in args.sizes:
+        costs = bench(size, args.ops)
+        print(f"{size:>10} " + " ".join(f"{c * 1e6:>10.3f}" for c in costs))
+
+
+if __name__ == "__main__":
+    main()
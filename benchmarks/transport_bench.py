@@ -0,0 +1,82 @@
+# Fetch throughput of a producer/consumer pair on each backend. Each round the
+# consumer fetches all 8 readings of the producer's city at once.
+#
+#   python3 -m benchmarks.transport_bench [--rounds 500] [--backends asyncio twisted]
+#                                         [--logging-level 20 [--log-queue] [--log-sample 100]] 2> log
+from Node import Node, SENSOR_TYPES
+from IPNode import SearchConfig
+from Transport import AsyncioBackend, TwistedBackend, BACKENDS, ASYNCIO, TWISTED
+from Logs import setupLogging
+from twisted.internet import defer, reactor, task
+from time import perf_counter
+import argparse
+import asyncio
+import logging
+import os
+
+NAMES = ['dublin' + suffix for suffix in SENSOR_TYPES]
+SETTLE = 2
+# Keys both nodes encrypt and sign DATA with
+DATA_KEY = os.urandom(32)
+MAC_KEY = os.urandom(32)
+
+
+def startNode(backend, name, port, city):
+    config = SearchConfig(['127.0.0.1'], port - 1, port)
+    return Node(name, port, city, search_config=config, backend=backend, data_key=DATA_KEY, mac_key=MAC_KEY)
+
+
+def report(backend, rounds, elapsed):
+    fetches = rounds * len(NAMES)
+    print(f"{backend:<8} {fetches:>8} {elapsed:>9.2f}s {fetches / elapsed:>10.0f}/s")
+
+
+async def runAsyncio(rounds, base_port):
+    # The producer must have given up searching before the consumer announces itself
+    backend = AsyncioBackend()
+    startNode(backend, 'Bench1', base_port + 1, 'dublin')
+    await asyncio.sleep(SETTLE)
+    consumer = startNode(backend, 'Bench2', base_port + 2, None)
+    await asyncio.sleep(SETTLE)
+    start = perf_counter()
+    for _ in range(rounds):
+        await asyncio.gather(*[consumer.fetch(n) for n in NAMES])
+    report(ASYNCIO, rounds, perf_counter() - start)
+
+
+async def runTwisted(rounds, base_port):
+    backend = TwistedBackend()
+    startNode(backend, 'Bench1', base_port + 1, 'dublin')
+    await task.deferLater(reactor, SETTLE, lambda: None)
+    consumer = startNode(backend, 'Bench2', base_port + 2, None)
+    await task.deferLater(reactor, SETTLE, lambda: None)
+    start = perf_counter()
+    for _ in range(rounds):
+        await defer.gatherResults([consumer.fetch(n) for n in NAMES], consumeErrors=True)
+    report(TWISTED, rounds, perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', help='Rounds of 8 concurrent fetches', type=int, default=500)
+    parser.add_argument('--backends', help='Backends to compare', choices=BACKENDS, nargs='+', default=BACKENDS)
+    parser.add_argument('--port', help='First of the ports to use', type=int, default=33110)
+    parser.add_argument('--logging-level', help='Logging level of both nodes', type=int, default=logging.ERROR)
+    parser.add_argument('--log-queue', help='Write logs from a background thread', action='store_true')
+    parser.add_argument('--log-sample', help='Keep one in this many per-message logs', type=int, default=1)
+    args = parser.parse_args()
+    setupLogging(args.logging_level, 'bench', args.log_queue, args.log_sample)
+
+    print(f"{'backend':<8} {'fetches':>8} {'time':>10} {'rate':>12}")
+    # The Twisted reactor cannot be restarted, so it runs last
+    if ASYNCIO in args.backends:
+        asyncio.run(runAsyncio(args.rounds, args.port))
+    if TWISTED in args.backends:
+        d = defer.ensureDeferred(runTwisted(args.rounds, args.port + 10))
+        d.addErrback(lambda e: print(e))
+        d.addBoth(lambda _: reactor.stop())
+        reactor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 #!/bin/sh
+# Every node encrypts, signs and checks DATA with the same keys; fresh ones per run unless set
+export ICN_DATA_KEY="${ICN_DATA_KEY:-$(head -c 24 /dev/urandom | base64)}"
+export ICN_MAC_KEY="${ICN_MAC_KEY:-$(head -c 24 /dev/urandom | base64)}"
+
 python3 Node.py --node-name Pi1 --port 33011 --data-n dublin &
 
-sleep 8
+sleep 2
 
 python3 Node.py --node-name Pi2 --port 33012 --data-n beijing &
 
@@ -0,0 +1,28 @@
+import json
+
+from Codec import FrameDecoder, encodeTLV, decodeTLV
+
+ACK = json.dumps({'id': 'b', 'type': 'ACKNOWLEDGE', 'content': {}, 'ttl': 1}).encode()
+NON_ASCII = json.dumps({'id': 'a', 'type': 'DATA', 'content': {'x': 'é'}, 'ttl': 1}, ensure_ascii=False).encode()
+
+
+def test_legacy_non_ascii_leaves_no_bytes_behind():
+    decoder = FrameDecoder()
+    assert decoder.feed(NON_ASCII)[0]['content'] == {'x': 'é'}
+    assert decoder.buffer == b''
+    assert decoder.feed(ACK)[0]['type'] == 'ACKNOWLEDGE'
+
+
+def test_legacy_character_split_across_reads():
+    decoder = FrameDecoder()
+    data = NON_ASCII + ACK
+    split = data.index('é'.encode()) + 1
+    assert decoder.feed(data[:split]) == []
+    assert [m['id'] for m in decoder.feed(data[split:])] == ['a', 'b']
+    assert decoder.buffer == b''
+
+
+def test_ints_beyond_64_bits_round_trip():
+    msg = {'id': 'a', 'type': 'REQUEST', 'content': {'nonce': 2 ** 64, 'ttw': -2 ** 63}, 'ttl': 1}
+    encoded = bytes(encodeTLV(msg))
+    assert decodeTLV(memoryview(encoded), 0, len(encoded))['content'] == msg['content']
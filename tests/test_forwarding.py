@@ -0,0 +1,71 @@
+from ICNProtocol import REQUEST, FAIL, DATA, REASON, DUPLICATE, PARTIAL, NO_ADDR
+from Simulator import SimNetwork
+
+NAME = 'dublin_temp'
+
+
+# Network of nodes linked to the first, whose sent messages are recorded
+# (and not delivered) as (type, destination, content)
+def makeNetwork(*names):
+    net = SimNetwork(seed=1)
+    for name in names:
+        net.addNode(name)
+    for name in names[1:]:
+        net.link(names[0], name)
+    sent = []
+    node = net.nodes[names[0]]
+    node.icn.ip_node.sendMsg = lambda msg, dest, connection=None: sent.append((msg['type'], dest, msg['content']))
+    return net, node, sent
+
+
+def sentTo(sent, msg_type):
+    return sorted(dest for t, dest, content in sent if t == msg_type)
+
+
+def test_aggregated_request_is_answered_on_every_face():
+    net, node, sent = makeNetwork('B', 'A', 'C', 'D')
+    node.icn.accept_unsigned = True
+    ttw = net.clock.seconds() + 10
+    node.icn.handleRequest('A', NAME, ttw, 5, nonce=1)
+    assert sentTo(sent, REQUEST) == ['C', 'D']
+    node.icn.handleRequest('F', NAME, ttw, 5, nonce=2)
+    assert sentTo(sent, REQUEST) == ['C', 'D']
+    assert node.PIT.aggregated == 1
+    node.icn.handleData('C', NAME, 'value', ttw, NO_ADDR)
+    assert sentTo(sent, DATA) == ['A', 'F']
+    assert not node.hasPITEntry(NAME)
+
+
+def test_copy_of_pending_request_fails_as_duplicate():
+    net, node, sent = makeNetwork('B', 'A', 'C', 'D')
+    ttw = net.clock.seconds() + 10
+    node.icn.handleRequest('A', NAME, ttw, 5, nonce=1)
+    # The same request coming back from C by another path
+    node.icn.handleRequest('C', NAME, ttw, 4, nonce=1)
+    fails = [(dest, content) for t, dest, content in sent if t == FAIL]
+    assert fails == [('C', {'data_name': NAME, REASON: DUPLICATE})]
+    assert node.PIT.duplicates == 1
+    assert node.PIT.forwardedFor(NAME) == {'A'}
+
+
+def test_partial_fail_retries_instead_of_failing():
+    net, node, sent = makeNetwork('A', 'B')
+    failed = []
+    node.failData = lambda data_name, *args: failed.append(data_name)
+    node.requestData(NAME)
+    assert sentTo(sent, REQUEST) == ['B']
+    node.icn.handleFail('B', NAME, PARTIAL)
+    assert failed == []
+    assert NAME in node.retransmissions
+    # Sent again on the retransmission timer
+    net.clock.run(until=node.retransmissions[NAME][0].time)
+    assert sentTo(sent, REQUEST) == ['B', 'B']
+
+
+def test_final_fail_fails_the_request():
+    net, node, sent = makeNetwork('A', 'B')
+    failed = []
+    node.failData = lambda data_name, *args: failed.append(data_name)
+    node.requestData(NAME)
+    node.icn.handleFail('B', NAME)
+    assert failed == [NAME]
@@ -0,0 +1,31 @@
+from Simulator import SimNetwork
+
+
+def makeNode():
+    net = SimNetwork(seed=1)
+    return net.addNode('A')
+
+
+def test_remove_location_drops_prefix_route_to_same_hop():
+    node = makeNode()
+    node.addLocation('dublin_temperature', 'N1')
+    assert node.removeLocation('dublin_temperature') == ('N1', 0)
+    assert node.getLocation('dublin_temperature') is None
+    assert node.getLocation('dublin_hum') is None
+
+
+def test_remove_location_keeps_prefix_route_to_other_hop():
+    node = makeNode()
+    node.addLocation('dublin_hum', 'N2')
+    node.locations.add('dublin_temperature', 'N1')
+    node.removeLocation('dublin_temperature')
+    assert node.getLocation('dublin_temperature') == 'N2'
+    assert node.getLocation('dublin_hum') == 'N2'
+
+
+def test_remove_location_of_prefix_route_only():
+    node = makeNode()
+    node.addLocation('dublin_hum', 'N1')
+    node.locations.remove('dublin_hum')
+    assert node.removeLocation('dublin_temp') == ('N1', 0)
+    assert node.getLocation('dublin_temp') is None
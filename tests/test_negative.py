@@ -0,0 +1,30 @@
+from NegativeCache import NegativeCache as Negative, PREFIX_FAILURES
+from Tlru import HEAP_COMPACT_FACTOR
+
+
+def test_data_clears_name_and_prefix_entries_only():
+    cache = Negative(64)
+    cache.add('dublin_temp', ['A', 'B'], 5)
+    cache.add('doha_temp', ['A'], 5)
+    assert cache.contains('dublin_temp', 'A', 5)
+    cache.clear('dublin_temp')
+    assert not cache.contains('dublin_temp', 'A', 5)
+    assert not cache.contains('dublin_temp', 'B', 5)
+    assert not cache.failures.contains((('dublin',), 'A'))
+    assert cache.contains('doha_temp', 'A', 5)
+
+
+def test_data_clears_a_missing_prefix():
+    cache = Negative(64)
+    for kind in ['temp', 'hum', 'wind'][:PREFIX_FAILURES]:
+        cache.add(f'nowhere_{kind}', ['A'], 5)
+    assert cache.contains('nowhere_snow', 'A', 5)
+    cache.clear('nowhere_snow')
+    assert not cache.contains('nowhere_snow', 'A', 5)
+
+
+def test_index_is_rebuilt_once_entries_are_gone():
+    cache = Negative(4)
+    for i in range(100):
+        cache.add(f'city{i}_temp', ['A'], 5)
+    assert len(cache.faces) <= HEAP_COMPACT_FACTOR * (len(cache.entries) + len(cache.failures)) + 16
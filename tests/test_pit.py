@@ -0,0 +1,45 @@
+import Pit
+from Pit import PIT
+
+
+def test_count_includes_faces_yet_to_answer_an_earlier_send():
+    pit = PIT(8)
+    ttw = Pit.time() + 10
+    assert pit.addFace('dublin_temp', 'A', ttw, count=2)
+    pit.sent('dublin_temp', 'C', 1, 5)
+    pit.sent('dublin_temp', 'D', 1, 5)
+    # Retransmitted to both faces while neither has answered
+    pit.addFace('dublin_temp', 'A', ttw, count=2)
+    assert pit.counts['dublin_temp'] == 4
+    pit.sent('dublin_temp', 'C', 2, 5)
+    pit.sent('dublin_temp', 'D', 2, 5)
+    assert pit.counts['dublin_temp'] == 2
+
+
+def test_count_reaches_zero_once_every_face_fails():
+    pit = PIT(8)
+    ttw = Pit.time() + 10
+    pit.addFace('dublin_temp', 'A', ttw, count=2)
+    pit.sent('dublin_temp', 'C', 1, 5)
+    pit.sent('dublin_temp', 'D', 1, 5)
+    pit.addFace('dublin_temp', 'A', ttw, count=1)
+    pit.sent('dublin_temp', 'C', 2, 5)
+    assert pit.answered('dublin_temp', 'C') == (2, True)
+    faces, count = pit.removeCount('dublin_temp')
+    assert count == 1
+    assert pit.answered('dublin_temp', 'D') == (1, False)
+    faces, count = pit.removeCount('dublin_temp')
+    assert count == 0
+    assert faces == ['A']
+    assert not pit.contains('dublin_temp')
+
+
+def test_joined_face_leaves_count_unchanged():
+    pit = PIT(8)
+    ttw = Pit.time() + 10
+    pit.addFace('dublin_temp', 'A', ttw, count=2, nonce=1)
+    pit.aggregate('dublin_temp', 'F', ttw, nonce=2)
+    assert pit.counts['dublin_temp'] == 2
+    assert pit.forwardedFor('dublin_temp') == {'A'}
+    assert pit.seen('dublin_temp', 2)
+    assert pit.aggregated == 1
@@ -0,0 +1,28 @@
+import Subscriptions
+from Subscriptions import SubscriptionTable
+
+
+def test_leases_expire_and_renewals_keep_them(monkeypatch):
+    table = SubscriptionTable(64)
+    now = Subscriptions.time()
+    assert table.subscribe('dublin_*', 'A', now + 1) == (True, True)
+    table.subscribe('dublin_*', 'B', now + 1)
+    # B renews before its first lease runs out
+    table.subscribe('dublin_*', 'B', now + 100)
+    table.subscribe('doha_temp', 'C', now + 1)
+    assert table.faces('dublin_temp', now + 1) == {'A', 'B'}
+    monkeypatch.setattr(Subscriptions, 'time', lambda: now + 2)
+    table.expire()
+    assert list(table.patterns) == [('dublin', '*')]
+    assert table.patterns[('dublin', '*')] == {'B': now + 100}
+    assert 'doha_temp' not in table.upstream
+    assert 'dublin_temp' not in table.delivered
+
+
+def test_stale_heap_records_are_compacted():
+    table = SubscriptionTable(64)
+    now = Subscriptions.time()
+    for i in range(1000):
+        table.subscribe('dublin_*', 'A', now + 10 + i)
+    assert len(table.expiry) <= table.compact_at
+    assert len(table.expiry) < 100